@@ -1,10 +1,12 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import re
 import datetime
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
+from china_bean_importers.dedup import is_overlap
 from china_bean_importers.importer import PdfImporter
 
 
@@ -96,13 +98,13 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         memo_idx = 8
 
     # 解析金额（带 +/- 符号）
-    amount_str = parts[amount_idx].strip().replace("+", "").replace(",", "")
-    if not amount_str or amount_str == "--":
+    amount_str = clean_value(parts[amount_idx])
+    if not amount_str:
         return None
 
     try:
-        units = amount.Amount(D(amount_str), "CNY")
-    except:
+        cents = parse_cents(amount_str)
+    except ValueError:
         return None
 
     # 解析摘要
@@ -157,16 +159,20 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
     # 黑名单检查（过滤支付宝、微信等重复流水）
     if in_blacklist(config, narration):
         print(
-            f"Item in blacklist: {txn_date} {narration} [{units}]",
+            f"Item in blacklist: {txn_date} {narration} [{format_cents(cents)} CNY]",
             file=sys.stderr,
             end=" -- ",
         )
-        if units.number < 0:
+        if cents < 0:
             print(f"Expense skipped", file=sys.stderr)
             return None
         else:
             print(f"Income kept in record", file=sys.stderr)
 
+    # 重叠导出中已导入过的交易直接跳过，只有通过上面过滤的交易才占用日志号
+    if is_overlap(card_acc, log_str, file.name):
+        return None
+
     # 匹配目标账户
     if m := match_destination_and_metadata(config, narration, payee):
         (account2, new_meta, new_tags) = m
@@ -174,7 +180,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         tags = tags.union(new_tags)
 
     if account2 is None:
-        account2 = unknown_account(config, units.number < 0)
+        account2 = unknown_account(config, cents < 0)
 
     # 处理转账（识别自己的卡号）
     if payee == real_name and payee_account:
@@ -199,7 +205,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         postings=[
             data.Posting(
                 account=card_acc,
-                units=units,
+                units=cents_amount(cents, "CNY"),
                 cost=None,
                 price=None,
                 flag=None,
@@ -227,10 +233,22 @@ class Importer(PdfImporter):
         self.file_account_name = "abc_debit_card"
         # 列偏移量：根据 PDF 实际坐标分析得出
         self.column_offsets = [50, 95, 135, 175, 215, 255, 305, 350, 390]
+        # 表头各列，用于按表头位置校准列偏移量
+        self.column_headers = [
+            "交易日期",
+            "交易时间",
+            "交易摘要",
+            "交易金额",
+            "本次余额",
+            "对手信息",
+            "日志号",
+            "交易渠道",
+            "交易附言",
+        ]
         self.content_start_keyword = "交易日期"
         self.content_end_regex = re.compile(r"该交易明细")
 
-    def parse_metadata(self, file):
+    def parse_metadata(self, ctx):
         """
         解析 PDF 元数据
 
@@ -240,36 +258,36 @@ class Importer(PdfImporter):
         - 起止日期
         """
         # 提取户名
-        match = re.search(r"户名：(\w+)", self.full_content)
+        match = re.search(r"户名：(\w+)", ctx.full_content)
         assert match, "无法找到户名"
-        self.real_name = match[1]
+        ctx.real_name = match[1]
 
         # 提取账号（19位）
-        match = re.search(r"账户：([0-9]{19})", self.full_content)
+        match = re.search(r"账户：([0-9]{19})", ctx.full_content)
         assert match, "无法找到账号"
         card_number = match[1]
 
         # 查找对应账户
-        self.card_acc = find_account_by_card_number(self.config, card_number[-4:])
+        ctx.card_acc = find_account_by_card_number(self.config, card_number[-4:])
         my_assert(
-            self.card_acc,
+            ctx.card_acc,
             f"Unknown card number {card_number}, 请在 config.py 的 card_accounts 中配置",
             0,
             0
         )
 
         # 提取起止日期
-        match = re.search(r"起止日期：(\d{8})-(\d{8})", self.full_content)
+        match = re.search(r"起止日期：(\d{8})-(\d{8})", ctx.full_content)
         if match:
-            self.start = datetime.datetime.strptime(match[1], "%Y%m%d").date()
-            self.end = datetime.datetime.strptime(match[2], "%Y%m%d").date()
+            ctx.start = datetime.datetime.strptime(match[1], "%Y%m%d").date()
+            ctx.end = datetime.datetime.strptime(match[2], "%Y%m%d").date()
         else:
             # 备用方案：从内容中提取日期
-            self.start = None
-            self.end = None
+            ctx.start = None
+            ctx.end = None
 
-    def generate_tx(self, row, lineno, file):
+    def generate_tx(self, row, lineno, ctx):
         """生成交易记录"""
         return gen_txn(
-            self.config, file, row, lineno, self.FLAG, self.card_acc, self.real_name
+            self.config, ctx.file, row, lineno, self.FLAG, ctx.card_acc, ctx.real_name
         )
@@ -1,11 +1,15 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
-import csv
+import functools
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, to_decimal
+from china_bean_importers.columnar import TableSpec, convert_table, read_table
+from china_bean_importers.dedup import is_overlap
 from china_bean_importers.importer import CsvImporter
+from china_bean_importers.pending import PendingTransaction
 
 
 class Importer(CsvImporter):
@@ -14,191 +18,254 @@ class Importer(CsvImporter):
         self.encoding = "gbk"
         self.match_keywords = ["支付宝", "电子客户回单"]
         self.file_account_name = "alipay_mobile"
+        self.table_spec = TableSpec(
+            header=["交易时间", "交易分类"],
+            roles={0: "datetime", 6: "amount"},
+            min_columns=13,
+            end_prefix="------",
+        )
 
-    def parse_metadata(self, file):
-        if m := re.search(r"起始时间：\[([0-9 :-]+)\]", self.full_content):
-            self.start = parse(m[1])
-        if m := re.search(r"终止时间：\[([0-9 :-]+)\]", self.full_content):
-            self.end = parse(m[1])
+    def parse_metadata(self, ctx):
+        if m := re.search(r"起始时间：\[([0-9 :-]+)\]", ctx.full_content):
+            ctx.start = parse(m[1])
+        if m := re.search(r"终止时间：\[([0-9 :-]+)\]", ctx.full_content):
+            ctx.end = parse(m[1])
 
-    def extract(self, file, existing_entries=None):
+    def extract_entries(self, ctx, existing_entries=None):
         entries = []
-        begin = False
+        table = read_table(ctx.content, self.table_spec)
+        table = convert_table(table, self.table_spec)
+        source_account = self.config["importers"]["alipay"]["account"]
 
-        for lineno, row in enumerate(csv.reader(self.content)):
-            row = [col.strip() for col in row]
-            if len(row) <= 12:
+        #   0        1        2        3       4       5     6       7        8          9       10      11
+        # 交易时间, 交易分类, 交易对方, 对方账号, 商品说明, 收/支, 金额, 收付款方式, 交易状态, 交易订单号, 商家订单号, 备注
+        rows = []
+        # rows classified by the rules
+        todo = []
+        for lineno, row, raw in table.rows():
+            # parse some basic info
+            time, _, payee, _, narration, direction, cents, method, status, serial = row[:10]
+
+            # 跳过已关闭状态的交易，避免导入无效交易
+            # 包括：交易关闭、支付关闭、订单关闭、退款关闭等
+            closed_statuses = ["交易关闭", "支付关闭", "订单关闭", "退款关闭", "已关闭"]
+            if status in closed_statuses or "关闭" in status:
                 continue
-            #   0        1        2        3       4       5     6       7        8          9       10      11
-            # 交易时间, 交易分类, 交易对方, 对方账号, 商品说明, 收/支, 金额, 收付款方式, 交易状态, 交易订单号, 商家订单号, 备注
-
-            if row[0] == "交易时间" and row[1] == "交易分类":
-                # skip table header
-                begin = True
-            elif begin and row[0].startswith("------"):
-                # end of data
-                break
-            elif begin:
-                # parse data line
-                metadata: dict = data.new_metadata(file.name, lineno)
-                tags = {"PendingReview"}
-
-                # parse some basic info
-                (
-                    time,
-                    category,
-                    payee,
-                    payee_account,
-                    narration,
-                    direction,
-                    amt,
-                    method,
-                    status,
-                    serial,
-                ) = row[:10]
-                time = parse(time)
-                units = amount.Amount(D(amt), "CNY")
-                metadata["serial"] = serial
-                metadata["status"] = status
-
-                # 跳过已关闭状态的交易，避免导入无效交易
-                # 包括：交易关闭、支付关闭、订单关闭、退款关闭等
-                closed_statuses = ["交易关闭", "支付关闭", "订单关闭", "退款关闭", "已关闭"]
-                if status in closed_statuses or "关闭" in status:
-                    continue
-
-                # fill metadata
-                if payee_account != "":
-                    metadata["payee_account"] = payee_account
-                metadata["imported_category"] = category
-                metadata["payment_method"] = "支付宝"
-                metadata["time"] = time.time().isoformat()
-                if category == "亲友代付" or "亲情卡" in narration:
-                    tags.add("family-card")
-
-                expense = None
-                # determine direction
-                if direction == "支出":
+
+            expense = None
+            direction_tags = ()
+            # determine direction
+            if direction == "支出":
+                expense = True
+            elif direction == "收入":
+                expense = False
+            elif direction == "其他" or direction == "不计收支":
+                if "退款" in narration or "退款成功" in status:
+                    expense = False
+                    direction_tags = ("refund",)
+                if method == "余额宝" and "收益" in narration:
+                    expense = False
+                if payee == "余额宝" and "转入" in narration:
                     expense = True
-                elif direction == "收入":
+                if method == "花呗" and "还款" in narration:
+                    expense = True
+                if payee == "花呗" and "还款" in narration:
+                    expense = True
+                if narration == "余额宝-转出到余额":
                     expense = False
-                elif direction == "其他" or direction == "不计收支":
-                    if "退款" in narration or "退款成功" in status:
-                        expense = False
-                        tags.add("refund")
-                    if method == "余额宝" and "收益" in narration:
-                        expense = False
-                    if payee == "余额宝" and "转入" in narration:
-                        expense = True
-                    if method == "花呗" and "还款" in narration:
-                        expense = True
-                    if payee == "花呗" and "还款" in narration:
-                        expense = True
-                    if narration == "余额宝-转出到余额":
-                        expense = False
-                    if narration == "余额宝-单次转入":
-                        expense = True
-                    if expense is None:
-                        # if '交易关闭' in status or '解冻成功' in status:
-                        my_warn(
-                            f"Transaction type not recognized, please confirm",
-                            lineno,
-                            row,
-                        )
-                        expense = True
-                        tags.add("confirmation-needed")
-
-                my_assert(expense is not None, f"Unknown transaction type", lineno, row)
-
-                # determine sign of amount
-                if expense:
-                    units = -units
-
-                # find source from 收付款方式
-                # TODO: handle 红包 & 余额宝转入
-                source_config = self.config["importers"]["alipay"]
-                account1 = source_config["account"]  # 支付宝余额
-                if "花呗" in method: # Handle discount transactions like "花呗&红包"
-                    account1 = source_config["huabei_account"]
-                elif method == "余额宝":
-                    account1 = source_config["yuebao_account"]
-                elif tail := match_card_tail(method):
-                    account1 = find_account_by_card_number(self.config, tail)
-                    my_assert(account1, f"Unknown card number {tail}", lineno, row)
-
-                # find from 商品说明 and 交易对方
-                account2 = None
-                if payee == "余额宝" and "自动转入" in narration:
-                    account2 = source_config["yuebao_account"]
-                elif method == "余额" and narration == "余额宝-转出到余额":
-                    account2 = source_config["yuebao_account"]
-                elif narration == "余额宝-单次转入":
-                    account2 = source_config["yuebao_account"]
-                elif category == "转账红包":
-                    account2 = (
-                        source_config["red_packet_income_account"]
-                        if not expense
-                        else source_config["red_packet_expense_account"]
-                    )
-                elif expense and category == "信用借还":
-                    if "还款" in narration and "花呗" in payee:
-                        account2 = source_config["huabei_account"]
-                    elif "抖音月付" in narration:
-                        account2 = source_config["douyin_monthly_payment_account"]
-                else:
-                    new_account, new_meta, new_tags = match_destination_and_metadata(
-                        self.config, narration, payee, expense=expense
-                    )
-                    if new_account:
-                        account2 = new_account
-                    metadata.update(new_meta)
-                    tags = tags.union(new_tags)
-                # then try category
-                if account2 is None:
-                    if category in source_config["category_mapping"]:
-                        account2 = source_config["category_mapping"][category]
-                    else:
-                        account2 = unknown_account(self.config, expense)
-
-                if "&" in method:
+                if narration == "余额宝-单次转入":
+                    expense = True
+                if expense is None:
+                    # if '交易关闭' in status or '解冻成功' in status:
                     my_warn(
-                        f"Multiple payment methods found, please confirm", lineno, row
+                        f"Transaction type not recognized, please confirm",
+                        lineno,
+                        raw,
                     )
-                    tags.add("confirmation-needed")
+                    expense = True
+                    direction_tags += ("confirmation-needed",)
+
+            my_assert(expense is not None, f"Unknown transaction type", lineno, raw)
+
+            # determine sign of amount
+            if expense:
+                cents = -cents
+
+            # find source from 收付款方式
+            # TODO: handle 红包 & 余额宝转入
+            source_config = self.config["importers"]["alipay"]
+            account1 = source_config["account"]  # 支付宝余额
+            if "花呗" in method: # Handle discount transactions like "花呗&红包"
+                account1 = source_config["huabei_account"]
+            elif method == "余额宝":
+                account1 = source_config["yuebao_account"]
+            elif tail := match_card_tail(method):
+                account1 = find_account_by_card_number(self.config, tail)
+                my_assert(account1, f"Unknown card number {tail}", lineno, raw)
 
-                # check status and add warning if needed
-                if "成功" not in status:
-                    my_warn(f"Transaction not successful, please confirm", lineno, row)
-                    tags.add("confirmation-needed")
+            # skip rows already imported from an overlapping export, before
+            # classifying them. Only rows kept by the filters above claim
+            # their serial
+            if is_overlap(source_account, serial, ctx.file.name):
+                continue
+
+            account2, classify = self.fixed_account(row, expense)
+            rows.append(
+                (lineno, row, raw, expense, cents, account1, direction_tags, account2)
+            )
+            if classify:
+                todo.append(len(rows) - 1)
 
-                # create transaction
-                txn = data.Transaction(
-                    meta=metadata,
+        # classify the rows without a fixed account at once, repeated
+        # narrations and payees are matched only once
+        matches = [None] * len(rows)
+        results = match_destination_and_metadata_batch(
+            self.config,
+            [rows[i][1][4] for i in todo],
+            [rows[i][1][2] for i in todo],
+            expenses=[rows[i][3] for i in todo],
+            amounts=[to_decimal(rows[i][4]) for i in todo],
+            times=[rows[i][1][0] for i in todo],
+        )
+        for i, match in zip(todo, results):
+            matches[i] = match
+
+        for r, match in zip(rows, matches):
+            time, serial = r[1][0], r[1][9]
+            # the transaction is built only if the row is not a duplicate
+            entries.append(
+                PendingTransaction(
                     date=time.date(),
-                    flag=self.FLAG,
-                    payee=payee,
-                    narration=narration,
-                    tags=tags,
-                    links=data.EMPTY_SET,
-                    postings=[
-                        data.Posting(
-                            account=account1,
-                            units=units,
-                            cost=None,
-                            price=None,
-                            flag=None,
-                            meta=None,
-                        ),
-                        data.Posting(
-                            account=account2,
-                            units=None,
-                            cost=None,
-                            price=None,
-                            flag=None,
-                            meta=None,
-                        ),
-                    ],
+                    time=time.time().isoformat(),
+                    account=r[5],
+                    cents=r[4],
+                    currency="CNY",
+                    txid=("serial", serial) if serial else None,
+                    build=functools.partial(self.build_entry, ctx, *r, match),
                 )
-                entries.append(txn)
+            )
 
         return entries
+
+    def fixed_account(self, row, expense):
+        # account given by the kind of transaction, and whether the rules
+        # should be matched
+        _, category, payee, _, narration, _, _, method = row[:8]
+        source_config = self.config["importers"]["alipay"]
+
+        # find from 商品说明 and 交易对方
+        if payee == "余额宝" and "自动转入" in narration:
+            return source_config["yuebao_account"], False
+        elif method == "余额" and narration == "余额宝-转出到余额":
+            return source_config["yuebao_account"], False
+        elif narration == "余额宝-单次转入":
+            return source_config["yuebao_account"], False
+        elif category == "转账红包":
+            return (
+                source_config["red_packet_income_account"]
+                if not expense
+                else source_config["red_packet_expense_account"]
+            ), False
+        elif expense and category == "信用借还":
+            if "还款" in narration and "花呗" in payee:
+                return source_config["huabei_account"], False
+            elif "抖音月付" in narration:
+                return source_config["douyin_monthly_payment_account"], False
+            return None, False
+        return None, True
+
+    def build_entry(
+        self,
+        ctx,
+        lineno,
+        row,
+        raw,
+        expense,
+        cents,
+        account1,
+        direction_tags,
+        account2,
+        match,
+    ):
+        (
+            time,
+            category,
+            payee,
+            payee_account,
+            narration,
+            _,
+            _,
+            method,
+            status,
+            serial,
+        ) = row[:10]
+
+        # parse data line
+        metadata: dict = data.new_metadata(ctx.file.name, lineno)
+        tags = {"PendingReview", *direction_tags}
+        metadata["serial"] = serial
+        metadata["status"] = status
+
+        # fill metadata
+        if payee_account != "":
+            metadata["payee_account"] = payee_account
+        metadata["imported_category"] = category
+        metadata["payment_method"] = "支付宝"
+        metadata["time"] = time.time().isoformat()
+        if category == "亲友代付" or "亲情卡" in narration:
+            tags.add("family-card")
+
+        source_config = self.config["importers"]["alipay"]
+
+        if match is not None:
+            new_account, new_meta, new_tags = match
+            if new_account:
+                account2 = new_account
+            metadata.update(new_meta)
+            tags = tags.union(new_tags)
+        # then try category
+        if account2 is None:
+            if category in source_config["category_mapping"]:
+                account2 = source_config["category_mapping"][category]
+            else:
+                account2 = unknown_account(self.config, expense)
+
+        if "&" in method:
+            my_warn(
+                f"Multiple payment methods found, please confirm", lineno, raw
+            )
+            tags.add("confirmation-needed")
+
+        # check status and add warning if needed
+        if "成功" not in status:
+            my_warn(f"Transaction not successful, please confirm", lineno, raw)
+            tags.add("confirmation-needed")
+
+        # create transaction
+        return data.Transaction(
+            meta=metadata,
+            date=time.date(),
+            flag=self.FLAG,
+            payee=payee,
+            narration=narration,
+            tags=tags,
+            links=data.EMPTY_SET,
+            postings=[
+                data.Posting(
+                    account=account1,
+                    units=cents_amount(cents, "CNY"),
+                    cost=None,
+                    price=None,
+                    flag=None,
+                    meta=None,
+                ),
+                data.Posting(
+                    account=account2,
+                    units=None,
+                    cost=None,
+                    price=None,
+                    flag=None,
+                    meta=None,
+                ),
+            ],
+        )
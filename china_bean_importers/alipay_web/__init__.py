@@ -19,7 +19,7 @@ class Importer(importer.ImporterProtocol):
     def file_account(self, file):
         return "alipay_web"
 
-    def file_date(self, file):
+    def file_date(self, file, context=None):
         with open(file.name, "r", encoding="gbk") as f:
             for row in csv.reader(f):
                 m = re.search(r"起始日期:\[([0-9 :-]+)\]", row[0])
@@ -28,7 +28,7 @@ class Importer(importer.ImporterProtocol):
                     return date
         return super().file_date(file)
 
-    def file_name(self, file):
+    def file_name(self, file, context=None):
         with open(file.name, "r", encoding="gbk") as f:
             for row in csv.reader(f):
                 m = re.search(r"终止日期:\[([0-9 :-]+)\]", row[0])
@@ -37,7 +37,8 @@ class Importer(importer.ImporterProtocol):
                     return "to." + date.date().isoformat() + ".txt"
         return super().file_name(file)
 
-    def extract(self, file, existing_entries=None):
+    # no per-file state is kept, the context of identify is not needed
+    def extract(self, file, existing_entries=None, context=None):
         entries = []
         begin = False
         with open(file.name, "r", encoding="gbk") as f:
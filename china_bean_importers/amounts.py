@@ -0,0 +1,73 @@
+import re
+import typing
+from decimal import Decimal
+
+from beancount.core import amount
+
+# thousands separators, currency signs and spaces
+PRINTED_PATTERN = re.compile(
+    r"([+-]?)\s*[¥￥]?\s*(\d{1,3}(?:,\d{3})+|\d+)?(?:\.(\d+))?"
+)
+# suffixes giving the direction of debit card amounts
+SIGN_SUFFIXES = {
+    "(支出)": -1,
+    "（支出）": -1,
+    "(存入)": 1,
+    "（存入）": 1,
+}
+
+
+def whole_cents(whole: str, frac: str) -> int:
+    # decimals past the cents must be zeros, as in "1.2300" of FX rows
+    if frac[2:].strip("0"):
+        raise ValueError(f"Amount {whole}.{frac} has fractions of a cent")
+    return int(whole or "0") * 100 + int(frac[:2].ljust(2, "0"))
+
+
+def parse_cents(text: str) -> int:
+    """
+    Integer cents of an amount as printed in statements: an optional sign,
+    a "¥" prefix, thousands separators, decimals (".5" included) and a
+    "(支出)"/"(存入)" suffix giving the sign. Raises ValueError otherwise,
+    or for amounts with fractions of a cent.
+    """
+    # plain decimals, the format of most exports
+    whole, dot, frac = text.partition(".")
+    digits = whole[1:] if whole[:1] in ("-", "+") else whole
+    if (digits.isdigit() or dot and not digits) and (not dot or frac.isdigit()):
+        cents = whole_cents(digits, frac)
+        return -cents if whole[:1] == "-" else cents
+
+    text = text.strip()
+    sign = 1
+    for suffix, s in SIGN_SUFFIXES.items():
+        if text.endswith(suffix):
+            text = text[: -len(suffix)].rstrip()
+            sign = s
+            break
+    if not (m := PRINTED_PATTERN.fullmatch(text)) or not (m[2] or m[3]):
+        raise ValueError(f"Invalid amount {text!r}")
+    cents = whole_cents((m[2] or "").replace(",", ""), m[3] or "")
+    return -sign * cents if m[1] == "-" else sign * cents
+
+
+def cell_cents(value) -> typing.Optional[int]:
+    # spreadsheet cells are numbers or strings, and NaN when empty
+    if value is None or str(value) == "nan":
+        return None
+    if isinstance(value, str):
+        return parse_cents(value) if value.strip() else None
+    return parse_cents(f"{value:.2f}")
+
+
+def to_decimal(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def cents_amount(cents: int, currency: str) -> amount.Amount:
+    # beancount objects are only created when building transactions
+    return amount.Amount(to_decimal(cents), currency)
+
+
+def format_cents(cents: int) -> str:
+    return f"{to_decimal(cents)}"
@@ -1,5 +1,4 @@
 from dateutil.parser import parse
-from beancount.ingest import importer
 from beancount.core import data, amount
 from beancount.core.number import D
 
@@ -7,13 +6,15 @@ import re
 import sys
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
+from china_bean_importers.pdf import DocumentText
+from china_bean_importers.importer import BaseImporter, ParseContext
 
 
-class Importer(importer.ImporterProtocol):
+class Importer(BaseImporter):
     def __init__(self, config) -> None:
-        super().__init__()
-        self.config = config
-        self.rate = None
+        super().__init__(config)
+        self.file_account_name = "boc_credit_card"
 
     def get_config(self, cfg, account, narration):
         if "importers" not in self.config:
@@ -35,22 +36,26 @@ class Importer(importer.ImporterProtocol):
     def extract_repayment_rate(self, account, narration) -> bool:
         return self.get_config("extract_repayment_rate", account, narration)
 
-    def identify(self, file):
+    def parse_file(self, file):
         if file.name.upper().endswith(".PDF"):
-            self.type = "pdf"
-
-            import fitz
-            if "中国银行信用卡" in file.name:
-                self.doc = fitz.open(file.name)
-                return True
-            elif "中国银行" in file.name:
-                doc = fitz.open(file.name)
-                if "信用卡账单" in doc[0].get_text():
-                    self.doc = doc
-                    return True
-            return False
+            ctx = ParseContext(file, "pdf")
+            ctx.type = "pdf"
+            ctx.rate = None
+
+            if "中国银行" not in file.name:
+                return False
+            with self.open_text(file) as text:
+                page = text.page(0)
+                if "中国银行信用卡" not in file.name and "信用卡账单" not in page.text():
+                    return False
+                # the statement date and the first entries are on the first
+                # page, its blocks are kept for file_date and extraction
+                ctx.first_page = page.blocks()
+            return ctx
         elif file.name.upper().endswith(".EML"):
-            self.type = "email"
+            ctx = ParseContext(file, "eml")
+            ctx.type = "email"
+            ctx.rate = None
             from bs4 import BeautifulSoup
             import email
             from email import policy
@@ -63,20 +68,32 @@ class Importer(importer.ImporterProtocol):
                 raw_body_html = quopri.decodestring(
                     raw_email.get_body().get_payload()
                 ).decode()
-                self.body = BeautifulSoup(raw_body_html, features="lxml")
-                return self.body.title.text == "中国银行电子帐单"
+                ctx.body = BeautifulSoup(raw_body_html, features="lxml")
+                if ctx.body.title.text == "中国银行电子帐单":
+                    return ctx
+                return False
             except BaseException:
                 return False
 
-    def file_account(self, file):
-        return "boc_credit_card"
+    def open_text(self, file):
+        # the document is opened on demand and closed after each use
+        import fitz
+
+        return DocumentText(fitz.open(file.name))
 
-    def file_date(self, file):
-        if self.type == "pdf":
+    def first_page(self, ctx) -> list[tuple]:
+        # blocks of the first page, read again for a context cached before
+        # they were kept
+        if getattr(ctx, "first_page", None) is None:
+            with self.open_text(ctx.file) as text:
+                ctx.first_page = text.page(0).blocks()
+        return ctx.first_page
+
+    def file_date(self, file, context=None):
+        ctx = self.get_context(file, context)
+        if ctx.type == "pdf":
             begin = False
-            page = self.doc[0]
-            text = page.get_text("blocks")
-            for x0, y0, x1, y1, content, block_no, block_type in text:
+            for x0, y0, x1, y1, content, block_no, block_type in self.first_page(ctx):
                 content = content.strip()
                 if not begin and "Current FCY Total Balance Due" in content:
                     begin = True
@@ -88,107 +105,110 @@ class Importer(importer.ImporterProtocol):
                         return parse(parts[0])
                     else:
                         break
-        elif self.type == "email":
-            info_table = self.body.select("table.bill_sum_detail_table")[0]
+        elif ctx.type == "email":
+            info_table = ctx.body.select("table.bill_sum_detail_table")[0]
             # 到期还款日 账单日 本期人民币欠款总计 本期外币欠款总计
             bill_date = info_table.find_all("td")[1].text
             return parse(bill_date)
-        return super().file_date(file)
+        return super().file_date(file, ctx)
 
-    def extract_text_entries(self):
+    def extract_text_entries(self, ctx):
         card_num_regex = re.compile(r".*\(卡号(:|：)(\d+)\)")
+        page_marker_regex = re.compile(r"(第 [0-9]+ 页/共)|([0-9]+ 页)")
         currency_regex = re.compile(r".*(\(([a-zA-Z]+)\))(\w+)?交易明细.*", flags=re.DOTALL)
 
         # collect text entries from EML / PDF
         # 货币 交易日 银行记账日 卡号后四位 交易描述 存入 支出
         text_entries = []
-        ref_rate = None
 
-        if self.type == "pdf":
+        if ctx.type == "pdf":
             card_number = None
             begin = False
             lineno = 0
 
-            for i in range(self.doc.page_count):
-                page = self.doc[i]
-                text = page.get_text("blocks")
-                for x0, y0, x1, y1, content, block_no, block_type in text:
-                    lineno += 1
-                    content = content.strip()
-                    if block_type != 0:  # 0: text, 1: image
-                        continue
-                    if re.match(r"(第 [0-9]+ 页/共)|([0-9]+ 页)", content):
-                        continue
-
-                    if m := re.match(r"参考汇率: *([0-9.]+)", content):
-                        rate = float(m.group(1))
-                        if rate == 0:
-                            rate = None
-                        elif rate > 100:
-                            rate = rate / 100
-
-                        if rate is not None:
-                            self.rate = rate
-
-                    if "人民币交易明细" in content:
-                        currency = "CNY"
-                    elif m := currency_regex.match(content):
-                        currency = m.group(2)
-                    match = card_num_regex.search(content)
-                    if match:
-                        card_number = match[2][-4:]
-                        begin = False
-                    elif card_number:
-                        if not begin and "Expenditure" in content:
-                            begin = True
-                        elif begin and (
-                            "Loyalty Plan" in content or "交易日" in content
-                        ):
+            with self.open_text(ctx.file) as text:
+                pages = itertools.chain(
+                    [self.first_page(ctx)], (page.blocks() for page in text.pages(1))
+                )
+                for blocks in pages:
+                    for x0, y0, x1, y1, content, block_no, block_type in blocks:
+                        lineno += 1
+                        content = content.strip()
+                        if block_type != 0:  # 0: text, 1: image
+                            continue
+                        # page number footers, checked on every page
+                        if page_marker_regex.match(content):
+                            continue
+
+                        if m := re.match(r"参考汇率: *([0-9.]+)", content):
+                            rate = float(m.group(1))
+                            if rate == 0:
+                                rate = None
+                            elif rate > 100:
+                                rate = rate / 100
+
+                            if rate is not None:
+                                ctx.rate = rate
+
+                        if "人民币交易明细" in content:
+                            currency = "CNY"
+                        elif m := currency_regex.match(content):
+                            currency = m.group(2)
+                        match = card_num_regex.search(content)
+                        if match:
+                            card_number = match[2][-4:]
                             begin = False
-                        elif begin:
-                            # Match date part first
-                            # card number can be empty
-                            m = re.match(
-                                r"[0-9]+-[0-9]+-[0-9]+\n[0-9]+-[0-9]+-[0-9]+(\n[0-9]+)?",
-                                content,
-                                re.MULTILINE,
-                            )
-                            if m:
-                                lines = content.split("\n")
-                                trans_date = lines[0]
-                                post_date = lines[1]
-                                description = ""
-                                # After date part matched, continue to match the rest
-                                content = content[m.end() :]
-
-                            # Description/Deposit/Expenditure
-                            description += content + "\n"
-                            done = False
-                            if x1 > 500:
-                                # Expenditure found
-                                expense = True
-                                done = True
-                            elif x1 > 400:
-                                # Deposit found
-                                expense = False
-                                done = True
-                            if done:
-                                desc_lines = description.split("\n")
-                                orig_narration = "".join(desc_lines[:-2])
-                                value = desc_lines[-2]
-                                entry = [
-                                    currency,
-                                    trans_date,
-                                    post_date,
-                                    card_number,
-                                    orig_narration,
-                                    value if not expense else "",
-                                    value if expense else "",
-                                ]
-                                text_entries.append(entry)
-
-        elif self.type == "email":
-            for lineno, card in enumerate(self.body.select("div.bill_card_detail")):
+                        elif card_number:
+                            if not begin and "Expenditure" in content:
+                                begin = True
+                            elif begin and (
+                                "Loyalty Plan" in content or "交易日" in content
+                            ):
+                                begin = False
+                            elif begin:
+                                # Match date part first
+                                # card number can be empty
+                                m = re.match(
+                                    r"[0-9]+-[0-9]+-[0-9]+\n[0-9]+-[0-9]+-[0-9]+(\n[0-9]+)?",
+                                    content,
+                                    re.MULTILINE,
+                                )
+                                if m:
+                                    lines = content.split("\n")
+                                    trans_date = lines[0]
+                                    post_date = lines[1]
+                                    description = ""
+                                    # After date part matched, continue to match the rest
+                                    content = content[m.end() :]
+
+                                # Description/Deposit/Expenditure
+                                description += content + "\n"
+                                done = False
+                                if x1 > 500:
+                                    # Expenditure found
+                                    expense = True
+                                    done = True
+                                elif x1 > 400:
+                                    # Deposit found
+                                    expense = False
+                                    done = True
+                                if done:
+                                    desc_lines = description.split("\n")
+                                    orig_narration = "".join(desc_lines[:-2])
+                                    value = desc_lines[-2]
+                                    entry = [
+                                        currency,
+                                        trans_date,
+                                        post_date,
+                                        card_number,
+                                        orig_narration,
+                                        value if not expense else "",
+                                        value if expense else "",
+                                    ]
+                                    text_entries.append(entry)
+
+        elif ctx.type == "email":
+            for lineno, card in enumerate(ctx.body.select("div.bill_card_detail")):
                 card_num = None
                 currency = None
 
@@ -237,13 +257,15 @@ class Importer(importer.ImporterProtocol):
 
         return text_entries
 
-    def extract(self, file, existing_entries=None):
+    def extract_entries(self, ctx, existing_entries=None):
 
         # generate beancount posting entries
         entries = []
 
         last_account = None
-        for lineno, entry in enumerate(self.extract_text_entries()):
+        for lineno, entry in enumerate(
+            self.cached_rows(ctx, self.extract_text_entries)
+        ):
             # print(entry, file=sys.stderr)
             # 货币 交易日 银行记账日 卡号后四位 交易描述 存入 支出
             (
@@ -261,7 +283,11 @@ class Importer(importer.ImporterProtocol):
                 my_warn(f"Empty value for entry", lineno, entry)
                 continue
 
-            units = amount.Amount(D(value), currency)
+            try:
+                cents = parse_cents(value)
+            except ValueError:
+                my_warn("Invalid amount, row skipped", lineno, entry)
+                continue
 
             if "-" in orig_narration:
                 hypen_idx = orig_narration.index("-")
@@ -273,7 +299,7 @@ class Importer(importer.ImporterProtocol):
                 narration = orig_narration
                 payee = None
 
-            metadata = data.new_metadata(file.name, lineno)
+            metadata = data.new_metadata(ctx.file.name, lineno)
             tags = {"PendingReview"}
 
             if card_number == "":
@@ -288,7 +314,7 @@ class Importer(importer.ImporterProtocol):
                 last_account = account1
 
             if expense != "":
-                units = -units
+                cents = -cents
 
             if trans_date != "":
                 date = parse(trans_date)
@@ -300,7 +326,7 @@ class Importer(importer.ImporterProtocol):
 
             if in_blacklist(self.config, orig_narration):
                 print(
-                    f"Item skipped due to blacklist: {date} {orig_narration} [{units}]",
+                    f"Item skipped due to blacklist: {date} {orig_narration} [{format_cents(cents)} {currency}]",
                     file=sys.stderr,
                 )
                 continue
@@ -319,7 +345,7 @@ class Importer(importer.ImporterProtocol):
                 if t := self.repayment_tag(account1, narration):
                     tags.add(t)
 
-                rate = self.rate
+                rate = ctx.rate
                 if m := re.search(r"汇率([0-9.]+)", narration):
                     rate = float(m.group(1))
 
@@ -348,7 +374,7 @@ class Importer(importer.ImporterProtocol):
                 postings=[
                     data.Posting(
                         account=account1,
-                        units=units,
+                        units=cents_amount(cents, currency),
                         cost=None,
                         price=price,
                         flag=None,
@@ -1,9 +1,10 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
 from china_bean_importers.importer import PdfTableImporter
 
 
@@ -28,15 +29,19 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         parts,
     )
     # parts[3]: 金额
-    units1 = amount.Amount(D(parts[3]), currency_code)
+    try:
+        cents = parse_cents(parts[3])
+    except ValueError:
+        my_warn("Invalid amount, row skipped", lineno, parts)
+        return None
     # check blacklist
     if in_blacklist(config, narration):
         print(
-            f"Item in blacklist: {date} {narration} [{units1}]",
+            f"Item in blacklist: {date} {narration} [{format_cents(cents)} {currency_code}]",
             file=sys.stderr,
             end=" -- ",
         )
-        if units1 < amount.Amount(D(0), currency_code):
+        if cents < 0:
             print(f"Expense skipped", file=sys.stderr)
             return None
         elif "退款" in parts[5]:
@@ -63,7 +68,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         metadata.update(new_meta)
         tags = tags.union(new_tags)
     if account2 is None:
-        account2 = unknown_account(config, units1.number < 0)
+        account2 = unknown_account(config, cents < 0)
 
     # Handle transfer to credit/debit cards
     # parts[9]: 对方账户名
@@ -88,7 +93,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         postings=[
             data.Posting(
                 account=card_acc,
-                units=units1,
+                units=cents_amount(cents, currency_code),
                 cost=None,
                 price=None,
                 flag=None,
@@ -114,26 +119,26 @@ class Importer(PdfTableImporter):
         self.file_account_name = "boc_debit_card"
         self.header_first_cell = "记账日期"
 
-    def parse_metadata(self, file):
+    def parse_metadata(self, ctx):
         match = re.search(
             r"交易区间：\s*([0-9]+-[0-9]+-[0-9]+)\s*至\s*([0-9]+-[0-9]+-[0-9]+)",
-            self.full_content,
+            ctx.full_content,
         )
         assert match
-        self.start = parse(match[1])
-        self.end = parse(match[2])
+        ctx.start = parse(match[1])
+        ctx.end = parse(match[2])
 
-        match = re.search(r"客户姓名：\s*(\w+)", self.full_content)
+        match = re.search(r"客户姓名：\s*(\w+)", ctx.full_content)
         assert match
-        self.real_name = match[1]
+        ctx.real_name = match[1]
 
-        match = re.search(r"[0-9]{19}", self.full_content)
+        match = re.search(r"[0-9]{19}", ctx.full_content)
         assert match
         card_number = match[0]
-        self.card_acc = find_account_by_card_number(self.config, card_number[-4:])
-        my_assert(self.card_acc, f"Unknown card number {card_number}", 0, 0)
+        ctx.card_acc = find_account_by_card_number(self.config, card_number[-4:])
+        my_assert(ctx.card_acc, f"Unknown card number {card_number}", 0, 0)
 
-    def generate_tx(self, row, lineno, file):
+    def generate_tx(self, row, lineno, ctx):
         return gen_txn(
-            self.config, file, row, lineno, self.FLAG, self.card_acc, self.real_name
+            self.config, ctx.file, row, lineno, self.FLAG, ctx.card_acc, ctx.real_name
         )
@@ -1,11 +1,12 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import re
 import os
 
 from china_bean_importers.common import *
-from china_bean_importers.importer import CsvOrXlsxImporter
+from china_bean_importers.amounts import cell_cents, cents_amount, format_cents
+from china_bean_importers.importer import CsvOrXlsxImporter, ParseContext
 
 class Importer(CsvOrXlsxImporter):
     def __init__(self, config) -> None:
@@ -13,7 +14,7 @@ class Importer(CsvOrXlsxImporter):
         self.match_keywords = ['交易时间', '业务摘要', '收入金额', '支出金额', '对方账户名称']
         self.file_account_name = "boc_debit_card_xlsx"
 
-    def identify(self, file):
+    def parse_file(self, file):
         if not file.name.endswith(".xlsx"):
             return False
         if not "中国银行" in file.name:
@@ -24,34 +25,36 @@ class Importer(CsvOrXlsxImporter):
             import pandas as pd
             df = pd.read_excel(file.name, nrows=0)
             if all(col in df.columns for col in self.match_keywords):
-                self.parse_metadata(file)
-                return True
+                ctx = ParseContext(file, "xlsx")
+                self.parse_metadata(ctx)
+                return ctx
         except Exception:
             pass
         return False
 
-    def parse_metadata(self, file):
+    def parse_metadata(self, ctx):
         # 尝试从文件名提取尾号
-        match = re.search(r"尾号(\d{4})", os.path.basename(file.name))
+        match = re.search(r"尾号(\d{4})", os.path.basename(ctx.file.name))
         if match:
             card_number = match.group(1)
-            self.card_acc = find_account_by_card_number(self.config, card_number)
+            ctx.card_acc = find_account_by_card_number(self.config, card_number)
         else:
-            self.card_acc = None
-        self.start = None
+            ctx.card_acc = None
+        ctx.start = None
 
-    def extract(self, file, existing_entries=None):
+    def extract_entries(self, ctx, existing_entries=None):
         import pandas as pd
-        df = pd.read_excel(file.name)
+        df = pd.read_excel(ctx.file.name)
         
         entries = []
         for index, row in df.iterrows():
-            txn = self.generate_tx(row.to_dict(), index, file)
+            txn = self.generate_tx(row.to_dict(), index, ctx)
             if txn:
+                self.keep_raw(ctx, index, list(row.values))
                 entries.append(txn)
         return entries
 
-    def generate_tx(self, row, lineno, file):
+    def generate_tx(self, row, lineno, ctx):
         date_raw = row.get('交易时间')
         if not date_raw or str(date_raw) == 'nan':
             return None
@@ -73,28 +76,27 @@ class Importer(CsvOrXlsxImporter):
         if remark != 'nan' and remark:
             narration = f"{summary} ({remark})"
         
-        income = row.get('收入金额')
-        expense = row.get('支出金额')
-        
         try:
-            if income and str(income) != 'nan' and float(income) != 0:
-                units1 = amount.Amount(D(str(income)), "CNY")
-            elif expense and str(expense) != 'nan' and float(expense) != 0:
-                units1 = amount.Amount(-D(str(expense)), "CNY")
-            else:
-                return None
-        except Exception:
+            income = cell_cents(row.get('收入金额'))
+            expense = cell_cents(row.get('支出金额'))
+        except ValueError:
+            return None
+        if income:
+            cents = income
+        elif expense:
+            cents = -expense
+        else:
             return None
 
         # check blacklist
         if in_blacklist(self.config, narration):
             print(
-                f"Item in blacklist: {date} {narration} [{units1}] (Skipped)",
+                f"Item in blacklist: {date} {narration} [{format_cents(cents)} CNY] (Skipped)",
                 file=sys.stderr,
             )
             return None
 
-        metadata = data.new_metadata(file.name, lineno)
+        metadata = data.new_metadata(ctx.file.name, lineno)
         if row.get('余额') and str(row.get('余额')) != 'nan':
             metadata["balance"] = str(row.get('余额'))
         
@@ -112,15 +114,15 @@ class Importer(CsvOrXlsxImporter):
 
         tags = {"PendingReview"}
         if account2 is None:
-            if m := match_destination_and_metadata(self.config, narration, payee, expense=units1.number < 0):
+            if m := match_destination_and_metadata(self.config, narration, payee, expense=cents < 0):
                 (account2, new_meta, new_tags) = m
                 metadata.update(new_meta)
                 tags = tags.union(new_tags)
         
         if account2 is None:
-            account2 = unknown_account(self.config, units1.number < 0)
+            account2 = unknown_account(self.config, cents < 0)
 
-        card_acc = self.card_acc if self.card_acc else unknown_account(self.config, units1.number > 0)
+        card_acc = ctx.card_acc if ctx.card_acc else unknown_account(self.config, cents > 0)
 
         return data.Transaction(
             meta=metadata,
@@ -131,7 +133,7 @@ class Importer(CsvOrXlsxImporter):
             tags=tags,
             links=data.EMPTY_SET,
             postings=[
-                data.Posting(card_acc, units1, None, None, None, None),
+                data.Posting(card_acc, cents_amount(cents, "CNY"), None, None, None, None),
                 data.Posting(account2, None, None, None, None, None),
             ],
         )
@@ -0,0 +1,187 @@
+import functools
+import importlib.util
+import sys
+import threading
+import typing
+import zlib
+
+from beancount.core import data
+from beancount.core.number import D
+
+from china_bean_importers.normalize import merchant_name
+
+# hashed feature space, large enough for the character bigrams of bills
+HASH_BITS = 14
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def field_features(prefix: str, text: str) -> tuple[int, ...]:
+    # character unigrams and bigrams, hashed with a stable hash; payees and
+    # narrations repeat a lot across bills, hence the cache
+    mask = (1 << HASH_BITS) - 1
+    return tuple(
+        zlib.crc32(f"{prefix}:{text[i:i + n]}".encode("utf-8")) & mask
+        for n in (1, 2)
+        for i in range(len(text) - n + 1)
+    )
+
+
+def features(narration: str, payee: str) -> tuple[int, ...]:
+    return field_features("n", merchant_name(narration or "")) + field_features(
+        "p", merchant_name(payee or "")
+    )
+
+
+def destination(entry) -> typing.Optional[str]:
+    if isinstance(entry, data.Transaction) and len(entry.postings) > 1:
+        return entry.postings[1].account
+    return None
+
+
+class Classifier:
+    """
+    Multinomial naive Bayes over hashed n-grams of narration and payee,
+    predicting the destination account. Rows are scored with numpy, each a
+    gather and sum over the columns of its own features.
+    """
+
+    def __init__(self, accounts: list[str], log_prior, log_prob) -> None:
+        self.accounts = accounts
+        self.log_prior = log_prior
+        self.log_prob = log_prob
+
+    @classmethod
+    def train(cls, entries, alpha: float = 1.0):
+        import numpy as np
+
+        # entries left unknown teach nothing
+        rows = [
+            (account, e)
+            for e in entries
+            if (account := destination(e)) is not None
+            and not account.endswith(":Unknown")
+        ]
+        accounts = sorted({account for account, _ in rows})
+        index = {account: i for i, account in enumerate(accounts)}
+        counts = np.zeros((len(accounts), 1 << HASH_BITS), dtype=np.float64)
+        prior = np.zeros(len(accounts), dtype=np.float64)
+        for account, e in rows:
+            c = index[account]
+            prior[c] += 1
+            np.add.at(counts[c], list(features(e.narration, e.payee)), 1)
+        log_prior = np.log(prior / max(len(rows), 1))
+        counts += alpha
+        log_prob = np.log(counts / counts.sum(axis=1, keepdims=True))
+        return cls(accounts, log_prior.astype(np.float32), log_prob.astype(np.float32))
+
+    def save(self, path: str):
+        import numpy as np
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                accounts=np.array(self.accounts),
+                log_prior=self.log_prior,
+                log_prob=self.log_prob,
+            )
+
+    @classmethod
+    def load(cls, path: str):
+        import numpy as np
+
+        with np.load(path) as f:
+            return cls([str(a) for a in f["accounts"]], f["log_prior"], f["log_prob"])
+
+    def predict(
+        self, narrations: list[str], payees: list[str], expenses: list[bool]
+    ) -> list[tuple[str, float]]:
+        """
+        The most likely account and its posterior probability of each row,
+        among expense accounts for expenses and the others otherwise.
+        """
+        import numpy as np
+
+        feats = [features(n, p) for n, p in zip(narrations, payees)]
+        scores = np.repeat(self.log_prior[:, None], len(feats), axis=1)
+        # row by row, the gathered columns stay as few as the features of
+        # one row whatever the size of the batch
+        for j, f in enumerate(feats):
+            if f:
+                scores[:, j] += self.log_prob[:, f].sum(axis=1)
+
+        is_expense = np.array([a.startswith("Expenses") for a in self.accounts])
+        mask = np.where(np.array(expenses)[None, :], is_expense[:, None], ~is_expense[:, None])
+        scores = np.where(mask, scores, -np.inf)
+        best = scores.argmax(axis=0)
+        top = scores[best, np.arange(len(feats))]
+        with np.errstate(invalid="ignore"):
+            confidence = 1 / np.exp(scores - top[None, :]).sum(axis=0)
+        return [
+            (self.accounts[b], float(c)) if np.isfinite(t) else (None, 0.0)
+            for b, c, t in zip(best, confidence, top)
+        ]
+
+
+_models: dict[str, Classifier] = {}
+_models_lock = threading.Lock()
+
+
+def load_classifier(config) -> typing.Optional[Classifier]:
+    path = config.get("classifier_model")
+    if path is None:
+        return None
+    if importlib.util.find_spec("numpy") is None:
+        print("WARNING: missing numpy, cannot use the classifier\n", file=sys.stderr)
+        return None
+    with _models_lock:
+        if (model := _models.get(path)) is None:
+            model = _models[path] = Classifier.load(path)
+    return model
+
+
+def classify_unknown(config, model: Classifier, entries: list) -> list:
+    """
+    Attach the predicted account and confidence to the entries left with the
+    unknown accounts. With `classifier_min_confidence` set, confident
+    predictions also replace the unknown account, the entries stay pending
+    review.
+    """
+    unknown = {config["unknown_expense_account"], config["unknown_income_account"]}
+    todo = [
+        i
+        for i, e in enumerate(entries)
+        if destination(e) in unknown and e.postings[0].units is not None
+    ]
+    if not todo:
+        return entries
+    predictions = model.predict(
+        [entries[i].narration for i in todo],
+        [entries[i].payee for i in todo],
+        [entries[i].postings[1].account == config["unknown_expense_account"] for i in todo],
+    )
+    min_confidence = config.get("classifier_min_confidence")
+    entries = list(entries)
+    for i, (account, confidence) in zip(todo, predictions):
+        if account is None:
+            continue
+        e = entries[i]
+        meta = {**e.meta, "predicted_account": account, "confidence": D(f"{confidence:.2f}")}
+        e = e._replace(meta=meta)
+        if min_confidence is not None and confidence >= min_confidence:
+            postings = list(e.postings)
+            postings[1] = postings[1]._replace(account=account)
+            e = e._replace(postings=postings)
+        entries[i] = e
+    return entries
+
+
+def train_from_ledger(ledger: str, path: str):
+    # train on a ledger file and save the model to path
+    from beancount import loader
+
+    entries, _, _ = loader.load_file(ledger)
+    Classifier.train(entries).save(path)
+
+
+if __name__ == "__main__":
+    train_from_ledger(sys.argv[1], sys.argv[2])
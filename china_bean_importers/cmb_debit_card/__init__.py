@@ -1,9 +1,10 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
 from china_bean_importers.importer import PdfImporter
 
 PAYEE_RE = re.compile(r"(\D*)(\d+)")
@@ -28,12 +29,18 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
     # parts[0]: 记账日期
     date = parse(parts[0]).date()
     # parts[2]: 金额
-    units1 = amount.Amount(D(parts[2]), "CNY")
-    # parts[3]: 余额
-    balance = amount.Amount(D(parts[3]), "CNY")
+    try:
+        cents = parse_cents(parts[2])
+    except ValueError:
+        my_warn("Invalid amount, row skipped", lineno, parts)
+        return None
 
     metadata = data.new_metadata(file.name, lineno)
-    metadata["balance"] = str(balance)
+    # parts[3]: 余额
+    try:
+        metadata["balance"] = f"{format_cents(parse_cents(parts[3]))} CNY"
+    except ValueError:
+        my_warn("Invalid balance, left out", lineno, parts)
     tags = {"PendingReview"}
 
     payee_account = None
@@ -67,7 +74,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc, real_name):
         postings=[
             data.Posting(
                 account=card_acc,
-                units=units1,
+                units=cents_amount(cents, "CNY"),
                 cost=None,
                 price=None,
                 flag=None,
@@ -98,20 +105,20 @@ class Importer(PdfImporter):
         self.content_end_regex = re.compile(
             r"^(\d+/\d+|合并统计)$"
         )  # match page number like "1/5" or "合并统计"
-        self.content_end_keyword = "————"  # match last page
+        self.content_stop_keyword = "————"  # match last page
 
-    def parse_metadata(self, file):
-        match = re.search(r"名：(\w+)", self.full_content)
+    def parse_metadata(self, ctx):
+        match = re.search(r"名：(\w+)", ctx.full_content)
         assert match
-        self.real_name = match[1]
+        ctx.real_name = match[1]
 
-        match = re.search(r"[0-9]{16}", self.full_content)
+        match = re.search(r"[0-9]{16}", ctx.full_content)
         assert match
         card_number = match[0]
-        self.card_acc = find_account_by_card_number(self.config, card_number[-4:])
-        my_assert(self.card_acc, f"Unknown card number {card_number}", 0, 0)
+        ctx.card_acc = find_account_by_card_number(self.config, card_number[-4:])
+        my_assert(ctx.card_acc, f"Unknown card number {card_number}", 0, 0)
 
-    def generate_tx(self, row, lineno, file):
+    def generate_tx(self, row, lineno, ctx):
         return gen_txn(
-            self.config, file, row, lineno, self.FLAG, self.card_acc, self.real_name
+            self.config, ctx.file, row, lineno, self.FLAG, ctx.card_acc, ctx.real_name
         )
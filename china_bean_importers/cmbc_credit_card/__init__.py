@@ -1,43 +1,43 @@
 from dateutil.parser import parse
-from beancount.ingest import importer
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import csv
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
+from china_bean_importers.importer import BaseImporter, ParseContext, split_content
 
 FOREIGN_CURR_TX = re.compile(
     r"^(?P<desc>.*?)\s*?(?P<country>[A-Z]+)(?P<amount>[-\d.]+)\s*(?P<currency>[A-Z]+)$"
 )
 
 
-class Importer(importer.ImporterProtocol):
+class Importer(BaseImporter):
 
     def __init__(self, config) -> None:
-        super().__init__()
-        self.config = config
+        super().__init__(config)
         self.match_keywords = ["卡号末四位", "交易日"]
+        self.file_account_name = "cmbc_credit_card"
 
-    def identify(self, file):
+    def parse_file(self, file):
         if file.name.upper().endswith(".CSV"):
-            self.type = "csv"
+            ctx = ParseContext(file, "csv")
+            ctx.type = "csv"
             try:
                 with open(file.name, "r", encoding="utf-8") as f:
-                    self.full_content = f.read()
-                    self.content = []
-                    for ln in self.full_content.splitlines():
-                        if (l := ln.strip()) != "":
-                            self.content.append(l)
+                    ctx.full_content = f.read()
+                    ctx.content = split_content(ctx.full_content)
                     if "csv" in file.name and all(
-                        map(lambda c: c in self.full_content, self.match_keywords)
+                        map(lambda c: c in ctx.full_content, self.match_keywords)
                     ):
-                        return True
+                        return ctx
                 return False
             except:
                 return False
         elif file.name.upper().endswith(".EML"):
-            self.type = "email"
+            ctx = ParseContext(file, "eml")
+            ctx.type = "email"
             from bs4 import BeautifulSoup
             import email
             from email import policy
@@ -56,49 +56,49 @@ class Importer(importer.ImporterProtocol):
                 )
                 raw_body_html = raw_body_html.replace("\xa0", " ")
                 soup = BeautifulSoup(raw_body_html, features="lxml")
-                self.body = soup.body
+                ctx.body = soup.body
                 # find 本期账单日
-                stmtDateCell = self.body.select("span#fixBand36")[
+                stmtDateCell = ctx.body.select("span#fixBand36")[
                     0
                 ].parent.nextSibling.font.text
-                self.stmt_date = parse(stmtDateCell)
-                return "民生信用卡" in raw_email["Subject"]
+                ctx.stmt_date = parse(stmtDateCell)
+                if "民生信用卡" in raw_email["Subject"]:
+                    return ctx
+                return False
             except BaseException:
                 return False
 
-    def file_account(self, file):
-        return "cmbc_credit_card"
-
-    def file_date(self, file):
-        if self.type == "csv":
-            if len(self.content) > 1:
-                return parse(self.content[1].split(",")[1])
-        elif self.type == "email":
-            return self.stmt_date
-        return super().file_date(file)
+    def file_date(self, file, context=None):
+        ctx = self.get_context(file, context)
+        if ctx.type == "csv":
+            if len(ctx.content) > 1:
+                return parse(ctx.content[1].split(",")[1])
+        elif ctx.type == "email":
+            return ctx.stmt_date
+        return super().file_date(file, ctx)
 
-    def extract(self, file, existing_entries=None):
+    def extract_entries(self, ctx, existing_entries=None):
 
         # generate beancount posting entries
         tx = list(
             filter(
                 None,
                 map(
-                    lambda e: self.generate_tx(e[1], e[0], file),
-                    enumerate(self.extract_text_entries()),
+                    lambda e: self.generate_tx(e[1], e[0], ctx),
+                    enumerate(self.cached_rows(ctx, self.extract_text_entries)),
                 ),
             )
         )
         return tx
 
-    def extract_text_entries(self):
+    def extract_text_entries(self, ctx):
         """
         extract entries in format of `generate_tx` from csv / eml
         """
 
         entries = []
-        if self.type == "csv":
-            for i, row in enumerate(csv.reader(self.content)):
+        if ctx.type == "csv":
+            for i, row in enumerate(csv.reader(ctx.content)):
                 if i == 0:
                     continue
                 # XXX: we can only default current to CNY
@@ -119,9 +119,9 @@ class Importer(importer.ImporterProtocol):
                 else:
                     row[0] = post_year + row[0]
                 entries.append(row[:3] + row[4:])  # skip 授权码
-        elif self.type == "email":
-            currency_ele = self.body.select("span#fixBand29")[:-1]
-            detail_table = self.body.select("span#loopBand3")
+        elif ctx.type == "email":
+            currency_ele = ctx.body.select("span#fixBand29")[:-1]
+            detail_table = ctx.body.select("span#loopBand3")
             my_assert(
                 len(currency_ele) == len(detail_table),
                 "Length of currency and detail table mismatch",
@@ -142,8 +142,8 @@ class Importer(importer.ImporterProtocol):
                 for j in range(0, len(all_cells), 5):
                     tx_date, post_date, narration, amount, card = all_cells[j : j + 5]
                     # both date in "MM/DD" format
-                    stmt_year = self.stmt_date.year
-                    stmt_mon = self.stmt_date.month
+                    stmt_year = ctx.stmt_date.year
+                    stmt_mon = ctx.stmt_date.month
                     tx_year = (
                         stmt_year if int(tx_date[:2]) <= stmt_mon else stmt_year - 1
                     )
@@ -158,18 +158,22 @@ class Importer(importer.ImporterProtocol):
 
         return entries
 
-    def generate_tx(self, row: list, lineno: int, file):
+    def generate_tx(self, row: list, lineno: int, ctx):
         #   0      1        2       3    4    5
         # 交易日, 记账日, 卡号末四位, 摘要, 金额, 货币
 
         # parse data line
-        metadata: dict = data.new_metadata(file.name, lineno)
+        metadata: dict = data.new_metadata(ctx.file.name, lineno)
         tags = {"PendingReview"}
 
         # parse some basic info
         date = parse(row[0]).date()
         metadata["post_date"] = parse(row[1]).date()
-        units = amount.Amount(D(row[4]), row[5])
+        try:
+            cents = parse_cents(row[4])
+        except ValueError:
+            my_warn("Invalid amount, row skipped", lineno, row)
+            return None
 
         _, _, card_number, orig_narration = row[:4]
 
@@ -190,14 +194,14 @@ class Importer(importer.ImporterProtocol):
             narration = orig_narration
             payee = None
 
-        units = -units  # inverse sign
+        cents = -cents  # inverse sign
         account1 = find_account_by_card_number(self.config, card_number)
         my_assert(account1, f"Unknown card number {card_number}", lineno, row)
 
         # check blacklist
         if in_blacklist(self.config, orig_narration):
             print(
-                f"Item skipped due to blacklist: {date} {orig_narration} [{units}]",
+                f"Item skipped due to blacklist: {date} {orig_narration} [{format_cents(cents)} {row[5]}]",
                 file=sys.stderr,
             )
             return None
@@ -207,7 +211,7 @@ class Importer(importer.ImporterProtocol):
             metadata.update(new_meta)
             tags = tags.union(new_tags)
         if account2 is None:
-            account2 = unknown_account(self.config, units.number < 0)
+            account2 = unknown_account(self.config, cents < 0)
 
         return data.Transaction(
             meta=metadata,
@@ -220,7 +224,7 @@ class Importer(importer.ImporterProtocol):
             postings=[
                 data.Posting(
                     account=account1,
-                    units=units,
+                    units=cents_amount(cents, row[5]),
                     cost=None,
                     price=None,
                     flag=None,
@@ -1,9 +1,10 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, parse_cents
 from china_bean_importers.importer import PdfImporter
 
 
@@ -27,16 +28,20 @@ def gen_txn(config, file, parts, lineno, flag, card_acc):
         return None
     full_time = parse(parts[2])
     date = full_time.date()
-    units1 = amount.Amount(D(parts[4]), "CNY")
+    try:
+        cents = parse_cents(parts[4])
+    except ValueError:
+        my_warn("Invalid amount, row skipped", lineno, parts)
+        return None
 
     # check blacklist
     if in_blacklist(config, narration):
         print(
-            f"Item in blacklist: {date} {narration} [{units1}]",
+            f"Item in blacklist: {date} {narration} [{format_cents(cents)} CNY]",
             file=sys.stderr,
             end=" -- ",
         )
-        if units1 < amount.Amount(D(0), "CNY"):
+        if cents < 0:
             print(f"Expense skipped", file=sys.stderr)
             return None
         else:
@@ -58,7 +63,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc):
         metadata.update(new_meta)
         tags = tags.union(new_tags)
     if account2 is None:
-        account2 = unknown_account(config, units1.number < 0)
+        account2 = unknown_account(config, cents < 0)
 
     # try to find transfer destination account
     if parts[9] != "":
@@ -81,7 +86,7 @@ def gen_txn(config, file, parts, lineno, flag, card_acc):
         postings=[
             data.Posting(
                 account=card_acc,
-                units=units1,
+                units=cents_amount(cents, "CNY"),
                 cost=None,
                 price=None,
                 flag=None,
@@ -106,27 +111,40 @@ class Importer(PdfImporter):
         self.match_keywords = ["民生银行", "个人账户对账单"]
         self.file_account_name = "cmbc_debit_card"
         self.column_offsets = [22, 56, 97, 173, 335, 413, 448, 482, 533, 568, 696]
+        self.column_headers = [
+            "凭证类型",
+            "凭证号码",
+            "交易时间",
+            "摘要",
+            "交易金额",
+            "账户余额",
+            "现转标志",
+            "交易渠道",
+            "交易机构",
+            "对方户名/账号",
+            "对方行名",
+        ]
         self.content_start_keyword = "对方行名"
         self.content_end_keyword = "______________"
 
-    def parse_metadata(self, file):
+    def parse_metadata(self, ctx):
         match = re.search(
             r"起止日期:([0-9]{4}\/[0-9]{2}\/[0-9]{2}).*([0-9]{4}\/[0-9]{2}\/[0-9]{2})",
-            self.full_content,
+            ctx.full_content,
         )
         assert match
-        self.start = parse(match[1])
-        self.end = parse(match[2])
+        ctx.start = parse(match[1])
+        ctx.end = parse(match[2])
 
-        match = re.search(r"客户姓名:(\w+)", self.full_content)
+        match = re.search(r"客户姓名:(\w+)", ctx.full_content)
         assert match
-        self.real_name = match[1]
+        ctx.real_name = match[1]
 
-        match = re.search(r"客户账号:([0-9]+)", self.full_content)
+        match = re.search(r"客户账号:([0-9]+)", ctx.full_content)
         assert match
         card_number = match[1]
-        self.card_acc = find_account_by_card_number(self.config, card_number[-4:])
-        my_assert(self.card_acc, f"Unknown card number {card_number}", 0, 0)
+        ctx.card_acc = find_account_by_card_number(self.config, card_number[-4:])
+        my_assert(ctx.card_acc, f"Unknown card number {card_number}", 0, 0)
 
-    def generate_tx(self, row, lineno, file):
-        return gen_txn(self.config, file, row, lineno, self.FLAG, self.card_acc)
+    def generate_tx(self, row, lineno, ctx):
+        return gen_txn(self.config, ctx.file, row, lineno, self.FLAG, ctx.card_acc)
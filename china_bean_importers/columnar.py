@@ -0,0 +1,262 @@
+import array
+import csv
+import io
+import itertools
+import typing
+from datetime import datetime
+
+from dateutil.parser import parse
+
+from china_bean_importers.amounts import parse_cents
+from china_bean_importers.common import my_warn
+
+
+class TableSpec(typing.NamedTuple):
+    # leading header cells identifying the table header row
+    # (None means the first line is the header)
+    header: typing.Optional[list[str]] = None
+    # roles of converted columns, keyed by column index or header name:
+    # "datetime", "amount", "cents", "direction" or a callable converter.
+    # Amounts are converted to integer cents
+    roles: typing.Optional[dict[typing.Union[int, str], object]] = None
+    # data rows with fewer columns are skipped
+    min_columns: int = 0
+    # prefix of the line marking the end of the table
+    end_prefix: typing.Optional[str] = None
+    # number of trailing lines that are not data
+    skip_footer: int = 0
+
+
+def to_datetime(value: str) -> datetime:
+    # most exports use ISO-like timestamps, avoid dateutil for those
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse(value)
+
+
+def to_expense(direction: str) -> typing.Optional[bool]:
+    if direction == "支出":
+        return True
+    elif direction == "收入":
+        return False
+    return None
+
+
+CONVERTERS = {
+    "datetime": to_datetime,
+    "amount": parse_cents,
+    "cents": int,
+    "direction": to_expense,
+}
+
+
+class Table:
+    """
+    Data rows of a CSV table stored column by column.
+
+    `lineno` holds the index of each row in the importer's `content`. `raw`
+    columns are stripped strings, `columns` are the same until converted by
+    convert_table, which replaces the columns with declared roles.
+    """
+
+    def __init__(self, names: list[str], lineno: list[int], columns: list[list]):
+        self.names = names
+        self.lineno = lineno
+        self.columns = columns
+        self.raw = columns
+
+    def __len__(self):
+        return len(self.lineno)
+
+    def index(self, key) -> int:
+        return key if isinstance(key, int) else self.names.index(key)
+
+    def column(self, key) -> list:
+        i = self.index(key)
+        if i >= len(self.columns):
+            return [""] * len(self)
+        return self.columns[i]
+
+    def row(self, i: int) -> list:
+        return [col[i] for col in self.columns]
+
+    def raw_row(self, i: int) -> list:
+        # cells of a row as in the file, for warnings
+        return [col[i] for col in self.raw]
+
+    def rows(self) -> typing.Iterator[tuple]:
+        # (lineno, converted row, raw row)
+        return zip(self.lineno, zip(*self.columns), zip(*self.raw))
+
+
+class Lines:
+    """
+    Stripped non-empty lines of a decoded file, sliced lazily from the one
+    buffer. Only the (start, end) offsets of the lines are kept.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.offsets = array.array("Q")
+        pos = 0
+        for ln in text.splitlines(True):
+            n = len(ln)
+            if l := ln.lstrip():
+                start = pos + n - len(l)
+                self.offsets.append(start)
+                self.offsets.append(start + len(l.rstrip()))
+            pos += n
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self.text[self.offsets[2 * i] : self.offsets[2 * i + 1]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def join(self, start: int, stop: int) -> str:
+        # lines start:stop separated by newlines, a single slice of the
+        # buffer when nothing but line breaks lies between them
+        if start >= stop:
+            return ""
+        text = self.text[self.offsets[2 * start] : self.offsets[2 * stop - 1]]
+        if text.count("\n") == stop - start - 1:
+            return text
+        return "\n".join(self[start:stop])
+
+
+def find_header(content: typing.Sequence[str], spec: TableSpec) -> int:
+    if spec.header is None:
+        return 0
+    for i, line in enumerate(content):
+        if spec.header[0] not in line:
+            continue
+        cells = next(csv.reader([line]))
+        if len(cells) >= len(spec.header) and all(
+            h in c for h, c in zip(spec.header, cells)
+        ):
+            return i
+    return -1
+
+
+def tokenize_arrow(text: str, width: int) -> typing.Optional[list[list[str]]]:
+    try:
+        from pyarrow import csv as pa_csv
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    names = [f"c{i}" for i in range(width)]
+    try:
+        table = pa_csv.read_csv(
+            io.BytesIO(text.encode("utf-8")),
+            read_options=pa_csv.ReadOptions(column_names=names),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={n: pa.string() for n in names},
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+    except pa.ArrowInvalid:
+        # ragged rows, let the python reader handle them
+        return None
+    return [
+        [c.strip() for c in col.to_pylist()] for col in table.itercolumns()
+    ]
+
+
+def read_table(content: typing.Sequence[str], spec: TableSpec) -> Table:
+    """
+    Locate the table described by `spec` in the decoded lines and split its
+    rows into columns of stripped strings. Roles are applied by convert_table.
+    """
+    header = find_header(content, spec)
+    if header < 0:
+        return Table([], [], [])
+    names = [c.strip() for c in next(csv.reader([content[header]]))]
+
+    start = header + 1
+    stop = len(content) - spec.skip_footer
+    if spec.end_prefix is not None:
+        for i in range(start, stop):
+            if content[i].startswith(spec.end_prefix):
+                stop = i
+                break
+
+    # decode all cells at once, prefer the arrow tokenizer when available
+    columns = None
+    width = max(len(names), spec.min_columns)
+    if start < stop and len(next(csv.reader([content[start]]))) == width:
+        if isinstance(content, Lines):
+            text = content.join(start, stop)
+        else:
+            text = "\n".join(content[start:stop])
+        columns = tokenize_arrow(text, width)
+    if columns is not None and columns and len(columns[0]) != stop - start:
+        # quoted line breaks, rows no longer map to lines
+        columns = None
+    if columns is not None:
+        # arrow rejects rows of another width, all rows have `width` cells
+        # which is at least min_columns
+        lineno = list(range(start, stop))
+    else:
+        rows = []
+        lineno = []
+        lines = (content[i] for i in range(start, stop))
+        for i, row in enumerate(csv.reader(lines), start):
+            if len(row) < spec.min_columns:
+                continue
+            rows.append([c.strip() for c in row])
+            lineno.append(i)
+        columns = list(map(list, itertools.zip_longest(*rows, fillvalue="")))
+
+    return Table(names, lineno, columns)
+
+
+def convert_column(convert, cells: list, bad: set) -> list:
+    try:
+        return list(map(convert, cells))
+    except ValueError:
+        pass
+    # find the offending cells
+    out = []
+    for i, cell in enumerate(cells):
+        try:
+            out.append(convert(cell))
+        except ValueError:
+            out.append(None)
+            bad.add(i)
+    return out
+
+
+def convert_table(table: Table, spec: TableSpec) -> Table:
+    """
+    Convert the columns with declared roles in bulk. Rows with cells that
+    cannot be converted are reported with their raw cells and skipped.
+    """
+    columns = table.columns = list(table.raw)
+    bad = set()
+    for key, role in (spec.roles or {}).items():
+        if isinstance(key, str) and key not in table.names:
+            continue
+        i = table.index(key)
+        if i < len(columns):
+            convert = CONVERTERS[role] if isinstance(role, str) else role
+            columns[i] = convert_column(convert, columns[i], bad)
+    if bad:
+        for i in sorted(bad):
+            my_warn("Invalid value, row skipped", table.lineno[i], table.raw_row(i))
+        keep = [i for i in range(len(table)) if i not in bad]
+        table.lineno = [table.lineno[i] for i in keep]
+        table.columns = [[col[i] for i in keep] for col in columns]
+        table.raw = [[col[i] for i in keep] for col in table.raw]
+    return table
@@ -1,6 +1,17 @@
+import functools
+import itertools
 import re
 import sys
 import typing
+from decimal import Decimal
+
+from china_bean_importers.normalize import canonical_id, contains
+from china_bean_importers.rulepack import (
+    candidate_rules,
+    has_raw_keywords,
+    has_windows,
+)
+from china_bean_importers.rulestats import rule_stats
 
 
 card_tail_pattern = re.compile(r".*银行.*\(([0-9]{4})\)")
@@ -20,7 +31,47 @@ currency_code_map = {
     "澳大利亚元": "AUD",
 }
 
-SAME_AS_NARRATION = object()
+class _SameAsNarration:
+    # unpickled as the same sentinel, rules are kept in pickled rule packs
+    def __reduce__(self):
+        return "SAME_AS_NARRATION"
+
+    def __repr__(self):
+        return "SAME_AS_NARRATION"
+
+
+SAME_AS_NARRATION = _SameAsNarration()
+
+# window predicates of a rule, in the order of window_values
+WINDOWS = ("amount", "time", "weekday", "day")
+# upper bound of amounts in cents
+MAX_CENTS = 1 << 62
+
+
+def to_cents(value) -> int:
+    return int((Decimal(str(value)) * 100).to_integral_value())
+
+
+@functools.lru_cache(maxsize=None)
+def clock_seconds(clock: str) -> int:
+    # "HH:MM" or "HH:MM:SS"
+    parts = [int(p) for p in clock.split(":")]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+
+def window_values(amount=None, when=None) -> tuple:
+    """
+    Values of an item checked by window predicates: the absolute amount in
+    cents, the seconds of the day, the ISO weekday and the day of the month.
+    `when` is a datetime, or a date when the time is unknown.
+    """
+    cents = None if amount is None else abs(to_cents(amount))
+    if when is None:
+        return cents, None, None, None
+    seconds = None
+    if hasattr(when, "hour"):
+        seconds = when.hour * 3600 + when.minute * 60 + when.second
+    return cents, seconds, when.isoweekday(), when.day
 
 
 class BillDetailMapping(typing.NamedTuple):
@@ -38,6 +89,48 @@ class BillDetailMapping(typing.NamedTuple):
     priority: int = 0
     # match logic ("OR" or "AND")
     match_logic: str = "OR"
+    # (min, max) of the absolute amount, inclusive, either may be None
+    amount_range: typing.Optional[tuple] = None
+    # ("HH:MM", "HH:MM") time of day, the end excluded, may wrap midnight
+    time_range: typing.Optional[tuple[str, str]] = None
+    # ISO weekdays (1 is Monday)
+    weekdays: typing.Optional[list[int]] = None
+    days_of_month: typing.Optional[list[int]] = None
+
+    def intervals(self) -> dict[str, list[tuple[int, int]]]:
+        """
+        Window predicates as half-open intervals over window_values, only
+        for the predicates the rule has.
+        """
+        out = {}
+        if self.amount_range is not None:
+            lo, hi = self.amount_range
+            out["amount"] = [
+                (
+                    0 if lo is None else to_cents(lo),
+                    MAX_CENTS if hi is None else to_cents(hi) + 1,
+                )
+            ]
+        if self.time_range is not None:
+            start, end = (clock_seconds(t) for t in self.time_range)
+            if start < end:
+                out["time"] = [(start, end)]
+            elif start > end:
+                out["time"] = [(start, 86400), (0, end)]
+            else:
+                out["time"] = [(0, 86400)]
+        if self.weekdays:
+            out["weekday"] = [(d, d + 1) for d in sorted(set(self.weekdays))]
+        if self.days_of_month:
+            out["day"] = [(d, d + 1) for d in sorted(set(self.days_of_month))]
+        return out
+
+    def in_window(self, values: tuple) -> bool:
+        for window, intervals in self.intervals().items():
+            v = values[WINDOWS.index(window)]
+            if v is None or not any(lo <= v < hi for lo, hi in intervals):
+                return False
+        return True
 
     def canonicalize(self):
         tags = set(self.additional_tags) if self.additional_tags else set()
@@ -45,10 +138,24 @@ class BillDetailMapping(typing.NamedTuple):
         return self.destination_account, metadata, tags, self.priority
 
     def match(
-        self, desc: str, payee: str, expense: typing.Optional[bool] = None
+        self,
+        desc: str,
+        payee: str,
+        expense: typing.Optional[bool] = None,
+        amount=None,
+        when=None,
     ) -> tuple[typing.Optional[str], dict[str, object], set[str], int]:
         assert self.match_logic == "OR" or self.match_logic == "AND"
 
+        # window predicates need the amount and time of the item
+        if (
+            self.amount_range is not None
+            or self.time_range is not None
+            or self.weekdays
+            or self.days_of_month
+        ) and not self.in_window(window_values(amount, when)):
+            return None, {}, set(), 0
+
         # Check target_type if specified in metadata
         if expense is not None and self.additional_metadata:
             target_type = self.additional_metadata.get("target_type")
@@ -61,7 +168,7 @@ class BillDetailMapping(typing.NamedTuple):
         narration_match = False
         if desc is not None and self.narration_keywords is not None:
             for keyword in self.narration_keywords:
-                if keyword in desc:
+                if contains(desc, keyword):
                     narration_match = True
                     break
 
@@ -74,7 +181,7 @@ class BillDetailMapping(typing.NamedTuple):
                 else self.payee_keywords
             )
             for keyword in keywords:
-                if keyword in payee:
+                if contains(payee, keyword):
                     payee_match = True
                     break
 
@@ -119,41 +226,97 @@ def find_account_by_card_number(config, card_number):
     return None
 
 
-def match_destination_and_metadata(config, desc, payee, expense=None):
+def match_destination_and_metadata(
+    config, desc, payee, expense=None, amount=None, when=None
+):
     account = None
-    mapping = None
-    priority = 0
+    rank = None
     metadata = {}
     tags = {"PendingReview"}
-
-    # merge all possible results
-    for m in config["detail_mappings"]:
+    stats = rule_stats(config)
+
+    # conflicts between rules are reported once when the rules are loaded
+    # and resolved by their precomputed rank. Rules are evaluated by
+    # priority and past hits, rules that only give an account are skipped
+    # once a better ranked account is found
+    candidates = candidate_rules(config, desc, payee, window_values(amount, when))
+    order = sorted(
+        range(len(candidates)),
+        key=lambda k: (
+            candidates[k][0][0],
+            -stats.hits(candidates[k][1]) if stats else 0,
+            candidates[k][0],
+        ),
+    )
+    results = {}
+    for k in order:
+        new_rank, m = candidates[k]
         _mapping: BillDetailMapping = m
-        new_account, new_metadata, new_tags, new_priority = _mapping.match(desc, payee, expense=expense)
-        # check compatibility
-        if account is None or new_priority > priority:
-            account, mapping, priority = new_account, m, new_priority
-        elif new_account is not None and new_priority == priority:
-            if new_account.startswith(account):
-                # new account is deeper than or equal to current account
-                account, mapping = new_account, m
-            elif not account.startswith(new_account):
-                my_warn(
-                    f"""Conflict destination accounts found for narration {desc} and payee {payee}:
-Old account {account} from {mapping}
-New account {new_account} from {m}
-
-""",
-                    0,
-                    "",
-                )
+        if (
+            rank is not None
+            and new_rank > rank
+            and not _mapping.additional_tags
+            and not _mapping.additional_metadata
+        ):
+            continue
+        if stats is not None:
+            new_account, new_metadata, new_tags, _ = stats.match(
+                m, desc, payee, expense, amount, when
+            )
+        else:
+            new_account, new_metadata, new_tags, _ = _mapping.match(
+                desc, payee, expense=expense, amount=amount, when=when
+            )
+        if new_account is not None and (rank is None or new_rank < rank):
+            account, rank = new_account, new_rank
+        results[k] = (new_metadata, new_tags)
 
-        metadata.update(new_metadata)
-        tags.update(new_tags)
+    # merge in rule order
+    for k in sorted(results):
+        metadata.update(results[k][0])
+        tags.update(results[k][1])
 
     return account, metadata, tags
 
 
+def match_destination_and_metadata_batch(
+    config, descs, payees, expenses=None, amounts=None, times=None
+):
+    """
+    Classify whole columns of narrations and payees at once.
+
+    Each distinct (narration, payee, expense) key, by canonical form, is
+    matched only once and the result is shared by all rows with that key, so
+    the returned metadata and tags must be treated as read-only (merge them
+    with `update` / `union`). The key holds the raw strings instead when
+    some keyword is matched on the raw text, and amounts and times only take
+    part in it when some rule has window predicates.
+    """
+    if expenses is None:
+        expenses = itertools.repeat(None)
+    windowed = has_windows(config)
+    raw = has_raw_keywords(config)
+    if amounts is None or not windowed:
+        amounts = itertools.repeat(None)
+    if times is None or not windowed:
+        times = itertools.repeat(None)
+    results = {}
+    out = []
+    for desc, payee, expense, amount, when in zip(descs, payees, expenses, amounts, times):
+        if raw:
+            key = (desc, payee, expense)
+        else:
+            key = (canonical_id(desc), canonical_id(payee), expense)
+        if windowed:
+            key += window_values(amount, when)
+        if (result := results.get(key)) is None:
+            result = results[key] = match_destination_and_metadata(
+                config, desc, payee, expense, amount, when
+            )
+        out.append(result)
+    return out
+
+
 def match_currency_code(currency_name):
     return (
         currency_code_map[currency_name] if currency_name in currency_code_map else None
@@ -170,10 +333,10 @@ def unknown_account(config, expense) -> str:
 
 def in_blacklist(config, narration):
     for b in config["importers"]["card_narration_whitelist"]:
-        if b in narration:
+        if contains(narration, b):
             return False
     for b in config["importers"]["card_narration_blacklist"]:
-        if b in narration:
+        if contains(narration, b):
             return True
     return False
 
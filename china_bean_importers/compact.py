@@ -0,0 +1,69 @@
+import sys
+import threading
+
+from beancount.core import data
+
+# metadata holding unique values, not worth interning
+UNIQUE_META_KEYS = frozenset(
+    ("filename", "lineno", "fingerprint", "serial", "log_no", "pos_journo", "balance")
+)
+
+_tag_sets: dict[frozenset, frozenset] = {}
+_tag_sets_lock = threading.Lock()
+
+
+def shared_tags(tags) -> frozenset:
+    # one frozen set per tag combination, shared by all entries
+    key = frozenset(tags)
+    if (shared := _tag_sets.get(key)) is None:
+        with _tag_sets_lock:
+            shared = _tag_sets.setdefault(key, key)
+    return shared
+
+
+def intern_value(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def compact_meta(meta: dict) -> dict:
+    # in place, values repeated across rows (time, category, status...)
+    for key, value in meta.items():
+        if type(value) is str and key not in UNIQUE_META_KEYS:
+            meta[key] = sys.intern(value)
+    return meta
+
+
+def compact_posting(posting: data.Posting) -> data.Posting:
+    account = sys.intern(posting.account)
+    units = posting.units
+    if units is not None and units.currency is not None:
+        currency = sys.intern(units.currency)
+        if currency is not units.currency:
+            units = units._replace(currency=currency)
+    if account is posting.account and units is posting.units:
+        return posting
+    return posting._replace(account=account, units=units)
+
+
+def compact_entries(entries: list) -> list:
+    """
+    Share the strings and tag sets repeated across imported transactions:
+    accounts, currencies, payees and small metadata values are interned, and
+    tags are replaced by one frozen set per combination. Narrations, mostly
+    unique to their row, are left alone.
+    """
+    result = []
+    for entry in entries:
+        if isinstance(entry, data.Transaction):
+            compact_meta(entry.meta)
+            entry = entry._replace(
+                payee=intern_value(entry.payee),
+                tags=shared_tags(entry.tags) if entry.tags else data.EMPTY_SET,
+            )
+            postings = entry.postings
+            for i, posting in enumerate(postings):
+                postings[i] = compact_posting(posting)
+        result.append(entry)
+    return result
@@ -1,5 +1,227 @@
+from beancount.core import data
 from beancount.ingest.extract import DUPLICATE_META
 from collections import defaultdict
+import threading
+import typing
+
+from china_bean_importers.normalize import clear_canonical_forms
+from china_bean_importers.pending import (
+    PendingTransaction,
+    entry_fingerprint,
+    first_posting,
+)
+
+
+# natural transaction ID (serial, pos_journo, log_no, ...) per source account
+# -> name of the first file that imported it in this run
+_imported_ids: dict[tuple[str, str], str] = {}
+_imported_ids_lock = threading.Lock()
+
+
+def is_overlap(account, txid, file_name) -> bool:
+    """
+    Record the natural transaction ID of a row from a source account, and
+    tell whether another export of the same source already had it in this
+    run. Overlapping exports are common since bills are downloaded as
+    sliding windows, their rows should be dropped before being classified.
+    """
+    if not txid:
+        return False
+    with _imported_ids_lock:
+        first = _imported_ids.setdefault((account, txid), file_name)
+    return first != file_name
+
+
+def clear_imported_ids():
+    # start a new run
+    with _imported_ids_lock:
+        _imported_ids.clear()
+
+
+def end_run(new_entries_list, existing_entries):
+    """
+    Ingest hook ending the run for is_overlap and the canonical forms, put
+    it in HOOKS. Processes running several imports, like fava, would
+    otherwise drop rows seen in the exports of an earlier run, and keep
+    every narration and payee they have seen.
+    """
+    clear_imported_ids()
+    clear_canonical_forms()
+    return new_entries_list
+
+
+# metadata holding natural transaction IDs recorded by the importers
+ID_META_KEYS = ("serial", "log_no", "pos_journo")
+
+
+class LedgerIndex:
+    """
+    Existing ledger entries indexed by natural transaction ID and by
+    (account, date, amount) of each posting, so that imported entries are
+    looked up in constant time instead of compared pairwise.
+    """
+
+    def __init__(self, entries) -> None:
+        self.by_id: dict[tuple[str, str], data.Transaction] = {}
+        self.fingerprints: set[str] = set()
+        self.by_posting: dict[tuple, list[data.Transaction]] = defaultdict(list)
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            if fp := entry.meta.get("fingerprint"):
+                self.fingerprints.add(fp)
+            for key in ID_META_KEYS:
+                if value := entry.meta.get(key):
+                    self.by_id[(key, str(value))] = entry
+            for posting in entry.postings:
+                if posting.units is None or posting.units.number is None:
+                    continue
+                self.by_posting[
+                    (
+                        posting.account,
+                        entry.date,
+                        posting.units.number,
+                        posting.units.currency,
+                    )
+                ].append(entry)
+
+    def find_id(self, entry) -> typing.Optional[data.Transaction]:
+        if isinstance(entry, PendingTransaction):
+            return self.by_id.get(entry.txid)
+        for key in ID_META_KEYS:
+            if value := entry.meta.get(key):
+                if (found := self.by_id.get((key, str(value)))) is not None:
+                    return found
+        return None
+
+    def find_postings(self, account, date, number, currency) -> list[data.Transaction]:
+        return self.by_posting.get((account, date, number, currency), [])
+
+    def mark_duplicates(self, entries) -> list:
+        """
+        Mark imported entries already in the ledger. An entry is matched by
+        its fingerprint, then by its transaction ID if it carries one, otherwise by its first posting,
+        where each existing entry accounts for one imported entry only.
+        """
+        used = set()
+        marked = []
+        for entry in entries:
+            if isinstance(entry, data.Transaction) and self.is_duplicate(entry, used):
+                marked_meta = entry.meta.copy()
+                marked_meta[DUPLICATE_META] = True
+                entry = entry._replace(meta=marked_meta)
+            marked.append(entry)
+        return marked
+
+    def drop_duplicates(self, entries) -> list:
+        # the same matching as mark_duplicates, for pending entries as well
+        used = set()
+        return [
+            entry
+            for entry in entries
+            if not (
+                isinstance(entry, (data.Transaction, PendingTransaction))
+                and self.is_duplicate(entry, used)
+            )
+        ]
+
+    def is_duplicate(self, entry, used: set) -> bool:
+        if entry_fingerprint(entry) in self.fingerprints:
+            return True
+        if (
+            entry.txid is not None
+            if isinstance(entry, PendingTransaction)
+            else any(entry.meta.get(key) for key in ID_META_KEYS)
+        ):
+            return self.find_id(entry) is not None
+        if (posting := first_posting(entry)) is None:
+            return False
+        for found in self.find_postings(*posting):
+            if id(found) not in used:
+                used.add(id(found))
+                return True
+        return False
+
+
+# the index of the ledger passed to the importers in this run
+_ledger_index: tuple[list, LedgerIndex] = (None, None)
+_ledger_index_lock = threading.Lock()
+
+
+def ledger_index(existing_entries) -> LedgerIndex:
+    # beancount hands the same entries to every importer, index them once
+    global _ledger_index
+    with _ledger_index_lock:
+        entries, index = _ledger_index
+        if entries is not existing_entries:
+            index = LedgerIndex(existing_entries)
+            _ledger_index = (existing_entries, index)
+    return index
+
+
+# payment_method of entries from wallet bills, which name the merchant and
+# also show up on the statement of the card that paid them
+WALLET_PAYMENT_METHODS = {"微信支付", "支付宝"}
+
+
+def _match_key(entry):
+    # source account and amount of a transaction
+    if not isinstance(entry, data.Transaction) or not entry.postings:
+        return None
+    units = entry.postings[0].units
+    if units is None:
+        return None
+    return (entry.postings[0].account, units.number, units.currency)
+
+
+def find_cross_source_duplicates(new_entries_list, existing_entries, window=3):
+    """
+    Match wallet entries paid by card against the same payment on the card
+    statement, within `window` days since banks post with a delay. The card
+    entries are marked as duplicates and point to the wallet entry, which
+    knows the merchant. Use functools.partial to change the window.
+    """
+    width = max(window, 1)
+
+    # hash join: card entries are bucketed by (account, amount, date), a
+    # wallet entry only probes its own and the neighbouring date buckets
+    cards = defaultdict(list)
+    wallets = []
+    for i, (_, new_entries) in enumerate(new_entries_list):
+        for j, entry in enumerate(new_entries):
+            if (key := _match_key(entry)) is None:
+                continue
+            day = entry.date.toordinal()
+            if entry.meta.get("payment_method") in WALLET_PAYMENT_METHODS:
+                wallets.append((day, i, j, key))
+            else:
+                cards[(key, day // width)].append((day, i, j))
+
+    matched = {}
+    for day, i, j, key in sorted(wallets):
+        best = None
+        for bucket in range(day // width - 1, day // width + 2):
+            for card in cards.get((key, bucket), ()):
+                if card[1] == i or card[1:] in matched:
+                    continue
+                dist = abs(card[0] - day)
+                if dist <= window and (best is None or dist < best[0]):
+                    best = (dist, card[1:])
+        if best is not None:
+            matched[best[1]] = new_entries_list[i][1][j]
+
+    mod_entries_list = []
+    for i, (key, new_entries) in enumerate(new_entries_list):
+        mod_entries = []
+        for j, entry in enumerate(new_entries):
+            if (wallet := matched.get((i, j))) is not None:
+                marked_meta = entry.meta.copy()
+                marked_meta[DUPLICATE_META] = True
+                marked_meta["matched"] = f"{wallet.meta['filename']}:{wallet.meta['lineno']}"
+                entry = entry._replace(meta=marked_meta)
+            mod_entries.append(entry)
+        mod_entries_list.append((key, mod_entries))
+    return mod_entries_list
 
 
 def find_wechat_family(new_entries_list, existing_entries):
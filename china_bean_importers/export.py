@@ -0,0 +1,143 @@
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+import typing
+
+from beancount.core import data
+
+from china_bean_importers.dedup import ID_META_KEYS
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("date", pa.date32()),
+            ("time", pa.string()),
+            ("amount", pa.decimal128(24, 8)),
+            ("currency", pa.string()),
+            ("source_account", pa.string()),
+            ("destination_account", pa.string()),
+            ("payee", pa.string()),
+            ("narration", pa.string()),
+            ("tags", pa.list_(pa.string())),
+            ("serial", pa.string()),
+            ("importer", pa.string()),
+            ("fingerprint", pa.string()),
+        ]
+    )
+
+
+def record_batch(importer: str, entries: list):
+    """
+    Normalized transactions as an Arrow record batch, one row per entry with
+    the amount of its first posting.
+    """
+    import pyarrow as pa
+
+    columns = {name: [] for name in arrow_schema().names}
+    for e in entries:
+        if not isinstance(e, data.Transaction) or not e.postings:
+            continue
+        units = e.postings[0].units
+        columns["date"].append(e.date)
+        columns["time"].append(e.meta.get("time"))
+        columns["amount"].append(None if units is None else units.number)
+        columns["currency"].append(None if units is None else units.currency)
+        columns["source_account"].append(e.postings[0].account)
+        columns["destination_account"].append(
+            e.postings[1].account if len(e.postings) > 1 else None
+        )
+        columns["payee"].append(e.payee)
+        columns["narration"].append(e.narration)
+        columns["tags"].append(sorted(e.tags))
+        columns["serial"].append(
+            next((str(e.meta[k]) for k in ID_META_KEYS if e.meta.get(k)), None)
+        )
+        columns["importer"].append(importer)
+        columns["fingerprint"].append(e.meta.get("fingerprint"))
+    return pa.RecordBatch.from_pydict(columns, schema=arrow_schema())
+
+
+def exported_fingerprints(dir: str, own: str) -> set:
+    # fingerprints exported from the other statements of a partition
+    import pyarrow.parquet as pq
+
+    found = set()
+    for name in os.listdir(dir):
+        if not name.endswith(".parquet") or name == own:
+            continue
+        path = os.path.join(dir, name)
+        if "fingerprint" in pq.read_schema(path).names:
+            found.update(
+                pq.read_table(path, columns=["fingerprint"])
+                .column("fingerprint")
+                .to_pylist()
+            )
+    found.discard(None)
+    return found
+
+
+class ParquetExporter:
+    """
+    Writes the transactions of each statement to Parquet files partitioned
+    as source=<importer>/month=<YYYY-MM>/. Each statement has its own file
+    in a partition, so exporting it again replaces the earlier rows. Rows
+    already exported from an overlapping statement, by fingerprint, are
+    left out so that no transaction is counted twice.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def write(self, importer: str, file_name: str, entries: list):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        batch = record_batch(importer, entries)
+        if batch.num_rows == 0:
+            return
+        part = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()[:16]
+        months = pc.strftime(batch.column("date"), format="%Y-%m")
+        for month in pc.unique(months).to_pylist():
+            rows = batch.filter(pc.equal(months, month))
+            dir = os.path.join(self.path, f"source={importer}", f"month={month}")
+            os.makedirs(dir, exist_ok=True)
+            path = os.path.join(dir, f"{part}.parquet")
+            if found := exported_fingerprints(dir, os.path.basename(path)):
+                rows = rows.filter(
+                    pc.invert(
+                        pc.is_in(
+                            rows.column("fingerprint"),
+                            value_set=pa.array(sorted(found), pa.string()),
+                        )
+                    )
+                )
+            if rows.num_rows == 0:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            pq.write_table(pa.Table.from_batches([rows]), tmp)
+            os.replace(tmp, path)
+
+
+_exporters: dict[str, ParquetExporter] = {}
+_exporters_lock = threading.Lock()
+
+
+def parquet_exporter(config) -> typing.Optional[ParquetExporter]:
+    path = config.get("parquet_export")
+    if path is None:
+        return None
+    if importlib.util.find_spec("pyarrow") is None:
+        print("WARNING: missing pyarrow, cannot export parquet\n", file=sys.stderr)
+        return None
+    with _exporters_lock:
+        if (exporter := _exporters.get(path)) is None:
+            exporter = _exporters[path] = ParquetExporter(path)
+    return exporter
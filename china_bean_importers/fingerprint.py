@@ -0,0 +1,147 @@
+import hashlib
+import sqlite3
+import sys
+import threading
+import typing
+
+from beancount.core import data
+from beancount.ingest.extract import DUPLICATE_META
+
+from china_bean_importers.pending import (
+    PendingTransaction,
+    entry_fingerprint,
+    entry_keys,
+)
+
+# bump when the fingerprinted fields or their format change
+FINGERPRINT_VERSION = 2
+
+
+def fingerprint(source: str, entry, occurrence: int = 0) -> str:
+    """
+    Stable ID of an imported transaction, pending or built, from the
+    source, account, date, time, amount and natural transaction ID.
+    Identical rows of one file are told apart by their occurrence.
+    """
+    account, date, time, units, txid = entry_keys(entry)
+    parts = [
+        str(FINGERPRINT_VERSION),
+        source,
+        account,
+        date.isoformat(),
+        time,
+        units,
+        "" if txid is None else txid[1],
+        str(occurrence),
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def add_fingerprints(source: str, entries: list) -> list:
+    seen: dict[str, int] = {}
+    result = []
+    for entry in entries:
+        if isinstance(entry, PendingTransaction) or (
+            isinstance(entry, data.Transaction) and entry.postings
+        ):
+            fp = fingerprint(source, entry)
+            occurrence = seen[fp] = seen.get(fp, -1) + 1
+            if occurrence:
+                fp = fingerprint(source, entry, occurrence)
+            if isinstance(entry, PendingTransaction):
+                entry = entry._replace(fingerprint=fp)
+            else:
+                entry = entry._replace(meta={**entry.meta, "fingerprint": fp})
+        result.append(entry)
+    return result
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of accepted imports kept in a SQLite database, so that
+    re-imports are recognized without loading the ledger.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "fingerprint TEXT PRIMARY KEY, file TEXT, date TEXT)"
+        )
+        self.conn.commit()
+
+    def __contains__(self, fp: str) -> bool:
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT 1 FROM fingerprints WHERE fingerprint = ?", (fp,)
+            )
+            return cur.fetchone() is not None
+
+    def add(self, entries: list):
+        rows = [
+            (e.meta["fingerprint"], e.meta.get("filename"), e.date.isoformat())
+            for e in entries
+            if isinstance(e, data.Transaction) and "fingerprint" in e.meta
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+    def mark_duplicates(self, entries: list) -> list:
+        marked = []
+        for entry in entries:
+            if (fp := entry.meta.get("fingerprint")) is not None and fp in self:
+                entry = entry._replace(meta={**entry.meta, DUPLICATE_META: True})
+            marked.append(entry)
+        return marked
+
+    def drop_duplicates(self, entries: list) -> list:
+        return [
+            e for e in entries if (fp := entry_fingerprint(e)) is None or fp not in self
+        ]
+
+
+_indexes: dict[str, FingerprintIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def fingerprint_index(config) -> typing.Optional[FingerprintIndex]:
+    # importers sharing a config share one database
+    path = config.get("fingerprint_index")
+    if path is None:
+        return None
+    with _indexes_lock:
+        if (index := _indexes.get(path)) is None:
+            index = _indexes[path] = FingerprintIndex(path)
+    return index
+
+
+def record_fingerprints(config):
+    """
+    Make an ingest hook recording the fingerprints found in the ledger,
+    i.e. of imports the user accepted. Extracted entries are not recorded,
+    an extract whose output is thrown away leaves no trace.
+    """
+
+    def hook(new_entries_list, existing_entries):
+        if existing_entries and (index := fingerprint_index(config)) is not None:
+            index.add(existing_entries)
+        return new_entries_list
+
+    return hook
+
+
+def accept_ledger(ledger: str, path: str):
+    # record the fingerprints of the imports accepted into a ledger file
+    from beancount import loader
+
+    entries, _, _ = loader.load_file(ledger)
+    FingerprintIndex(path).add(entries)
+
+
+if __name__ == "__main__":
+    accept_ledger(sys.argv[1], sys.argv[2])
@@ -1,10 +1,12 @@
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
-import csv
 from datetime import datetime
+import itertools
 from pathlib import Path
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount
+from china_bean_importers.columnar import TableSpec, convert_table, read_table
 from china_bean_importers.importer import CsvImporter
 
 
@@ -20,13 +22,19 @@ class Importer(CsvImporter):
         self.encoding = "utf-8"
         self.match_keywords = ["Billing currency", "Description"]
         self.file_account_name = "hsbc_hk"
-
-    def identify(self, file):
+        self.table_spec = TableSpec(
+            roles={
+                "Billing amount": "amount",
+                "Balance": "amount",
+                "Transaction date": parse_date,
+                "Date": parse_date,
+            },
+        )
+
+    def parse_file(self, file):
         acc_name = Path(file.name).stem.split("_")[0]
         if mapping := self.config["importers"]["hsbc_hk"].get("account_mapping"):
-            if acc := mapping.get(acc_name):
-                self.account1 = acc
-            else:
+            if not (acc := mapping.get(acc_name)):
                 my_warn(
                     f"Account mapping not found for {acc_name}, skipping...",
                     file.name,
@@ -35,47 +43,63 @@ class Importer(CsvImporter):
                 return False
         else:
             raise ValueError("Account mapping not set in importer config")
-        return super().identify(file)
-
-    def parse_metadata(self, file):
-        self.reader = csv.DictReader(self.content)
-        self.parsed_content = list(self.reader)
-        if "Transaction date" in self.reader.fieldnames:
-            self.type = "Credit"
-            self.date_field = "Transaction date"
-        elif "Date" in self.reader.fieldnames:
-            self.type = "Debit"
-            self.date_field = "Date"
+        if ctx := super().parse_file(file):
+            ctx.account1 = acc
+        return ctx
+
+    def parse_metadata(self, ctx):
+        ctx.table = read_table(ctx.content, self.table_spec)
+        if "Transaction date" in ctx.table.names:
+            ctx.type = "Credit"
+            ctx.date_field = "Transaction date"
+        elif "Date" in ctx.table.names:
+            ctx.type = "Debit"
+            ctx.date_field = "Date"
         else:
             raise ValueError("Unknown file format")
 
-        # unify date for sorting
-        for i, c in enumerate(self.parsed_content):
-            c["D"] = parse_date(c[self.date_field])
-            c["line_no"] = i + 1
-
-        self.parsed_content = sorted(self.parsed_content, key=lambda x: x["D"])
-        self.start = self.parsed_content[0]["D"]
-        self.end = self.parsed_content[-1]["D"]
-
-    def extract(self, file, existing_entries=None):
+        # the table is converted by extract, which reports invalid rows
+        dates = []
+        for value in ctx.table.column(ctx.date_field):
+            try:
+                dates.append(parse_date(value))
+            except ValueError:
+                pass
+        if dates:
+            ctx.start = min(dates)
+            ctx.end = max(dates)
+
+    def extract_entries(self, ctx, existing_entries=None):
         entries = []
         use_cnh = self.config["importers"]["hsbc_hk"].get("use_cnh", False)
+        table = convert_table(ctx.table, self.table_spec)
+        # unify date for sorting
+        dates = table.column(ctx.date_field)
+        order = sorted(range(len(dates)), key=lambda i: dates[i])
+        currencies = table.column("Billing currency")
+        numbers = table.column("Billing amount")
+        narrations = table.column("Description")
+        if ctx.type == "Credit":
+            payees = table.column("Merchant name")
+        else:
+            payees = itertools.repeat("")
+        matches = match_destination_and_metadata_batch(self.config, narrations, payees)
 
-        for c in self.parsed_content:
+        for i in order:
+            c = dict(zip(table.names, table.row(i)))
 
             # parse data line
-            metadata: dict = data.new_metadata(file.name, c["line_no"])
+            line_no = table.lineno[i]
+            metadata: dict = data.new_metadata(ctx.file.name, line_no)
             tags = {"PendingReview"}
 
-            line_no = c["line_no"]
-            date = c["D"].date()
-            currency = c["Billing currency"].strip()
+            date = dates[i].date()
+            currency = currencies[i]
             # use CNH instead of CNY if specified in config
             if currency == "CNY" and use_cnh:
                 currency = "CNH"
-            units = amount.Amount(D(c["Billing amount"].strip()), currency)
-            narration = c["Description"].strip()
+            cents = numbers[i]
+            narration = narrations[i]
             payee = ""
 
             if "UNIONPAY" in narration:
@@ -83,10 +107,11 @@ class Importer(CsvImporter):
             elif "APPLEPAY" in narration:
                 metadata["payment_method"] = "Apple Pay"
 
-            if self.type == "Credit":
+            if ctx.type == "Credit":
                 status = c["Transaction status"]
                 if status != "POSTED":
-                    my_warn(f"Unposted transaction status {status}", line_no, c)
+                    raw = dict(zip(table.names, table.raw_row(i)))
+                    my_warn(f"Unposted transaction status {status}", line_no, raw)
                     tags.add("need-confirmation")
                 metadata["post_date"] = parse_date(c["Post date"]).date()
                 if (country := c["Country / region"].strip()) != "":
@@ -94,16 +119,14 @@ class Importer(CsvImporter):
                 if (area := c["Area / district"].strip()) != "":
                     metadata["area"] = area
                 payee = c["Merchant name"].strip()
-            elif self.type == "Debit":
-                balance = amount.Amount(D(c["Balance"].strip()), currency)
+            elif ctx.type == "Debit":
+                balance = cents_amount(c["Balance"], currency)
                 metadata["balance_after"] = balance
 
             # find account2
-            expense = units.number < 0
+            expense = cents < 0
             account2 = unknown_account(self.config, expense)
-            new_account, new_meta, new_tags = match_destination_and_metadata(
-                self.config, narration, payee
-            )
+            new_account, new_meta, new_tags = matches[i]
             if new_account:
                 account2 = new_account
             metadata.update(new_meta)
@@ -120,8 +143,8 @@ class Importer(CsvImporter):
                 links=data.EMPTY_SET,
                 postings=[
                     data.Posting(
-                        account=self.account1,
-                        units=units,
+                        account=ctx.account1,
+                        units=cents_amount(cents, currency),
                         cost=None,
                         price=None,
                         flag=None,
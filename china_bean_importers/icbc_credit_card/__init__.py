@@ -1,10 +1,11 @@
 from beancount.core.number import D
-from beancount.core import data, amount
-from beancount.ingest import importer
+from beancount.core import data
 from dateutil.parser import parse
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, parse_cents
+from china_bean_importers.importer import BaseImporter, ParseContext
 
 REGEX_YYYY_MM_DD = re.compile(r"(\d+)年(\d+)月(\d+)日")
 
@@ -53,16 +54,18 @@ def to_txn_object(values: list[str], header_index: dict[str, int]) -> dict[str,
     return ret
 
 
-class Importer(importer.ImporterProtocol):
+class Importer(BaseImporter):
 
     def __init__(self, config) -> None:
-        super().__init__()
-        self.config = config
+        super().__init__(config)
         self.match_keywords = [EMAIL_KEYWORD]
+        self.file_account_name = "icbc_credit_card"
 
-    def identify(self, file):
+    def parse_file(self, file):
         if file.name.upper().endswith(".EML"):
-            self.type = "email"
+            ctx = ParseContext(file, "eml")
+            ctx.type = "email"
+            ctx.stmt_date = None
 
             from bs4 import BeautifulSoup
             from email import policy
@@ -74,27 +77,25 @@ class Importer(importer.ImporterProtocol):
                     f)
                 raw_body_html = quopri.decodestring(
                     raw_email.get_body().get_payload())
-                self.body = BeautifulSoup(raw_body_html, features="lxml")
-                for i in self.body.find_all("td"):
+                ctx.body = BeautifulSoup(raw_body_html, features="lxml")
+                for i in ctx.body.find_all("td"):
                     if "对账单生成日" in (i.string or ""):
                         [y, m, d] = REGEX_YYYY_MM_DD.search(
                             i.string).groups()
-                        self.stmt_date = parse(f"{y}-{m}-{d}")
+                        ctx.stmt_date = parse(f"{y}-{m}-{d}")
                 is_workable = EMAIL_KEYWORD in raw_email["Subject"]
-                return is_workable
+                return ctx if is_workable else False
         return False
 
-    def file_account(self, file):
-        return "icbc_credit_card"
-
-    def file_date(self, file):
-        if self.type == "email":
-            return self.stmt_date
-        return super().file_date(file)
+    def file_date(self, file, context=None):
+        ctx = self.get_context(file, context)
+        if ctx.type == "email":
+            return ctx.stmt_date
+        return super().file_date(file, ctx)
 
     # common methods for table-based import
-    def extract(self, file, existing_entries=None):
-        return list(self.process_outer(self.body, file.name))
+    def extract_entries(self, ctx, existing_entries=None):
+        return list(self.process_outer(ctx.body, ctx.file.name))
 
     def process_inner(self, table, file_name):
         headers_processed = False
@@ -180,16 +181,20 @@ class Importer(importer.ImporterProtocol):
         if "退款" in narration:
             tags.add("refund")
 
-        units = amount.Amount(D(dst_number), dst_currency)
+        try:
+            cents = parse_cents(dst_number)
+        except ValueError:
+            my_warn("Invalid amount, row skipped", lineno, txn_object)
+            return None
         if is_expense:
-            units = -units
+            cents = -cents
 
         if m := match_destination_and_metadata(self.config, narration, payee):
             (account2, new_meta, new_tags) = m
             metadata.update(new_meta)
             tags = tags.union(new_tags)
         if account2 is None:
-            account2 = unknown_account(self.config, units.number < 0)
+            account2 = unknown_account(self.config, cents < 0)
 
         return data.Transaction(
             meta=metadata,
@@ -202,7 +207,7 @@ class Importer(importer.ImporterProtocol):
             postings=[
                 data.Posting(
                     account=account1,
-                    units=units,
+                    units=cents_amount(cents, dst_currency),
                     cost=None,
                     price=None,
                     flag=None,
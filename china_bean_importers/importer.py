@@ -1,26 +1,133 @@
 from dateutil.parser import parse
 from beancount.ingest import importer
 from datetime import datetime
+import collections
+import threading
 
 from china_bean_importers.common import *
+from china_bean_importers.dedup import ledger_index
+from china_bean_importers.fingerprint import add_fingerprints, fingerprint_index
+from china_bean_importers.staging import csv_columns, staging_store
+from china_bean_importers.rowcache import config_digest, row_cache
+from china_bean_importers.export import parquet_exporter
+from china_bean_importers.classifier import classify_unknown, load_classifier
+from china_bean_importers.pending import materialize
+from china_bean_importers.compact import compact_entries
+from china_bean_importers.columnar import Lines
+from china_bean_importers.pdf import DocumentText
+from china_bean_importers.layout import *
+
+
+class ParseContext:
+    """
+    Everything learned about one file while identifying it.
+
+    identify returns the context and file_date, file_name and extract take it,
+    so importers hold no per-file state and can be shared between threads.
+    Importers add their own fields (card account, real name, ...) as needed.
+    """
+
+    def __init__(self, file, filetype: str = None) -> None:
+        self.file = file
+        self.filetype = filetype
+        self.full_content: str = ""
+        self.content: typing.Sequence[str] = []
+        self.start: datetime = None
+        self.end: datetime = None
+        # source rows of the generated entries by lineno, kept for staging
+        self.raw_rows: dict[int, list] = {}
+        # rows before classification, when restored from the row cache
+        self.rows: typing.Optional[list] = None
+        self.cache_key: str = None
 
 
 class BaseImporter(importer.ImporterProtocol):
+    # parsed files remembered for the beancount calls following identify
+    max_contexts = 16
+
     def __init__(self, config) -> None:
         super().__init__()
         self.config: dict = config
         self.match_keywords: list[str] = None
         self.file_account_name: str = None
-        self.full_content: str = ""
-        self.content: list[str] = []
-        self.start: datetime = None
-        self.end: datetime = None
         self.filetype: str = None
+        self.contexts: collections.OrderedDict[str, ParseContext] = (
+            collections.OrderedDict()
+        )
+        self.contexts_lock = threading.Lock()
+        self.staging = staging_store(config)
+        self.row_cache = row_cache(config)
+        self.parse_config_digest = (
+            None if self.row_cache is None else config_digest(config)
+        )
+        self.exporter = parquet_exporter(config)
+        self.classifier = load_classifier(config)
 
     def identify(self, file):
+        context = self.cached_context(file)
+        if context is None:
+            context = self.parse_file(file)
+            if context and self.row_cache is not None:
+                self.save_context(context, file)
+        if not context:
+            return False
+        with self.contexts_lock:
+            self.contexts[file.name] = context
+            self.contexts.move_to_end(file.name)
+            while len(self.contexts) > self.max_contexts:
+                self.contexts.popitem(last=False)
+        return context
+
+    def get_context(self, file, context=None) -> ParseContext:
+        # compatibility with beancount's ImporterProtocol, which only passes
+        # the file: use the context of the last identify, or parse again
+        if context is not None:
+            return context
+        with self.contexts_lock:
+            context = self.contexts.get(file.name)
+        if context is None:
+            context = self.identify(file)
+            assert context, f"Cannot identify {file.name}"
+        return context
+
+    def cached_context(self, file):
+        # the cached result of parse_file, None when not cached
+        if self.row_cache is None:
+            return None
+        key = self.cache_key(file)
+        if (cached := self.row_cache.load(key)) is None or not cached["context"]:
+            return None
+        ctx = ParseContext(file)
+        ctx.__dict__.update(cached["context"])
+        ctx.cache_key = key
+        return ctx
+
+    def cache_key(self, file) -> str:
+        return self.row_cache.key(
+            type(self).__module__, file.name, self.parse_config_digest
+        )
+
+    def save_context(self, ctx, file):
+        key = self.cache_key(file)
+        ctx.cache_key = key
+        state = {
+            k: v for k, v in vars(ctx).items() if k not in ("file", "raw_rows")
+        }
+        self.row_cache.save(key, {"context": state})
+
+    def cached_rows(self, ctx: ParseContext, extract) -> typing.Iterable[list]:
+        # rows of extract(ctx), kept in the row cache for the next run
+        if self.row_cache is None or ctx.cache_key is None:
+            return extract(ctx)
+        if ctx.rows is None:
+            ctx.rows = list(extract(ctx))
+            self.save_context(ctx, ctx.file)
+        return ctx.rows
+
+    def parse_file(self, file) -> typing.Optional[ParseContext]:
         raise "Unimplemented"
 
-    def parse_metadata(self, file):
+    def parse_metadata(self, ctx: ParseContext):
         raise "Unimplemented"
 
     def file_account(self, file):
@@ -28,54 +135,100 @@ class BaseImporter(importer.ImporterProtocol):
             raise "file_account_name not set"
         return self.file_account_name
 
-    def file_date(self, file):
-        return self.start
+    def file_date(self, file, context=None):
+        return self.get_context(file, context).start
+
+    def file_name(self, file, context=None):
+        ctx = self.get_context(file, context)
+        assert ctx.filetype is not None
+        if ctx.end:
+            return f"to.{ctx.end.date().isoformat()}.{ctx.filetype}"
+
+    def extract(self, file, existing_entries=None, context=None):
+        ctx = self.get_context(file, context)
+        entries = self.extract_entries(ctx, existing_entries)
+        entries = add_fingerprints(self.file_account_name, entries)
+        if self.config.get("skip_duplicates"):
+            # drop rows imported before, pending ones are never built
+            if (index := fingerprint_index(self.config)) is not None:
+                entries = index.drop_duplicates(entries)
+            if existing_entries:
+                entries = ledger_index(existing_entries).drop_duplicates(entries)
+        entries = materialize(entries)
+        if self.staging is not None:
+            # staged before the classifier fills in unknown accounts, rows
+            # are ruled when their account is the one the rules give
+            self.staging.add(
+                self.file_account_name,
+                entries,
+                lambda i: self.raw_row(ctx, i),
+                self.config,
+            )
+            ctx.raw_rows.clear()
+        if self.classifier is not None:
+            entries = classify_unknown(self.config, self.classifier, entries)
+        entries = compact_entries(entries)
+        if self.exporter is not None:
+            self.exporter.write(self.file_account_name, ctx.file.name, entries)
+        if (index := fingerprint_index(self.config)) is not None:
+            entries = index.mark_duplicates(entries)
+        if existing_entries:
+            entries = ledger_index(existing_entries).mark_duplicates(entries)
+        return entries
 
-    def file_name(self, file):
-        assert self.filetype is not None
-        if self.end:
-            return f"to.{self.end.date().isoformat()}.{self.filetype}"
+    def keep_raw(self, ctx: ParseContext, lineno: int, row):
+        if self.staging is not None:
+            ctx.raw_rows[lineno] = row
+
+    def raw_row(self, ctx: ParseContext, lineno: int) -> typing.Optional[list]:
+        return ctx.raw_rows.get(lineno)
 
     # common methods for table-based import
-    def extract(self, file, existing_entries=None):
-        return list(
-            filter(
-                lambda x: x is not None,
-                [
-                    self.generate_tx(r, i, file)
-                    for i, r in enumerate(self.extract_rows())
-                ],
-            )
-        )
+    def extract_entries(self, ctx: ParseContext, existing_entries=None):
+        entries = []
+        for i, r in enumerate(self.cached_rows(ctx, self.extract_rows)):
+            if (txn := self.generate_tx(r, i, ctx)) is not None:
+                self.keep_raw(ctx, i, r)
+                entries.append(txn)
+        return entries
 
-    def extract_rows(self) -> list[list[str]]:
+    def extract_rows(self, ctx: ParseContext) -> typing.Iterable[list[str]]:
         raise "Unimplemented"
 
-    def generate_tx(self, row: list[str], lineno: int, file):
+    def generate_tx(self, row: list[str], lineno: int, ctx: ParseContext):
         raise "Unimplemented"
 
 
+def split_content(full_content: str) -> Lines:
+    # stripped non-empty lines, sliced from full_content when accessed
+    return Lines(full_content)
+
+
 class CsvImporter(BaseImporter):
     def __init__(self, config) -> None:
         super().__init__(config)
         self.encoding: str = "utf-8"
         self.filetype = "csv"
 
-    def identify(self, file):
+    def raw_row(self, ctx, lineno):
+        # entries are numbered by their line in content
+        if lineno in ctx.raw_rows or not 0 <= lineno < len(ctx.content):
+            return ctx.raw_rows.get(lineno)
+        return csv_columns(ctx.content[lineno])
+
+    def parse_file(self, file):
         if self.match_keywords is None:
             raise "match_keywords not set"
         try:
             with open(file.name, "r", encoding=self.encoding) as f:
-                self.full_content = f.read()
-                self.content = []
-                for ln in self.full_content.splitlines():
-                    if (l := ln.strip()) != "":
-                        self.content.append(l)
+                ctx = ParseContext(file, self.filetype)
+                ctx.full_content = f.read()
+                ctx.content = split_content(ctx.full_content)
                 if "csv" in file.name and all(
-                    map(lambda c: c in self.full_content, self.match_keywords)
+                    map(lambda c: c in ctx.full_content, self.match_keywords)
                 ):
-                    self.parse_metadata(file)
-                    return True
+                    self.parse_metadata(ctx)
+                    return ctx
         except BaseException:
             return False
 
@@ -85,10 +238,13 @@ class CsvOrXlsxImporter(BaseImporter):
         self.encoding: str = "utf-8"
         self.filetype = "csv"
 
-    def identify(self, file):
+    raw_row = CsvImporter.raw_row
+
+    def parse_file(self, file):
         if self.match_keywords is None:
             raise "match_keywords not set"
         try:
+            ctx = ParseContext(file, self.filetype)
             if file.name.endswith(".xlsx"):
                 try:
                     import pandas as pd
@@ -99,22 +255,19 @@ class CsvOrXlsxImporter(BaseImporter):
 
                 df = pd.read_excel(file.name)
                 csv = df.to_csv(index=False)
-                self.filetype = "xlsx"
-                self.full_content = csv
+                ctx.filetype = "xlsx"
+                ctx.full_content = csv
             elif file.name.endswith(".csv"):
                 with open(file.name, "r", encoding=self.encoding) as f:
-                    self.full_content = f.read()
+                    ctx.full_content = f.read()
             else:
                 return False
-            self.content = []
-            for ln in self.full_content.splitlines():
-                if (l := ln.strip()) != "":
-                    self.content.append(l)
+            ctx.content = split_content(ctx.full_content)
             if all(
-                map(lambda c: c in self.full_content, self.match_keywords)
+                map(lambda c: c in ctx.full_content, self.match_keywords)
             ):
-                self.parse_metadata(file)
-                return True
+                self.parse_metadata(ctx)
+                return ctx
         except BaseException:
             return False
 
@@ -126,90 +279,162 @@ class PdfImporter(BaseImporter):
         super().__init__(config)
         self.filetype = "pdf"
         self.column_offsets: list[int] = None
+        # header labels of the columns, when given the column offsets are
+        # calibrated from the header row and column_offsets is the fallback
+        self.column_headers: list[str] = None
+        # largest distance in points between calibrated and configured
+        # offsets, beyond it the configured offsets are used
+        self.column_tolerance: float = 15
+        self.layout_cache = layout_cache(config)
         self.content_start_keyword: str = None
         self.content_start_regex = None
         self.content_end_keyword: str = None
         self.content_end_regex = None
-
-    def identify(self, file):
+        # marker after which no page contains transactions
+        self.content_stop_keyword: str = None
+        self.content_stop_regex = None
+        # (x0, y0, x1, y1) of the transaction table on each page, when not
+        # given and the columns are calibrated, the table starts at the
+        # first column
+        self.content_clip: tuple[float, float, float, float] = None
+
+    def parse_file(self, file):
         if self.match_keywords is None:
             raise "match_keywords not set"
 
         if "pdf" not in file.name.lower():
             return False
 
-        doc = open_pdf(self.config, file.name)
-        if doc is None:
+        text = self.open_text(file)
+        if text is None:
             return False
 
-        self.full_content = ""
-        self.content = []
-        for page in doc:
-            self.content.extend(page.get_text("words"))
-            self.full_content += page.get_text("text")
+        # the document is reopened on extraction, only its text is kept
+        ctx = ParseContext(file, self.filetype)
+        with text:
+            ctx.full_content = text.text()
 
-        if all(map(lambda c: c in self.full_content, self.match_keywords)):
-            self.parse_metadata(file)
-            return True
+        if all(map(lambda c: c in ctx.full_content, self.match_keywords)):
+            self.parse_metadata(ctx)
+            return ctx
+
+    def open_text(self, file):
+        doc = open_pdf(self.config, file.name)
+        return None if doc is None else DocumentText(doc)
 
-    def extract_rows(self):
-        assert self.column_offsets
+    def is_content_start(self, content):
+        return (
+            self.content_start_keyword and self.content_start_keyword in content
+        ) or (self.content_start_regex and self.content_start_regex.match(content))
+
+    def is_content_end(self, content):
+        return (self.content_end_keyword and self.content_end_keyword in content) or (
+            self.content_end_regex and self.content_end_regex.match(content)
+        )
+
+    def is_content_stop(self, content):
+        return (self.content_stop_keyword and self.content_stop_keyword in content) or (
+            self.content_stop_regex and self.content_stop_regex.match(content)
+        )
+
+    def calibrate_columns(self, text):
+        if self.column_headers is None:
+            return self.column_offsets
+        key = layout_fingerprint(self.file_account_name, text.doc, self.column_headers)
+        if (layout := self.layout_cache.get(key)) is not None:
+            return layout["column_offsets"]
+        for page in text:
+            header = find_header_row(page.words(self.content_clip), self.column_headers)
+            if header is None:
+                continue
+            offsets = column_boundaries(header)
+            if self.column_offsets is not None and not offsets_agree(
+                offsets, self.column_offsets, self.column_tolerance
+            ):
+                print(
+                    f"WARNING: calibrated column offsets {offsets} of "
+                    f"{self.file_account_name} differ from {self.column_offsets}, "
+                    "using the configured offsets",
+                    file=sys.stderr,
+                )
+                offsets = self.column_offsets
+            self.layout_cache.put(key, {"column_offsets": offsets})
+            return offsets
+        # no header in this layout, do not search it again
+        self.layout_cache.put(key, {"column_offsets": self.column_offsets})
+        return self.column_offsets
+
+    def table_clip(self, column_offsets):
+        # words left of the first column belong to none of them
+        if self.content_clip is not None or self.column_headers is None:
+            return self.content_clip
+        return (column_offsets[0], -float("inf"), float("inf"), float("inf"))
+
+    def extract_rows(self, ctx):
+        with self.open_text(ctx.file) as text:
+            yield from self.read_rows(text)
+
+    def read_rows(self, text):
+        column_offsets = self.calibrate_columns(text)
+        assert column_offsets
         assert self.content_start_keyword or self.content_start_regex
-        assert self.content_end_keyword or self.content_end_regex
+        assert (
+            self.content_end_keyword
+            or self.content_end_regex
+            or self.content_stop_keyword
+            or self.content_stop_regex
+        )
 
-        entries = []
         parts = []
+        started = False
         valid = False
         last_y0 = 0
         last_col = -1
+        clip = self.table_clip(column_offsets)
 
-        for x0, y0, x1, y1, content, block_no, line_no, word_no in self.content:
-            content = content.strip()
-            # for debugging
-            # print(x0, y0, content, file=sys.stderr)
+        # words are only taken from the table area, and the remaining pages
+        # are not looked at once the stop marker shows up
+        for page in text:
+            for x0, y0, x1, y1, content, block_no, line_no, word_no in page.words(clip):
+                content = content.strip()
+                # for debugging
+                # print(x0, y0, content, file=sys.stderr)
 
-            if not valid and (
-                (self.content_start_keyword and self.content_start_keyword in content)
-                or (
-                    self.content_start_regex and self.content_start_regex.match(content)
-                )
-            ):
-                valid = True
-            elif valid and (
-                (self.content_end_keyword and self.content_end_keyword in content)
-                or (self.content_end_regex and self.content_end_regex.match(content))
-            ):
-                valid = False
-            elif valid:
-                # find current column
-                for i, off in enumerate(self.column_offsets):
-                    if x0 >= off:
-                        curr_col = i
-                if curr_col > last_col:
-                    # new column in existing row
-                    parts.append(content)
-                elif curr_col == last_col:
-                    # same column in existing row
-                    if y0 == last_y0:
-                        # no newline
-                        parts[-1] = parts[-1] + " " + content
-                    else:
-                        # newline
-                        parts[-1] = parts[-1] + content
-                else:
-                    # new row
+                if started and self.is_content_stop(content):
                     if len(parts) > 0:
-                        entries.append(parts)
-                        parts = []
-                    parts.append(content)
-                last_y0 = y0
-                last_col = curr_col
+                        yield parts
+                    return
+                elif not valid and self.is_content_start(content):
+                    started = valid = True
+                elif valid and self.is_content_end(content):
+                    valid = False
+                elif valid:
+                    # find current column
+                    for i, off in enumerate(column_offsets):
+                        if x0 >= off:
+                            curr_col = i
+                    if curr_col > last_col:
+                        # new column in existing row
+                        parts.append(content)
+                    elif curr_col == last_col:
+                        # same column in existing row
+                        if y0 == last_y0:
+                            # no newline
+                            parts[-1] = parts[-1] + " " + content
+                        else:
+                            # newline
+                            parts[-1] = parts[-1] + content
+                    else:
+                        # new row
+                        if len(parts) > 0:
+                            yield parts
+                            parts = []
+                        parts.append(content)
+                    last_y0 = y0
+                    last_col = curr_col
 
         if len(parts) > 0:
-            entries.append(parts)
-            parts = []
-
-        return entries
+            yield parts
 
 
 class PdfTableImporter(BaseImporter):
@@ -218,68 +443,98 @@ class PdfTableImporter(BaseImporter):
 
         super().__init__(config)
         self.filetype = "pdf"
+        # x positions of the column lines, calibrated from the table under
+        # the header row when not given
         self.vertical_lines: list[int] = None
+        self.layout_cache = layout_cache(config)
         self.header_first_cell: str = None
         self.header_first_cell_regex = None
 
-    def identify(self, file):
+    def parse_file(self, file):
         if self.match_keywords is None:
             raise "match_keywords not set"
 
         if "pdf" not in file.name.lower():
             return False
 
-        doc = open_pdf(self.config, file.name)
-        if doc is None:
+        text = self.open_text(file)
+        if text is None:
             return False
-        doc = self.preprocess_doc(doc)
-
-        self.full_content = ""
-        self.content = []
-        self.doc = doc
-        for page in doc:
-            self.content.extend(page.get_text("words"))
-            self.full_content += page.get_text("text")
-
-        if all(map(lambda c: c in self.full_content, self.match_keywords)):
-            self.populate_rows(doc)
-            self.parse_metadata(file)
-            return True
+
+        # the document is reopened on extraction, only its text is kept
+        ctx = ParseContext(file, self.filetype)
+        with text:
+            ctx.full_content = text.text()
+
+        if all(map(lambda c: c in ctx.full_content, self.match_keywords)):
+            self.parse_metadata(ctx)
+            return ctx
         else:
             return False
 
+    def open_text(self, file):
+        doc = open_pdf(self.config, file.name)
+        return None if doc is None else DocumentText(self.preprocess_doc(doc))
+
     def preprocess_doc(self, doc):
         return doc
 
-    def populate_rows(self, doc):
-        self.rows = []
-        for page in doc:
-            for tbl in page.find_tables(vertical_lines=self.vertical_lines).tables:
-                # TODO: Check vertical offset
-                self.rows.extend(
-                    filter(lambda x: not self.is_row_filtered(x), tbl.extract())
-                )
+    def is_header_cell(self, cell):
+        return (
+            self.header_first_cell is not None and self.header_first_cell == cell
+        ) or (
+            self.header_first_cell_regex is not None
+            and self.header_first_cell_regex.match(cell)
+        )
+
+    def calibrate_tables(self, text):
+        if self.vertical_lines is not None:
+            return self.vertical_lines
+        labels = [
+            self.header_first_cell or "",
+            getattr(self.header_first_cell_regex, "pattern", ""),
+        ]
+        key = layout_fingerprint(self.file_account_name, text.doc, labels)
+        if (layout := self.layout_cache.get(key)) is not None:
+            return layout["vertical_lines"]
+        for page in text:
+            words = page.words()
+            first = next((w for w in words if self.is_header_cell(w[4])), None)
+            if first is None:
+                continue
+            # learn the column lines from the detected table once
+            x, y = (first[0] + first[2]) / 2, (first[1] + first[3]) / 2
+            for tbl in page.page.find_tables().tables:
+                x0, y0, x1, y1 = tbl.bbox
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    lines = sorted({round(c[0], 1) for c in tbl.cells if c})
+                    layout = {"vertical_lines": lines + [round(x1, 1)]}
+                    self.layout_cache.put(key, layout)
+                    return layout["vertical_lines"]
+            return None
+        return None
+
+    def table_rows(self, text):
+        columns = self.calibrate_tables(text)
+        for page in text:
+            rulings = []
+            if columns:
+                rulings = horizontal_rulings(page.page, columns[0], columns[-1])
+            if len(rulings) >= 2:
+                # fixed geometry, words are placed into the ruled grid
+                yield from grid_rows(page.chars(), columns, rulings)
+            else:
+                for tbl in page.page.find_tables().tables:
+                    yield from tbl.extract()
 
     def is_row_filtered(self, row):
         if len(row) == 0:
             return True
-        if self.header_first_cell is not None and self.header_first_cell == row[0]:
-            return True
-        if self.header_first_cell_regex is not None and self.header_first_cell.match(
-            row[0]
-        ):
-            return True
-        return False
-
-    def extract_rows(self):
-        rows = []
-        for page in self.doc:
-            for tbl in page.find_tables().tables:
-                # TODO: Check vertical offset
-                rows.extend(
-                    map(
-                        lambda row: [cell.replace("\n", "").strip() for cell in row],
-                        filter(lambda x: not self.is_row_filtered(x), tbl.extract()),
-                    )
-                )
-        return rows
+        return bool(self.is_header_cell(row[0]))
+
+    def extract_rows(self, ctx):
+        with self.open_text(ctx.file) as text:
+            for row in self.table_rows(text):
+                if not self.is_row_filtered(row):
+                    # TODO: Check vertical offset
+                    yield [cell.replace("\n", "").strip() for cell in row]
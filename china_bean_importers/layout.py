@@ -0,0 +1,180 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import typing
+
+
+class LayoutCache:
+    """
+    Column geometry learned from statement headers, keyed by layout
+    fingerprint.
+
+    With a path the cache is kept in a JSON file, so later statements of the
+    same layout skip calibration. Entries may also be edited by hand to pin
+    the geometry of a layout.
+    """
+
+    def __init__(self, path: typing.Optional[str] = None) -> None:
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key: str) -> typing.Optional[dict]:
+        return self.entries.get(key)
+
+    def put(self, key: str, value: dict):
+        with self.lock:
+            self.entries[key] = value
+            if self.path is None:
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+_caches: dict[typing.Optional[str], LayoutCache] = {}
+
+
+def layout_cache(config) -> LayoutCache:
+    # importers sharing a config share one cache
+    path = config.get("layout_cache")
+    if (cache := _caches.get(path)) is None:
+        cache = _caches[path] = LayoutCache(path)
+    return cache
+
+
+def layout_fingerprint(name: str, doc, labels: list[str]) -> str:
+    """
+    Identify a layout by the producer, the size of the first page and the
+    expected header labels, all known before the header is searched for, so
+    that a cached layout skips calibration.
+    """
+    rect = doc[0].rect if doc.page_count else None
+    parts = [
+        name,
+        doc.metadata.get("producer") or "",
+        doc.metadata.get("creator") or "",
+        "" if rect is None else f"{rect.width:.0f}x{rect.height:.0f}",
+        *labels,
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def offsets_agree(
+    calibrated: list[float], configured: list[float], tolerance: float
+) -> bool:
+    return len(calibrated) == len(configured) and all(
+        abs(a - b) <= tolerance for a, b in zip(calibrated, configured)
+    )
+
+
+def line_words(words: list[tuple], first: tuple) -> list[tuple]:
+    # words vertically overlapping the given word, left to right
+    mid = (first[1] + first[3]) / 2
+    return sorted((w for w in words if w[1] <= mid <= w[3]), key=lambda w: w[0])
+
+
+def find_header_row(words: list[tuple], labels: list[str]) -> typing.Optional[list[tuple]]:
+    """
+    Find the line containing all header labels in order, returning the box
+    (x0, y0, x1, y1, label) of each label. A label may span several words.
+    """
+    for first in words:
+        if not labels[0].startswith(first[4]):
+            continue
+        line = line_words(words, first)
+        line = line[line.index(first) :]
+        boxes = []
+        i = 0
+        for label in labels:
+            box = None
+            text = ""
+            while i < len(line) and len(text) < len(label):
+                w = line[i]
+                text += w[4]
+                box = w[:4] if box is None else (box[0], box[1], w[2], w[3])
+                i += 1
+                if not label.startswith(text):
+                    break
+            if text != label:
+                break
+            boxes.append((*box, label))
+        if len(boxes) == len(labels):
+            return boxes
+    return None
+
+
+def column_boundaries(header: list[tuple], margin: float = 2) -> list[float]:
+    # a column starts just left of its header, but after the previous one
+    offsets = [header[0][0] - margin]
+    for prev, curr in zip(header, header[1:]):
+        offsets.append(max(prev[2], curr[0] - margin))
+    return offsets
+
+
+def horizontal_rulings(page, x0: float, x1: float, tolerance: float = 1) -> list[float]:
+    """
+    Y positions of the horizontal lines drawn across the columns [x0, x1].
+    When the left border of the table is drawn, lines outside it are dropped.
+    """
+    ys = set()
+    borders = []
+    for path in page.get_drawings():
+        for item in path["items"]:
+            if item[0] == "l":
+                p, q = item[1], item[2]
+                rect = (min(p.x, q.x), min(p.y, q.y), max(p.x, q.x), max(p.y, q.y))
+            elif item[0] == "re":
+                r = item[1]
+                rect = (r.x0, r.y0, r.x1, r.y1)
+            else:
+                continue
+            left, top, right, bottom = rect
+            if bottom - top <= tolerance:
+                if left <= x0 + tolerance and right >= x1 - tolerance:
+                    ys.add(round(top, 1))
+            elif right - left <= tolerance and abs(left - x0) <= tolerance:
+                borders.append((top, bottom))
+    if borders:
+        top = min(b[0] for b in borders) - tolerance
+        bottom = max(b[1] for b in borders) + tolerance
+        ys = {y for y in ys if top <= y <= bottom}
+    return sorted(ys)
+
+
+def grid_rows(
+    chars: list[tuple], columns: list[float], rulings: list[float]
+) -> list[list[str]]:
+    """
+    Assign characters to the cells of a fixed grid by their centers, lines of
+    text within a cell are separated by newlines.
+    """
+    cells: dict[tuple[int, int], list[tuple]] = {}
+    for c in chars:
+        col = bisect.bisect(columns, (c[0] + c[2]) / 2) - 1
+        row = bisect.bisect(rulings, (c[1] + c[3]) / 2) - 1
+        if 0 <= col < len(columns) - 1 and 0 <= row < len(rulings) - 1:
+            cells.setdefault((row, col), []).append(c)
+
+    rows = []
+    for row in range(len(rulings) - 1):
+        if not any((row, col) in cells for col in range(len(columns) - 1)):
+            continue
+        out = []
+        for col in range(len(columns) - 1):
+            lines: dict[int, list[tuple]] = {}
+            for c in cells.get((row, col), ()):
+                lines.setdefault(c[5], []).append(c)
+            text = [
+                "".join(c[4] for c in sorted(line, key=lambda c: c[0])).strip()
+                for line in sorted(lines.values(), key=lambda line: line[0][1])
+            ]
+            out.append("\n".join(t for t in text if t))
+        rows.append(out)
+    return rows
@@ -0,0 +1,105 @@
+import functools
+import re
+import threading
+import typing
+import unicodedata
+
+# order, transaction and card numbers embedded in payees and narrations
+number_pattern = re.compile(r"[0-9]{8,}")
+digit_pattern = re.compile(r"[0-9]")
+space_pattern = re.compile(r"\s+")
+# trailing branch of a merchant, e.g. 星巴克(中关村店)
+branch_pattern = re.compile(r"\([^()]*(店|分店|分行|支行|分公司|营业部)\)$")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def literal(text: str) -> str:
+    # full-width to half-width, case and spacing, numbers are kept
+    return space_pattern.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def fold(text: str) -> str:
+    # full-width to half-width, case, spacing and long numbers
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = number_pattern.sub("", text)
+    return space_pattern.sub("", text)
+
+
+class Normalizer:
+    """
+    Canonical forms of raw payees and narrations, each computed once and
+    dictionary encoded: raw strings with the same canonical form share an
+    integer ID, which rule matching and caches key on.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.raw: dict[str, int] = {}
+        self.ids: dict[str, int] = {}
+        self.forms: list[str] = []
+
+    def id(self, text: str) -> int:
+        if (i := self.raw.get(text)) is not None:
+            return i
+        form = fold(text)
+        with self.lock:
+            if (i := self.ids.get(form)) is None:
+                i = self.ids[form] = len(self.forms)
+                self.forms.append(form)
+            self.raw[text] = i
+        return i
+
+    def form(self, text: str) -> str:
+        return self.forms[self.id(text)]
+
+    def clear(self):
+        with self.lock:
+            self.raw.clear()
+            self.ids.clear()
+            self.forms.clear()
+
+
+_normalizer = Normalizer()
+
+
+def canonical_id(text: typing.Optional[str]) -> int:
+    return -1 if text is None else _normalizer.id(text)
+
+
+def canonical(text: typing.Optional[str]) -> typing.Optional[str]:
+    return None if text is None else _normalizer.form(text)
+
+
+def clear_canonical_forms():
+    # end of a run, long-running hosts would otherwise keep every narration
+    # and payee they have seen
+    _normalizer.clear()
+    literal.cache_clear()
+    merchant_name.cache_clear()
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def merchant_name(text: str) -> str:
+    # the canonical form without the branch
+    return branch_pattern.sub("", canonical(text)) or canonical(text)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def keyword_form(keyword: str) -> typing.Optional[str]:
+    """
+    The canonical form of a keyword, or None for keywords with digits,
+    which are matched on the literal form of the text. Long numbers are
+    only dropped from the text: dropped from a keyword, "ETC12345678" would
+    match any "etc", and a card tail such as "3333" would never match the
+    card number it ends.
+    """
+    form = literal(keyword)
+    if not form or digit_pattern.search(form):
+        return None
+    return form
+
+
+def contains(text: str, keyword: str) -> bool:
+    if (form := keyword_form(keyword)) is not None:
+        return form in canonical(text)
+    return literal(keyword) in literal(text)
@@ -0,0 +1,117 @@
+import collections
+import typing
+
+
+class PageText:
+    """
+    Text of a single PDF page.
+
+    The layout analysis runs once into a TextPage, words, plain text and
+    blocks are all derived from it and memoized.
+    """
+
+    def __init__(self, page, flags: int) -> None:
+        self.page = page
+        self.textpage = page.get_textpage(flags=flags)
+        self._words = None
+        self._text = None
+        self._blocks = None
+        self._chars = None
+
+    def words(self, clip=None) -> list[tuple]:
+        if clip is not None:
+            # sub-select the words inside the clip from the same TextPage
+            return self.page.get_text("words", textpage=self.textpage, clip=clip)
+        if self._words is None:
+            self._words = self.page.get_text("words", textpage=self.textpage)
+        return self._words
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.page.get_text("text", textpage=self.textpage)
+        return self._text
+
+    def chars(self) -> list[tuple]:
+        # (x0, y0, x1, y1, c, line) of every character, where line numbers
+        # the text lines of the page
+        if self._chars is None:
+            self._chars = []
+            page = self.textpage.extractRAWDICT()
+            line_no = 0
+            for block in page["blocks"]:
+                for line in block.get("lines", ()):
+                    for span in line["spans"]:
+                        for char in span["chars"]:
+                            self._chars.append((*char["bbox"], char["c"], line_no))
+                    line_no += 1
+        return self._chars
+
+    def blocks(self) -> list[tuple]:
+        if self._blocks is None:
+            self._blocks = self.page.get_text("blocks", textpage=self.textpage)
+        return self._blocks
+
+
+class DocumentText:
+    """
+    Text pages of an opened document.
+
+    Iterating builds one page at a time. Only the last `recent_pages` pages
+    are kept, so memory stays bounded by a few pages while a pass that looks
+    at the first pages (e.g. calibration) and the pass reading all of them
+    share the TextPages. Use it as a context manager to close the document
+    when done.
+    """
+
+    # pages kept by iteration
+    recent_pages = 4
+
+    def __init__(self, doc, flags: typing.Optional[int] = None) -> None:
+        import fitz
+
+        self.doc = doc
+        # the default text flags, which already leave out images
+        self.flags = fitz.TEXTFLAGS_TEXT if flags is None else flags
+        self._pages: dict[int, PageText] = {}
+        self._recent: collections.OrderedDict[int, PageText] = (
+            collections.OrderedDict()
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pages.clear()
+        self._recent.clear()
+        self.doc.close()
+
+    def __len__(self):
+        return self.doc.page_count
+
+    def __iter__(self) -> typing.Iterator[PageText]:
+        return self.pages()
+
+    def pages(self, start: int = 0) -> typing.Iterator[PageText]:
+        # the pages from `start` on, the ones before are not built
+        for i in range(start, len(self)):
+            if (page := self._pages.get(i)) is None:
+                if (page := self._recent.get(i)) is None:
+                    page = self._recent[i] = PageText(self.doc[i], self.flags)
+                    if len(self._recent) > self.recent_pages:
+                        self._recent.popitem(last=False)
+                else:
+                    self._recent.move_to_end(i)
+            yield page
+
+    def page(self, i: int) -> PageText:
+        # pages fetched by index are kept for repeated access
+        if (page := self._pages.get(i)) is None:
+            page = self._recent.pop(i, None) or PageText(self.doc[i], self.flags)
+            self._pages[i] = page
+        return page
+
+    def text(self) -> str:
+        return "".join(page.text() for page in self)
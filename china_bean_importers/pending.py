@@ -0,0 +1,92 @@
+import datetime
+import typing
+from decimal import Decimal
+
+from beancount.core import data
+
+from china_bean_importers.amounts import to_decimal
+
+
+class PendingTransaction(typing.NamedTuple):
+    """
+    An imported row before its Transaction is built: the keys looked at by
+    fingerprints and deduplication, and a function building the entry.
+    Rows dropped as duplicates never allocate beancount objects.
+    """
+
+    date: datetime.date
+    # "HH:MM:SS" as in the time metadata
+    time: typing.Optional[str]
+    # account of the first posting
+    account: str
+    cents: int
+    currency: str
+    # (metadata key, value) of the natural transaction ID
+    txid: typing.Optional[tuple[str, str]]
+    build: typing.Callable[[], data.Transaction]
+    fingerprint: typing.Optional[str] = None
+
+
+def amount_key(number: Decimal, currency: str) -> str:
+    return f"{number.normalize():f} {currency}"
+
+
+def entry_keys(entry) -> tuple:
+    """
+    (account, date, time, amount, txid) of a Transaction or a pending one,
+    the amount without trailing zeros, so that it does not depend on how
+    the number is displayed, or None for entries without postings.
+    """
+    if isinstance(entry, PendingTransaction):
+        return (
+            entry.account,
+            entry.date,
+            entry.time or "",
+            amount_key(to_decimal(entry.cents), entry.currency),
+            entry.txid,
+        )
+    from china_bean_importers.dedup import ID_META_KEYS
+
+    if not isinstance(entry, data.Transaction) or not entry.postings:
+        return None
+    posting = entry.postings[0]
+    txid = next(((k, str(entry.meta[k])) for k in ID_META_KEYS if entry.meta.get(k)), None)
+    return (
+        posting.account,
+        entry.date,
+        str(entry.meta.get("time", "")),
+        ""
+        if posting.units is None
+        else amount_key(posting.units.number, posting.units.currency),
+        txid,
+    )
+
+
+def first_posting(entry) -> typing.Optional[tuple]:
+    # (account, date, number, currency) of the first posting
+    if isinstance(entry, PendingTransaction):
+        return entry.account, entry.date, to_decimal(entry.cents), entry.currency
+    if not entry.postings or entry.postings[0].units is None:
+        return None
+    posting = entry.postings[0]
+    return posting.account, entry.date, posting.units.number, posting.units.currency
+
+
+def entry_fingerprint(entry) -> typing.Optional[str]:
+    if isinstance(entry, PendingTransaction):
+        return entry.fingerprint
+    return entry.meta.get("fingerprint")
+
+
+def materialize(entries: list) -> list:
+    # build the pending entries that are left, keeping their fingerprints
+    out = []
+    for entry in entries:
+        if isinstance(entry, PendingTransaction):
+            fp = entry.fingerprint
+            if (entry := entry.build()) is None:
+                continue
+            if fp is not None:
+                entry.meta["fingerprint"] = fp
+        out.append(entry)
+    return out
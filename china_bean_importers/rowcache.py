@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import typing
+
+# bump when the parsed form of statements changes
+ROW_CACHE_VERSION = 4
+
+
+class RowCache:
+    """
+    Parse results of statements kept on disk, keyed by importer and file
+    content and the config read while parsing: the ParseContext found by
+    identify and the rows extracted before classification. Files an importer
+    does not handle are not cached, the cause (a missing password or
+    package) may be fixed by the next run.
+
+    Extracting again then only runs the classification rules and builds the
+    transactions, which is what changes when detail_mappings are edited.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # content digests by (name, mtime, size), every importer asks for them
+        self.digests: dict[tuple, str] = {}
+        self.lock = threading.Lock()
+
+    def digest(self, file_name: str) -> str:
+        st = os.stat(file_name)
+        stat_key = (file_name, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if (digest := self.digests.get(stat_key)) is not None:
+                return digest
+        h = hashlib.sha1()
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self.lock:
+            digest = self.digests[stat_key] = h.hexdigest()
+        return digest
+
+    def key(self, name: str, file_name: str, config_digest: str = "") -> str:
+        key = f"{ROW_CACHE_VERSION}|{name}|{config_digest}|{self.digest(file_name)}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def load(self, key: str) -> typing.Optional[dict]:
+        try:
+            with open(os.path.join(self.path, f"{key}.pickle"), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def save(self, key: str, value: dict):
+        path = os.path.join(self.path, f"{key}.pickle")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            # parse results that cannot be stored are parsed again next time
+            os.remove(tmp)
+            return
+        os.replace(tmp, path)
+
+
+# config read while parsing statements, parse results depend on it
+PARSE_CONFIG_KEYS = ("importers", "card_accounts", "pdf_passwords")
+
+
+def config_digest(config) -> str:
+    # stable across runs, functions in the config are named, not addressed
+    def stable(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(map(str, value))
+        return getattr(value, "__qualname__", None) or type(value).__name__
+
+    text = json.dumps(
+        {k: config.get(k) for k in PARSE_CONFIG_KEYS},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=stable,
+    )
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+_caches: dict[str, RowCache] = {}
+_caches_lock = threading.Lock()
+
+
+def row_cache(config) -> typing.Optional[RowCache]:
+    path = config.get("row_cache")
+    if path is None:
+        return None
+    with _caches_lock:
+        if (cache := _caches.get(path)) is None:
+            cache = _caches[path] = RowCache(path)
+    return cache
@@ -0,0 +1,217 @@
+import datetime
+import hashlib
+import sys
+import threading
+import typing
+from decimal import Decimal
+
+from china_bean_importers.common import *
+from china_bean_importers.rulepack import rule_sets
+
+
+def rule_id(m: BillDetailMapping) -> str:
+    # stable across runs, unlike the SAME_AS_NARRATION sentinel
+    parts = [
+        "SAME_AS_NARRATION" if v is SAME_AS_NARRATION else v
+        for v in m._replace(
+            additional_metadata=sorted((m.additional_metadata or {}).items()),
+            additional_tags=sorted(m.additional_tags or []),
+        )
+    ]
+    # rules without window predicates keep the IDs they had before those
+    # fields were added
+    while len(parts) > 7 and not parts[-1]:
+        parts.pop()
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class CurrentRules(typing.NamedTuple):
+    # digest of the rule IDs, which names the rule set in the staging store
+    digest: str
+    # rule IDs by rule set and index in it
+    ids: list[list[str]]
+    rules: dict[str, BillDetailMapping]
+
+
+def ruleset_digest(ids: typing.Iterable[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(ids)).encode("utf-8")).hexdigest()[:16]
+
+
+_current: dict[int, tuple[list, CurrentRules]] = {}
+_current_lock = threading.Lock()
+
+
+def current_rules(config) -> CurrentRules:
+    # computed once per loaded rule set, like the rule sets themselves
+    sets = rule_sets(config)
+    if (cached := _current.get(id(sets))) is not None and cached[0] is sets:
+        return cached[1]
+    with _current_lock:
+        ids = [[rule_id(m) for m in s.rules] for s in sets]
+        rules = {
+            r: s.rule(i) for s, set_ids in zip(sets, ids) for i, r in enumerate(set_ids)
+        }
+        current = CurrentRules(ruleset_digest(rules), ids, rules)
+        _current[id(sets)] = (sets, current)
+    return current
+
+
+def key_rules(config, narration: str, payee: str) -> set[str]:
+    """
+    IDs of the rules with a keyword in the narration or payee. This ignores
+    the match logic, target type and windows, so it covers every key whose
+    classification the rule takes part in.
+    """
+    ids = current_rules(config).ids
+    return {
+        ids[n][i]
+        for n, s in enumerate(rule_sets(config))
+        for i in s.candidates(narration, payee)
+    }
+
+
+def index_keys(conn, config, keys: typing.Iterable[tuple]):
+    """
+    Record the rules that could match each (narration, payee) key in the
+    rule_keys table.
+    """
+    conn.executemany(
+        "INSERT OR IGNORE INTO rule_keys VALUES (?, ?, ?)",
+        (
+            (r, narration, payee)
+            for narration, payee in set(keys)
+            for r in key_rules(config, narration, payee)
+        ),
+    )
+
+
+def record_rules(conn, current: CurrentRules):
+    # rows name the rule set they were classified with by its digest
+    if (
+        conn.execute(
+            "SELECT 1 FROM rules WHERE ruleset = ? LIMIT 1", (current.digest,)
+        ).fetchone()
+        is None
+    ):
+        conn.executemany(
+            "INSERT OR IGNORE INTO rules VALUES (?, ?)",
+            ((current.digest, r) for r in current.rules),
+        )
+
+
+class Change(typing.NamedTuple):
+    fingerprint: str
+    date: str
+    narration: str
+    payee: str
+    old_account: str
+    new_account: str
+
+
+def rule_account(
+    config, narration: str, payee: str, expense: bool, amount=None, when=None
+) -> str:
+    account = match_destination_and_metadata(
+        config, narration, payee, expense, amount, when
+    )[0]
+    return account or unknown_account(config, expense)
+
+
+def staged_when(date: str, time: typing.Optional[str]):
+    if time:
+        return datetime.datetime.fromisoformat(f"{date}T{time}")
+    return datetime.date.fromisoformat(date)
+
+
+def reclassify(store, config) -> list[Change]:
+    """
+    Reclassify the staged rows affected by the edits to the rules since
+    each row was classified, and record that all rows follow the current
+    rule set.
+
+    For the rows of each recorded rule set, only keys indexed under rules
+    since removed or changed, and keys containing a keyword of rules since
+    added, are matched again. Rows whose account was set by the importer
+    rather than by the rules are left alone.
+    """
+    current = current_rules(config)
+    with store.lock:
+        conn = store.conn
+        affected = set()
+        recorded = [
+            r
+            for (r,) in conn.execute("SELECT DISTINCT IFNULL(ruleset, '') FROM rows")
+            if r != current.digest
+        ]
+        for ruleset in recorded:
+            old_ids = {
+                r
+                for (r,) in conn.execute(
+                    "SELECT rule FROM rules WHERE ruleset = ?", (ruleset,)
+                )
+            }
+            removed = old_ids - current.rules.keys()
+            added = current.rules.keys() - old_ids
+            keys = set()
+            for r in removed:
+                keys.update(
+                    conn.execute(
+                        "SELECT narration, payee FROM rule_keys WHERE rule = ?", (r,)
+                    )
+                )
+            if added:
+                for key in conn.execute(
+                    "SELECT DISTINCT narration, payee FROM rows "
+                    "WHERE IFNULL(ruleset, '') = ?",
+                    (ruleset,),
+                ):
+                    if not added.isdisjoint(key_rules(config, *key)):
+                        keys.add(key)
+            affected.update((ruleset, *key) for key in keys)
+
+        changes = []
+        for ruleset, narration, payee in affected:
+            rows = conn.execute(
+                "SELECT fingerprint, date, time, amount, account FROM rows "
+                "WHERE narration = ? AND payee = ? AND ruled "
+                "AND IFNULL(ruleset, '') = ?",
+                (narration, payee, ruleset),
+            ).fetchall()
+            for fingerprint, date, time, cents, account in rows:
+                new_account = rule_account(
+                    config,
+                    narration,
+                    payee,
+                    cents is not None and cents < 0,
+                    None if cents is None else Decimal(cents).scaleb(-2),
+                    staged_when(date, time),
+                )
+                if new_account != account:
+                    changes.append(
+                        Change(fingerprint, date, narration, payee, account, new_account)
+                    )
+
+        conn.executemany(
+            "UPDATE rows SET account = ? WHERE fingerprint = ?",
+            ((c.new_account, c.fingerprint) for c in changes),
+        )
+        conn.execute("UPDATE rows SET ruleset = ?", (current.digest,))
+        conn.execute("DELETE FROM rules WHERE ruleset != ?", (current.digest,))
+        record_rules(conn, current)
+        stale = [
+            (r,)
+            for (r,) in conn.execute("SELECT DISTINCT rule FROM rule_keys")
+            if r not in current.rules
+        ]
+        conn.executemany("DELETE FROM rule_keys WHERE rule = ?", stale)
+        index_keys(conn, config, {(n, p) for _, n, p in affected})
+        conn.commit()
+    return changes
+
+
+def print_report(changes: list[Change], file=sys.stdout):
+    for c in sorted(changes, key=lambda c: c.date):
+        print(
+            f"{c.date} {c.narration} {c.payee}: {c.old_account} -> {c.new_account}",
+            file=file,
+        )
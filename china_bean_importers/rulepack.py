@@ -0,0 +1,485 @@
+import array
+import bisect
+import csv
+import gc
+import json
+import os
+import pickle
+import sys
+import threading
+import typing
+
+from china_bean_importers.normalize import canonical, keyword_form, literal
+
+# bump when the compiled form changes
+RULE_PACK_VERSION = 4
+
+
+class KeywordIndex:
+    """
+    Keywords by the first two characters of their canonical form. A text is
+    scanned once, looking up the keywords starting at each position, instead
+    of testing every keyword against it.
+    """
+
+    def __init__(self) -> None:
+        self.prefixes: dict[str, list[tuple[str, int]]] = {}
+        # literal forms of keywords with digits, matched on the literal text
+        self.raw: list[tuple[str, int]] = []
+        # pickled prefixes, expanded on first use
+        self.packed: dict[str, tuple[str, array.array]] = {}
+
+    def __getstate__(self):
+        packed = dict(self.packed)
+        for key, entries in self.prefixes.items():
+            packed[key] = (
+                "\0".join(k for k, _ in entries),
+                array.array("l", (r for _, r in entries)),
+            )
+        return {"raw": self.raw, "packed": packed}
+
+    def __setstate__(self, state):
+        self.prefixes = {}
+        self.raw = state["raw"]
+        self.packed = state["packed"]
+
+    def add(self, keyword: str, rule: int):
+        if (form := keyword_form(keyword)) is not None:
+            self.prefixes.setdefault(form[:2], []).append((form, rule))
+        else:
+            self.raw.append((literal(keyword), rule))
+
+    def entries(self, key: str) -> list[tuple[str, int]]:
+        if (entries := self.prefixes.get(key)) is None:
+            entries = []
+            if (packed := self.packed.get(key)) is not None:
+                entries = list(zip(packed[0].split("\0"), packed[1]))
+            self.prefixes[key] = entries
+        return entries
+
+    def find(self, text: str) -> set[int]:
+        found = set()
+        if self.raw:
+            text_literal = literal(text)
+            found = {rule for keyword, rule in self.raw if keyword in text_literal}
+        form = canonical(text)
+        for i in range(len(form)):
+            for key in (form[i : i + 2], form[i]):
+                for keyword, rule in self.entries(key):
+                    if rule not in found and form.startswith(keyword, i):
+                        found.add(rule)
+        return found
+
+
+class IntervalIndex:
+    """
+    Half-open intervals of rules, cut at every endpoint into segments that
+    each hold the rules covering them, so the rules whose window contains a
+    value are found by bisection.
+    """
+
+    def __init__(self, intervals: list[tuple[int, int, int]]) -> None:
+        # rules constrained by this window
+        self.rules = frozenset(r for _, _, r in intervals)
+        starts: dict[int, list[int]] = {}
+        ends: dict[int, list[int]] = {}
+        for lo, hi, rule in intervals:
+            if lo >= hi:
+                continue
+            starts.setdefault(lo, []).append(rule)
+            ends.setdefault(hi, []).append(rule)
+        self.bounds = sorted(starts.keys() | ends.keys())
+        self.covering: list[frozenset] = []
+        active: dict[int, int] = {}
+        for b in self.bounds[:-1]:
+            for rule in ends.get(b, ()):
+                active[rule] -= 1
+                if active[rule] == 0:
+                    del active[rule]
+            for rule in starts.get(b, ()):
+                active[rule] = active.get(rule, 0) + 1
+            self.covering.append(frozenset(active))
+
+    def find(self, value: typing.Optional[int]) -> frozenset:
+        if value is None:
+            return frozenset()
+        i = bisect.bisect_right(self.bounds, value) - 1
+        if 0 <= i < len(self.covering):
+            return self.covering[i]
+        return frozenset()
+
+    def filter(self, found: set[int], value: typing.Optional[int]) -> set[int]:
+        # keep unconstrained rules and the rules whose window has the value
+        if not self.rules:
+            return found
+        return (found - self.rules) | (found & self.find(value))
+
+
+def encode_rule(m) -> str:
+    from china_bean_importers.common import SAME_AS_NARRATION
+
+    return json.dumps(
+        [
+            m.narration_keywords,
+            "SAME_AS_NARRATION"
+            if m.payee_keywords is SAME_AS_NARRATION
+            else m.payee_keywords,
+            m.destination_account,
+            m.additional_tags,
+            m.additional_metadata,
+            m.priority,
+            m.match_logic,
+            m.amount_range,
+            m.time_range,
+            m.weekdays,
+            m.days_of_month,
+        ],
+        ensure_ascii=False,
+    )
+
+
+def decode_rule(s: str):
+    from china_bean_importers.common import BillDetailMapping, SAME_AS_NARRATION
+
+    fields = json.loads(s)
+    if fields[1] == "SAME_AS_NARRATION":
+        fields[1] = SAME_AS_NARRATION
+    # ranges are tuples, as read_rules gives them, JSON only has lists
+    for i in (7, 8):
+        if fields[i] is not None:
+            fields[i] = tuple(fields[i])
+    return BillDetailMapping(*fields)
+
+
+class RuleSet:
+    """
+    Rules with keyword indexes over narration and payee, to find the rules
+    a bill item could match. Pickled rules are decoded when first needed.
+    """
+
+    def __init__(self, rules: list) -> None:
+        from china_bean_importers.common import SAME_AS_NARRATION, WINDOWS
+
+        self.decoded = dict(enumerate(rules))
+        # one JSON line per rule, when unpickled
+        self.encoded: str = None
+        self.offsets: array.array = None
+        self.count = len(rules)
+        # what the resolution order of the rules depends on
+        self.priorities = array.array("l", (m.priority for m in rules))
+        self.depths = array.array("l", (account_depth(m) for m in rules))
+        self.narration = KeywordIndex()
+        self.payee = KeywordIndex()
+        intervals = {window: [] for window in WINDOWS}
+        for i, m in enumerate(rules):
+            for window, ranges in m.intervals().items():
+                intervals[window].extend((lo, hi, i) for lo, hi in ranges)
+            for keyword in m.narration_keywords or ():
+                self.narration.add(keyword, i)
+            payee_keywords = (
+                m.narration_keywords
+                if m.payee_keywords is SAME_AS_NARRATION
+                else m.payee_keywords
+            )
+            for keyword in payee_keywords or ():
+                self.payee.add(keyword, i)
+        # one index per window, in the order of window_values
+        self.windows = [IntervalIndex(intervals[window]) for window in WINDOWS]
+
+    def __getstate__(self):
+        lines = [encode_rule(self.rule(i)) for i in range(self.count)]
+        offsets = array.array("l", [0])
+        for line in lines:
+            offsets.append(offsets[-1] + len(line) + 1)
+        return {
+            "encoded": "\n".join(lines),
+            "offsets": offsets,
+            "priorities": self.priorities,
+            "depths": self.depths,
+            "narration": self.narration,
+            "payee": self.payee,
+            "windows": self.windows,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.count = len(self.offsets) - 1
+        self.decoded = {}
+
+    def rule(self, i: int):
+        if (m := self.decoded.get(i)) is None:
+            line = self.encoded[self.offsets[i] : self.offsets[i + 1] - 1]
+            m = self.decoded[i] = decode_rule(line)
+        return m
+
+    @property
+    def rules(self) -> list:
+        return [self.rule(i) for i in range(self.count)]
+
+    @property
+    def windowed(self) -> bool:
+        return any(index.rules for index in self.windows)
+
+    def candidates(
+        self,
+        desc: typing.Optional[str],
+        payee: typing.Optional[str],
+        values: typing.Optional[tuple] = None,
+    ) -> list[int]:
+        """
+        Indexes of the rules, in their original order, with a keyword in the
+        narration or payee and whose windows contain the window_values.
+        """
+        found = set()
+        if desc is not None:
+            found |= self.narration.find(desc)
+        if payee is not None:
+            found |= self.payee.find(payee)
+        if found and values is not None:
+            for index, value in zip(self.windows, values):
+                found = index.filter(found, value)
+        return sorted(found)
+
+
+def account_depth(m) -> int:
+    if m.destination_account is None:
+        return 0
+    return m.destination_account.count(":") + 1
+
+
+def compatible(a: str, b: str) -> bool:
+    return a.startswith(b) or b.startswith(a)
+
+
+def target_type(m):
+    return (m.additional_metadata or {}).get("target_type")
+
+
+def windowed(m) -> bool:
+    return bool(m.intervals())
+
+
+def analyze_rules(rule_set: RuleSet, name: str) -> list[str]:
+    """
+    Find dead rules, which never match, shadowed rules, whose account always
+    loses to a rule of higher priority, and rules of equal priority with
+    overlapping keywords and incompatible accounts.
+    """
+    from china_bean_importers.common import SAME_AS_NARRATION
+
+    problems = []
+    rules = rule_set.rules
+    seen = {}
+    conflicts = set()
+    for i, m in enumerate(rules):
+        where = f"{name} rule {i + 1} {m}"
+        narration = m.narration_keywords or []
+        payee = (
+            narration if m.payee_keywords is SAME_AS_NARRATION else m.payee_keywords or []
+        )
+        key = repr(m)
+        if key in seen:
+            problems.append(f"{where} duplicates rule {seen[key] + 1}")
+            continue
+        seen[key] = i
+        if (
+            not narration
+            and not payee
+            or m.match_logic == "AND"
+            and not (narration and payee)
+            or any(all(lo >= hi for lo, hi in r) for r in m.intervals().values())
+        ):
+            problems.append(f"{where} can never match")
+            continue
+
+        # rules with a keyword contained in each keyword of this rule match
+        # wherever this rule matches through that keyword
+        covering = [
+            rule_set.narration.find(k) for k in narration
+        ] + [rule_set.payee.find(k) for k in payee]
+        others = set().union(*covering) - {i}
+        for j in sorted(others):
+            o = rules[j]
+            # a rule with windows refines the rules it overlaps
+            if (
+                not windowed(o)
+                and not windowed(m)
+                and o.priority == m.priority
+                and o.destination_account is not None
+                and m.destination_account is not None
+                and not compatible(o.destination_account, m.destination_account)
+                and (min(i, j), max(i, j)) not in conflicts
+            ):
+                conflicts.add((min(i, j), max(i, j)))
+                problems.append(
+                    f"{where} overlaps rule {j + 1} {o} with a conflicting account"
+                )
+        if m.destination_account is not None and m.match_logic == "OR":
+            if all(
+                any(
+                    rules[j].priority > m.priority
+                    and rules[j].match_logic == "OR"
+                    and not windowed(rules[j])
+                    and rules[j].destination_account is not None
+                    and target_type(rules[j]) in (None, target_type(m))
+                    for j in c - {i}
+                )
+                for c in covering
+            ):
+                problems.append(f"{where} is shadowed by rules of higher priority")
+    return problems
+
+
+def warn_rules(rule_set: RuleSet, name: str, limit: int = 50):
+    problems = analyze_rules(rule_set, name)
+    for problem in problems[:limit]:
+        print(f"WARNING: {problem}\n", file=sys.stderr)
+    if len(problems) > limit:
+        print(f"WARNING: {len(problems) - limit} more problems in {name}\n", file=sys.stderr)
+
+
+def read_rules(path: str) -> list:
+    """
+    Read rules from a CSV or TSV file with the columns narration_keywords,
+    payee_keywords, destination_account, tags, metadata, priority and
+    match_logic, and optionally amount_range, time_range, weekdays and
+    days_of_month. Keywords, tags and days are separated by "|", metadata is
+    written as "key=value;key=value" and payee_keywords may be
+    SAME_AS_NARRATION. Ranges are written as "min-max", either side may be
+    left out, and a single amount matches exactly.
+    """
+    from china_bean_importers.common import BillDetailMapping, SAME_AS_NARRATION
+
+    def split(cell):
+        return [c.strip() for c in cell.split("|") if c.strip()] if cell else None
+
+    def days(cell):
+        return [int(d) for d in split(cell)] if split(cell) else None
+
+    def amount_range(cell):
+        if not cell or not cell.strip():
+            return None
+        lo, sep, hi = cell.strip().partition("-")
+        if not sep:
+            return lo, lo
+        return lo.strip() or None, hi.strip() or None
+
+    def time_range(cell):
+        if not cell or not cell.strip():
+            return None
+        start, end = cell.split("-")
+        return start.strip(), end.strip()
+
+    rules = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        dialect = "excel-tab" if path.lower().endswith(".tsv") else "excel"
+        for row in csv.DictReader(f, dialect=dialect):
+            payee = row.get("payee_keywords") or ""
+            metadata = {}
+            for item in (row.get("metadata") or "").split(";"):
+                if "=" in item:
+                    k, v = item.split("=", 1)
+                    metadata[k.strip()] = v.strip()
+            rules.append(
+                BillDetailMapping(
+                    narration_keywords=split(row.get("narration_keywords")),
+                    payee_keywords=(
+                        SAME_AS_NARRATION
+                        if payee.strip() == "SAME_AS_NARRATION"
+                        else split(payee)
+                    ),
+                    destination_account=row.get("destination_account") or None,
+                    additional_tags=split(row.get("tags")),
+                    additional_metadata=metadata or None,
+                    priority=int(row.get("priority") or 0),
+                    match_logic=(row.get("match_logic") or "OR").upper(),
+                    amount_range=amount_range(row.get("amount_range")),
+                    time_range=time_range(row.get("time_range")),
+                    weekdays=days(row.get("weekdays")),
+                    days_of_month=days(row.get("days_of_month")),
+                )
+            )
+    return rules
+
+
+def source_stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return (RULE_PACK_VERSION, st.st_mtime_ns, st.st_size)
+
+
+def load_rule_pack(path: str) -> RuleSet:
+    """
+    The compiled rule set of a CSV/TSV rule file. It is kept as a pickle in
+    <path>.pack and compiled again when the source file changes.
+    """
+    pack = f"{path}.pack"
+    stamp = source_stamp(path)
+    try:
+        with open(pack, "rb") as f:
+            # the pack is a few large objects, collecting while loading only
+            # costs time
+            gc.disable()
+            try:
+                stored, rule_set = pickle.load(f)
+            finally:
+                gc.enable()
+        if stored == stamp:
+            return rule_set
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    rule_set = RuleSet(read_rules(path))
+    warn_rules(rule_set, path)
+    tmp = f"{pack}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump((stamp, rule_set), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, pack)
+    return rule_set
+
+
+# rule sets of the detail_mappings list and rule packs of a config
+_rule_sets: dict[tuple, tuple[list, list[RuleSet]]] = {}
+_rule_sets_lock = threading.Lock()
+
+
+def rule_sets(config) -> list[RuleSet]:
+    # rule packs are loaded once per run, after detail_mappings
+    mappings = config["detail_mappings"]
+    packs = tuple(config.get("rule_packs", ()))
+    key = (id(mappings), len(mappings), packs)
+    if (cached := _rule_sets.get(key)) is not None and cached[0] is mappings:
+        return cached[1]
+    with _rule_sets_lock:
+        sets = [RuleSet(list(mappings))] + [load_rule_pack(p) for p in packs]
+        warn_rules(sets[0], "detail_mappings")
+        _rule_sets[key] = (mappings, sets)
+    return sets
+
+
+def candidate_rules(config, desc, payee, values=None) -> list[tuple[tuple, object]]:
+    """
+    The rules that could match, in their original order, each with its rank
+    in the resolution order: higher priority first, then deeper accounts,
+    then earlier rules. The best ranked account among the matching rules is
+    the destination, which is what the pairwise merge gave for rules
+    without conflicts.
+    """
+    out = []
+    offset = 0
+    for s in rule_sets(config):
+        for i in s.candidates(desc, payee, values):
+            out.append(((-s.priorities[i], -s.depths[i], offset + i), s.rule(i)))
+        offset += s.count
+    return out
+
+
+def has_windows(config) -> bool:
+    return any(s.windowed for s in rule_sets(config))
+
+
+def has_raw_keywords(config) -> bool:
+    # whether matching depends on more than the canonical forms
+    return any(s.narration.raw or s.payee.raw for s in rule_sets(config))
+
+
+def all_rules(config) -> list:
+    return [m for s in rule_sets(config) for m in s.rules]
@@ -0,0 +1,97 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import typing
+
+
+class RuleStats:
+    """
+    Hits, evaluations and evaluation time of each rule, keyed by rule ID and
+    kept in a JSON file across runs. Saved when the process exits.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        # rule IDs by rule object, each rule is held here so that its id is
+        # not given to another rule
+        self.ids: dict[int, tuple[typing.Any, str]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        atexit.register(self.save)
+
+    def entry(self, m) -> dict:
+        from china_bean_importers.ruleindex import rule_id
+
+        if (held := self.ids.get(id(m))) is None:
+            held = self.ids[id(m)] = (m, rule_id(m))
+        rid = held[1]
+        if (e := self.entries.get(rid)) is None:
+            e = self.entries[rid] = {
+                "rule": repr(m),
+                "hits": 0,
+                "evaluations": 0,
+                "seconds": 0.0,
+            }
+        return e
+
+    def hits(self, m) -> int:
+        return self.entry(m)["hits"]
+
+    def match(self, m, desc, payee, expense, amount=None, when=None):
+        # BillDetailMapping.match, counted and timed
+        start = time.perf_counter()
+        result = m.match(desc, payee, expense=expense, amount=amount, when=when)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            e = self.entry(m)
+            e["evaluations"] += 1
+            e["seconds"] += elapsed
+            if result[0] is not None or result[1] or result[2]:
+                e["hits"] += 1
+        return result
+
+    def save(self):
+        with self.lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+
+
+_stats: dict[str, RuleStats] = {}
+_stats_lock = threading.Lock()
+
+
+def rule_stats(config) -> typing.Optional[RuleStats]:
+    path = config.get("rule_stats")
+    if path is None:
+        return None
+    with _stats_lock:
+        if (stats := _stats.get(path)) is None:
+            stats = _stats[path] = RuleStats(path)
+    return stats
+
+
+def print_rule_report(config, rules: list, hot: int = 20, file=sys.stdout):
+    """
+    List the rules that never fired and the most frequently hit ones, with
+    their evaluation cost.
+    """
+    stats = rule_stats(config)
+    entries = [(m, stats.entry(m)) for m in rules]
+    print("Dead rules:", file=file)
+    for m, e in entries:
+        if e["hits"] == 0:
+            print(f"  {m} (evaluated {e['evaluations']} times)", file=file)
+    print("Hot rules:", file=file)
+    for m, e in sorted(entries, key=lambda x: -x[1]["hits"])[:hot]:
+        if e["hits"] == 0:
+            break
+        cost = e["seconds"] / max(e["evaluations"], 1) * 1e6
+        print(f"  {e['hits']} hits, {cost:.1f} us/evaluation: {m}", file=file)
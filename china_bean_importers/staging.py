@@ -0,0 +1,183 @@
+import csv
+import json
+import sqlite3
+import threading
+import typing
+
+from beancount.core import data
+
+from china_bean_importers.dedup import ID_META_KEYS
+from china_bean_importers.ruleindex import (
+    current_rules,
+    index_keys,
+    record_rules,
+    rule_account,
+    ruleset_digest,
+    staged_when,
+)
+from china_bean_importers.rulepack import has_windows
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    fingerprint TEXT PRIMARY KEY,
+    source TEXT,
+    file TEXT,
+    lineno INTEGER,
+    date TEXT,
+    time TEXT,
+    -- in hundredths of the currency unit
+    amount INTEGER,
+    currency TEXT,
+    payee TEXT,
+    narration TEXT,
+    serial TEXT,
+    -- JSON list of the source columns, when known
+    raw TEXT,
+    account TEXT,
+    tags TEXT,
+    -- whether the account is the one given by detail_mappings
+    ruled INTEGER,
+    -- digest of the rule set the row was classified with
+    ruleset TEXT
+);
+CREATE INDEX IF NOT EXISTS rows_date ON rows (date);
+CREATE INDEX IF NOT EXISTS rows_amount ON rows (amount);
+CREATE INDEX IF NOT EXISTS rows_serial ON rows (serial);
+CREATE INDEX IF NOT EXISTS rows_key ON rows (narration, payee);
+-- rules of each rule set the rows were classified with, and the
+-- (narration, payee) keys each rule could match
+CREATE TABLE IF NOT EXISTS rules (
+    ruleset TEXT,
+    rule TEXT,
+    PRIMARY KEY (ruleset, rule)
+);
+CREATE TABLE IF NOT EXISTS rule_keys (
+    rule TEXT,
+    narration TEXT,
+    payee TEXT,
+    PRIMARY KEY (rule, narration, payee)
+);
+"""
+
+
+def csv_columns(line: str) -> list[str]:
+    return next(csv.reader([line]), [])
+
+
+def staged_row(
+    source: str,
+    entry: data.Transaction,
+    raw: typing.Optional[list],
+    ruled: bool,
+    ruleset: str,
+) -> tuple:
+    posting = entry.postings[0]
+    units = posting.units
+    return (
+        entry.meta.get("fingerprint"),
+        source,
+        entry.meta.get("filename"),
+        entry.meta.get("lineno"),
+        entry.date.isoformat(),
+        entry.meta.get("time"),
+        None if units is None else int(units.number.scaleb(2).to_integral_value()),
+        None if units is None else units.currency,
+        entry.payee or "",
+        entry.narration or "",
+        next((str(entry.meta[k]) for k in ID_META_KEYS if entry.meta.get(k)), None),
+        None if raw is None else json.dumps([str(c) for c in raw], ensure_ascii=False),
+        entry.postings[1].account if len(entry.postings) > 1 else None,
+        " ".join(sorted(entry.tags)),
+        ruled,
+        ruleset,
+    )
+
+
+def migrate(conn):
+    # stores written before the rule set of each row was recorded hold a
+    # single rule set, the one all their rows were classified with
+    if [c[1] for c in conn.execute("PRAGMA table_info(rules)")] != ["rule"]:
+        return
+    old = [r for (r,) in conn.execute("SELECT rule FROM rules")]
+    conn.execute("DROP TABLE rules")
+    conn.execute("ALTER TABLE rows ADD COLUMN ruleset TEXT")
+    if old:
+        conn.execute("UPDATE rows SET ruleset = ?", (ruleset_digest(old),))
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO rules VALUES (?, ?)", ((ruleset_digest(old), r) for r in old)
+    )
+
+
+class StagingStore:
+    """
+    Normalized rows of every import kept in a SQLite database, so that
+    history can be queried without extracting the statements again. Rows
+    are keyed by fingerprint, extracting a file again replaces its rows.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        migrate(self.conn)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def add(self, source: str, entries: list, raw_row: typing.Callable, config):
+        entries = [e for e in entries if isinstance(e, data.Transaction) and e.postings]
+        keys = {(e.narration or "", e.payee or "") for e in entries}
+        # the rules' account of each key, to tell it from accounts set by
+        # the importer
+        accounts = {}
+        rows = []
+        windowed = has_windows(config)
+        current = current_rules(config)
+        for e in entries:
+            units = e.postings[0].units
+            key = (e.narration or "", e.payee or "", units is not None and units.number < 0)
+            if windowed:
+                # window predicates depend on the amount and time as well
+                key += (
+                    None if units is None else units.number,
+                    staged_when(e.date.isoformat(), e.meta.get("time")),
+                )
+            if key not in accounts:
+                accounts[key] = rule_account(config, *key)
+            account = e.postings[1].account if len(e.postings) > 1 else None
+            rows.append(
+                staged_row(
+                    source,
+                    e,
+                    raw_row(e.meta.get("lineno")),
+                    accounts[key] == account,
+                    current.digest,
+                )
+            )
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO rows VALUES ({', '.join('?' * 16)})", rows
+            )
+            index_keys(self.conn, config, keys)
+            record_rules(self.conn, current)
+            self.conn.commit()
+
+    def query(self, sql: str, params=()) -> list[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+_stores: dict[str, StagingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def staging_store(config) -> typing.Optional[StagingStore]:
+    # importers sharing a config share one database
+    path = config.get("staging_db")
+    if path is None:
+        return None
+    with _stores_lock:
+        if (store := _stores.get(path)) is None:
+            store = _stores[path] = StagingStore(path)
+    return store
@@ -1,9 +1,11 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
-import csv
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount, format_cents, to_decimal
+from china_bean_importers.columnar import TableSpec, convert_table, read_table
+from china_bean_importers.dedup import is_overlap
 from china_bean_importers.importer import CsvImporter
 
 
@@ -12,86 +14,91 @@ class Importer(CsvImporter):
         super().__init__(config)
         self.match_keywords = ["mername"]
         self.file_account_name = "thu_ecard"
-        self.all_ids = set()
-
-    def parse_metadata(self, file):
-        if len(self.content) > 2:
-            if m := common_date_pattern.search(self.content[1]):
-                self.end = parse(m[1])
-            if m := common_date_pattern.search(self.content[-1]):
-                self.start = parse(m[1])
-
-    def extract(self, file, existing_entries=None):
+        # header on the first line, footer on the last line
+        self.table_spec = TableSpec(
+            roles={10: "datetime", 15: "cents", 20: "cents"},
+            skip_footer=1,
+        )
+
+    def parse_metadata(self, ctx):
+        if len(ctx.content) > 2:
+            if m := common_date_pattern.search(ctx.content[1]):
+                ctx.end = parse(m[1])
+            if m := common_date_pattern.search(ctx.content[-1]):
+                ctx.start = parse(m[1])
+
+    def extract_entries(self, ctx, existing_entries=None):
         entries = []
-
-        def to_yuan(fen) -> str:
-            from decimal import Decimal
-
-            d = (Decimal(fen) / 100).quantize(Decimal(".01"))
-            return d
-
-        for lineno, row in enumerate(csv.reader(self.content)):
-            row = [col.strip() for col in row]
-
-            #    0         1         2        3          4          5       6       7
-            # summary, posjourno, idserial, txaccno, inputuserid, pcode, poscode, accno
-            #    8         9    10      11        12           13      14     15,      16
-            # txcode, cardno, txdate, txname, stationcode, identityno, sts, balance, journo
-            #   17        18     19    20     21        22       23
-            # regdate, departid, id, txamt, meraddr, username, mername
-
-            # skip table header and footer
-            if lineno == 0:
-                continue
-            elif lineno == len(self.content) - 1:
-                break
-
-            # detect duplicate items by pos_journo
-            pos_journo = row[1].strip()
+        table = read_table(ctx.content, self.table_spec)
+        table = convert_table(table, self.table_spec)
+        source_account = self.config["importers"]["thu_ecard"]["account"]
+
+        #    0         1         2        3          4          5       6       7
+        # summary, posjourno, idserial, txaccno, inputuserid, pcode, poscode, accno
+        #    8         9    10      11        12           13      14     15,      16
+        # txcode, cardno, txdate, txname, stationcode, identityno, sts, balance, journo
+        #   17        18     19    20     21        22       23
+        # regdate, departid, id, txamt, meraddr, username, mername
+        rows = []
+        all_ids = set()
+        for lineno, row, raw in table.rows():
+            # detect duplicate items by pos_journo, both within the file and
+            # from overlapping exports, before classifying them
+            pos_journo = row[1]
             if pos_journo != "":
-                if pos_journo in self.all_ids:
-                    my_warn(f"Duplicate pos_journo detected: {pos_journo}", lineno, row)
+                if pos_journo in all_ids:
+                    my_warn(f"Duplicate pos_journo detected: {pos_journo}", lineno, raw)
                     continue
-                self.all_ids.add(pos_journo)
-
+                all_ids.add(pos_journo)
+                if is_overlap(source_account, pos_journo, ctx.file.name):
+                    continue
+            rows.append((lineno, row, raw))
+
+        summaries = [
+            row[0] if row[0] == row[11] else f"{row[0]}_{row[11]}"
+            for _, row, _ in rows
+        ]
+        matches = match_destination_and_metadata_batch(
+            self.config,
+            summaries,
+            [row[23] for _, row, _ in rows],
+            amounts=[to_decimal(row[20]) for _, row, _ in rows],
+            times=[row[10] for _, row, _ in rows],
+        )
+
+        for (lineno, row, raw), summary, match in zip(rows, summaries, matches):
             # parse data line
-            metadata: dict = data.new_metadata(file.name, lineno)
+            metadata: dict = data.new_metadata(ctx.file.name, lineno)
             tags = {"PendingReview"}
 
             # parse some basic info
-            summary = row[0]
-            time = parse(row[10])
-            units = amount.Amount(D(to_yuan(row[20])), "CNY")
-            balance = amount.Amount(D(to_yuan(row[15])), "CNY")
+            time = row[10]
+            cents = row[20]
             payee = row[23]
             addr = row[21]
-            tx_type = row[11]
-            if summary != tx_type:
-                summary = f"{summary}_{tx_type}"
 
-            metadata["balance"] = str(balance)
+            metadata["balance"] = f"{format_cents(row[15])} CNY"
             metadata["location"] = addr
             metadata["time"] = time.time().isoformat()
             metadata["payment_method"] = "清华大学校园卡"
+            if row[1] != "":
+                metadata["pos_journo"] = row[1]
 
             expense = None
 
-            if any(["消费", "补卡"], lambda k: k in summary):
+            if any(k in summary for k in ["消费", "补卡"]):
                 expense = True
-            elif any(["充值", "代发", "圈存"], lambda k: k in summary):
+            elif any(k in summary for k in ["充值", "代发", "圈存"]):
                 expense = False
 
-            my_assert(expense is not None, f"Unknown transaction type", lineno, row)
+            my_assert(expense is not None, f"Unknown transaction type", lineno, raw)
 
             if expense:
-                units = -units
+                cents = -cents
 
-            source_config = self.config["importers"]["thu_ecard"]
-            account1 = source_config["account"]
+            account1 = source_account
             account2 = unknown_account(self.config, expense)
-            new_account, new_meta, new_tags = match_destination_and_metadata(
-                self.config, summary, payee
-            )
+            new_account, new_meta, new_tags = match
             if new_account:
                 account2 = new_account
             metadata.update(new_meta)
@@ -109,7 +116,7 @@ class Importer(CsvImporter):
                 postings=[
                     data.Posting(
                         account=account1,
-                        units=units,
+                        units=cents_amount(cents, "CNY"),
                         cost=None,
                         price=None,
                         flag=None,
@@ -1,10 +1,11 @@
 from dateutil.parser import parse
-from beancount.core import data, amount
+from beancount.core import data
 from beancount.core.number import D
-import csv
 import re
 
 from china_bean_importers.common import *
+from china_bean_importers.amounts import cents_amount
+from china_bean_importers.columnar import TableSpec, convert_table, read_table
 from china_bean_importers.importer import CsvImporter
 
 
@@ -13,36 +14,38 @@ class Importer(CsvImporter):
         super().__init__(config)
         self.match_keywords = ["终端编号"]
         self.file_account_name = "thu_ecard_old"
-
-    def parse_metadata(self, file):
-        if len(self.content) > 2:
-            if m := re.search(r"([0-9]{4}-[0-9]{2}-[0-9]{2})", self.content[1]):
-                self.start = parse(m[1])
-            if m := re.search(r"([0-9]{4}-[0-9]{2}-[0-9]{2})", self.content[-2]):
-                self.end = parse(m[1])
-
-    def extract(self, file, existing_entries=None):
+        # header on the first line, footer on the last line
+        self.table_spec = TableSpec(
+            roles={4: "datetime", 5: "amount"},
+            skip_footer=1,
+        )
+
+    def parse_metadata(self, ctx):
+        if len(ctx.content) > 2:
+            if m := re.search(r"([0-9]{4}-[0-9]{2}-[0-9]{2})", ctx.content[1]):
+                ctx.start = parse(m[1])
+            if m := re.search(r"([0-9]{4}-[0-9]{2}-[0-9]{2})", ctx.content[-2]):
+                ctx.end = parse(m[1])
+
+    def extract_entries(self, ctx, existing_entries=None):
         entries = []
+        table = read_table(ctx.content, self.table_spec)
+        table = convert_table(table, self.table_spec)
 
-        for lineno, row in enumerate(csv.reader(self.content)):
-            row = [col.strip() for col in row]
-
-            #  0      1        2        3       4        5
-            # 序号, 交易地点, 交易类型, 终端编号, 交易时间, 交易金额
-
-            # skip table header and footer
-            if lineno == 0:
-                continue
-            elif lineno == len(self.content) - 1:
-                break
+        #  0      1        2        3       4        5
+        # 序号, 交易地点, 交易类型, 终端编号, 交易时间, 交易金额
+        matches = match_destination_and_metadata_batch(
+            self.config, table.column(2), table.column(1)
+        )
 
+        for (lineno, row, raw), match in zip(table.rows(), matches):
             # parse data line
-            metadata: dict = data.new_metadata(file.name, lineno)
+            metadata: dict = data.new_metadata(ctx.file.name, lineno)
             tags = {"PendingReview"}
 
             # parse some basic info
-            time = parse(row[4])
-            units = amount.Amount(D(row[5]), "CNY")
+            time = row[4]
+            cents = row[5]
             _, payee, type, terminal = row[:4]
             metadata["terminal"] = terminal
             metadata["time"] = time.time().isoformat()
@@ -55,17 +58,15 @@ class Importer(CsvImporter):
             elif "领取" in type or type == "支付宝充值":
                 expense = False
 
-            my_assert(expense is not None, f"Unknown transaction type", lineno, row)
+            my_assert(expense is not None, f"Unknown transaction type", lineno, raw)
 
             if expense:
-                units = -units
+                cents = -cents
 
             source_config = self.config["importers"]["thu_ecard"]
             account1 = source_config["account"]
             account2 = unknown_account(self.config, expense)
-            new_account, new_meta, new_tags = match_destination_and_metadata(
-                self.config, type, payee
-            )
+            new_account, new_meta, new_tags = match
             if new_account:
                 account2 = new_account
             metadata.update(new_meta)
@@ -85,7 +86,7 @@ class Importer(CsvImporter):
                 postings=[
                     data.Posting(
                         account=account1,
-                        units=units,
+                        units=cents_amount(cents, "CNY"),
                         cost=None,
                         price=None,
                         flag=None,
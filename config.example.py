@@ -60,9 +60,45 @@ config = {
     # account matching
     "unknown_expense_account": "Expenses:Unknown",
     "unknown_income_account": "Income:Unknown",
+    # The settings below are optional and off when left out. Uncomment the
+    # ones you need; most keep a file or directory at the given path.
+    #
+    # column geometry learned from PDF statement headers
+    # "layout_cache": "pdf_layouts.json",
+    # fingerprints of accepted imports, to recognize re-imports
+    # "fingerprint_index": "fingerprints.sqlite",
+    # drop re-imported rows instead of marking them as duplicates
+    # "skip_duplicates": False,
+    # normalized rows of every import, for queries over history
+    # "staging_db": "staging.sqlite",
+    # parsed statements, re-runs only classify the cached rows
+    # "row_cache": "row_cache",
+    # Parquet files of the imported transactions, for analytics (needs pyarrow)
+    # "parquet_export": "parquet",
+    # classifier trained from the ledger, for rows no mapping matches (needs
+    # numpy); train it first with
+    # python -m china_bean_importers.classifier main.bean classifier.npz
+    # "classifier_model": "classifier.npz",
+    # "classifier_min_confidence": 0.9,
+    # additional rules in CSV/TSV files you write, compiled to <file>.pack;
+    # the files must exist
+    # "rule_packs": ["merchants.csv"],
+    # per-rule hit counts and evaluation time, kept across runs
+    # "rule_stats": "rule_stats.json",
     "detail_mappings": [
         BDM(["京东"], [], "Expenses:JD", [], {"platform": "京东"}),
         BDM([], ["饿了么"], "Expenses:Food:Delivery", [], {"platform": "饿了么"}),
         BDM([], ["万龙运动旅游"], None, ["ski"], {}),
+        # 11:00-14:00 Meituan payments up to 50 CNY are lunch
+        BDM(
+            ["美团"],
+            [],
+            "Expenses:Food:Lunch",
+            priority=1,
+            amount_range=(None, 50),
+            time_range=("11:00", "14:00"),
+        ),
+        # transfers of exactly 3000 CNY on the 1st are rent
+        BDM(["转账"], [], "Expenses:Rent", amount_range=(3000, 3000), days_of_month=[1]),
     ],
 }
@@ -0,0 +1,32 @@
+# a WeChat bill and the config to import it, shared by the tests
+
+WECHAT_HEADER = """微信支付账单明细,,,,,,,,
+微信昵称：[123412341234],,,,,,,,
+起始时间：[2023-01-01 00:00:00] 终止时间：[2023-02-01 00:00:00],,,,,,,,
+
+----------------------微信支付账单明细列表--------------------,,,,,,,,
+交易时间,交易类型,交易对方,商品,收/支,金额(元),支付方式,当前状态,交易单号,商户单号,备注
+"""
+
+WECHAT_CONFIG = {
+    "importers": {
+        "wechat": {
+            "account": "Assets:WeChat",
+            "lingqiantong_account": "Assets:WeChat:LingQianTong",
+            "red_packet_income_account": "Income:WeChat:RedPacket",
+            "red_packet_expense_account": "Expenses:WeChat:RedPacket",
+            "family_card_expense_account": "Expenses:WeChat:FamilyCard",
+            "group_payment_expense_account": "Expenses:WeChat:Group",
+            "group_payment_income_account": "Income:WeChat:Group",
+            "transfer_expense_account": "Expenses:WeChat:Transfer",
+            "transfer_income_account": "Income:WeChat:Transfer",
+        },
+        "card_narration_whitelist": [],
+        "card_narration_blacklist": [],
+    },
+    "card_accounts": {},
+    "pdf_passwords": [],
+    "unknown_expense_account": "Expenses:Unknown",
+    "unknown_income_account": "Income:Unknown",
+    "detail_mappings": [],
+}
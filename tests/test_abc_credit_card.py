@@ -0,0 +1,58 @@
+from email.message import EmailMessage
+
+import pytest
+
+pytest.importorskip("lxml")
+
+from beancount.ingest import cache
+
+from china_bean_importers import abc_credit_card
+
+CONFIG = {
+    "importers": {
+        "card_narration_whitelist": [],
+        "card_narration_blacklist": ["支付宝"],
+    },
+    "card_accounts": {"Liabilities:CreditCard": {"ABC": ["1234"]}},
+    "pdf_passwords": [],
+    "unknown_expense_account": "Expenses:Unknown",
+    "unknown_income_account": "Income:Unknown",
+    "detail_mappings": [],
+}
+
+ROWS = [
+    ("230102", "230103", "1234", "消费，星巴克", "-30.00/CNY", "-30.00/CNY"),
+    ("230104", "230105", "1234", "支付宝，某店", "-9.00/CNY", "-9.00/CNY"),
+    ("230106", "230107", "1234", "消费，全家", "-1.2.3/CNY", "-1.2.3/CNY"),
+]
+
+
+def statement(path):
+    cells = "".join(
+        "<tr>" + "".join(f"<td>{c}</td>" for c in row) + "</tr>" for row in ROWS
+    )
+    msg = EmailMessage()
+    msg["From"] = "creditcard@abchina.com"
+    msg["Subject"] = "中国农业银行信用卡电子对账单"
+    msg.set_content(
+        "<html><body><table><tr><td>交易日期</td><td>交易说明</td></tr></table>"
+        f"<table>{cells}</table></body></html>",
+        subtype="html",
+    )
+    path.write_bytes(bytes(msg))
+
+
+def test_extract(tmp_path, capsys):
+    bill = tmp_path / "abc.eml"
+    statement(bill)
+    importer = abc_credit_card.Importer(CONFIG)
+    file = cache.get_file(str(bill))
+    assert importer.identify(file)
+    (entry,) = importer.extract(file, [])
+    assert entry.narration == "消费"
+    assert entry.payee == "星巴克"
+    assert str(entry.postings[0].units) == "-30.00 CNY"
+    assert entry.postings[0].account == "Liabilities:CreditCard:ABC:1234"
+    # built through BaseImporter.extract, like the other importers
+    assert "fingerprint" in entry.meta
+    assert "Invalid amount, row skipped" in capsys.readouterr().err
@@ -0,0 +1,36 @@
+import pytest
+
+from china_bean_importers.amounts import cell_cents, format_cents, parse_cents
+
+
+@pytest.mark.parametrize(
+    "text, cents",
+    [
+        ("12.50", 1250),
+        ("12.5", 1250),
+        ("-3", -300),
+        (".5", 50),
+        ("-.05", -5),
+        ("1.2300", 123),
+        ("¥1,234.56", 123456),
+        ("- ￥ 1,234.5", -123450),
+        ("12.50(支出)", -1250),
+        ("12.50（存入）", 1250),
+    ],
+)
+def test_parse_cents(text, cents):
+    assert parse_cents(text) == cents
+
+
+@pytest.mark.parametrize("text", ["", ".", "-", "1.", "1,23.4", "abc", "1.2345"])
+def test_parse_cents_rejects(text):
+    with pytest.raises(ValueError):
+        parse_cents(text)
+
+
+def test_cell_cents():
+    assert cell_cents(None) is None
+    assert cell_cents(float("nan")) is None
+    assert cell_cents(" ") is None
+    assert cell_cents(12.5) == 1250
+    assert format_cents(cell_cents("1,000")) == "1000.00"
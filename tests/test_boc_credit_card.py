@@ -0,0 +1,50 @@
+import datetime
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from beancount.ingest import cache
+
+from china_bean_importers import boc_credit_card, pdf
+
+CONFIG = {
+    "importers": {
+        "card_narration_whitelist": [],
+        "card_narration_blacklist": [],
+    },
+    "card_accounts": {"Liabilities:CreditCard": {"BoC": ["1234"]}},
+    "pdf_passwords": [],
+    "unknown_expense_account": "Expenses:Unknown",
+    "unknown_income_account": "Income:Unknown",
+    "detail_mappings": [],
+}
+
+
+def statement(path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Current FCY Total Balance Due")
+    page.insert_text((72, 144), "2023-01-15\n2023-02-05")
+    for i in range(2):
+        doc.new_page().insert_text((72, 72), f"page {i + 1}")
+    doc.save(str(path))
+
+
+def test_first_page_is_read_once(tmp_path, monkeypatch):
+    built = []
+
+    class CountingPageText(pdf.PageText):
+        def __init__(self, page, flags):
+            built.append(page.number)
+            super().__init__(page, flags)
+
+    monkeypatch.setattr(pdf, "PageText", CountingPageText)
+    bill = tmp_path / "中国银行信用卡.pdf"
+    statement(bill)
+    importer = boc_credit_card.Importer(CONFIG)
+    file = cache.get_file(str(bill))
+    assert importer.identify(file)
+    assert importer.file_date(file) == datetime.datetime(2023, 1, 15)
+    assert importer.extract(file, []) == []
+    assert built == [0, 1, 2]
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+from china_bean_importers import (
+    cmb_debit_card,
+    cmbc_credit_card,
+    cmbc_debit_card,
+    icbc_credit_card,
+    icbc_debit_card,
+)
+
+CONFIG = {
+    "importers": {
+        "card_narration_whitelist": [],
+        "card_narration_blacklist": [],
+    },
+    "card_accounts": {},
+    "pdf_passwords": [],
+    "unknown_expense_account": "Expenses:Unknown",
+    "unknown_income_account": "Income:Unknown",
+    "detail_mappings": [],
+}
+
+FILE = SimpleNamespace(name="bill.pdf")
+
+
+@pytest.mark.parametrize(
+    "gen_txn, parts",
+    [
+        (
+            lambda parts: cmb_debit_card.gen_txn(
+                CONFIG, FILE, parts, 1, "*", "Assets:Card", "张三"
+            ),
+            ["2023-01-02", "CNY", "1.2.3", "100.00", "消费", "星巴克"],
+        ),
+        (
+            lambda parts: cmbc_debit_card.gen_txn(
+                CONFIG, FILE, parts, 1, "*", "Assets:Card"
+            ),
+            ["2023-01-02 10:00:00", "消费", "1.2.3", "100.00"],
+        ),
+        (
+            lambda parts: icbc_debit_card.gen_txn(
+                CONFIG, FILE, parts, 1, "*", "Assets:Card", "张三"
+            ),
+            ["2023-01-02 10:00:00", "1234", "", "", "人民币", "钞", "消费", "北京",
+             "1.2.3", "100.00", "星巴克", "", "POS"],
+        ),
+    ],
+)
+def test_debit_card_rows_with_invalid_amounts_are_skipped(gen_txn, parts, capsys):
+    assert gen_txn(parts) is None
+    assert "Invalid amount, row skipped" in capsys.readouterr().err
+
+
+def test_credit_card_rows_with_invalid_amounts_are_skipped(capsys):
+    cmbc = cmbc_credit_card.Importer(CONFIG)
+    row = ["2023/01/02", "2023/01/03", "1234", "星巴克", "1.2.3", "CNY"]
+    assert cmbc.generate_tx(row, 1, SimpleNamespace(file=FILE)) is None
+    icbc = icbc_credit_card.Importer(CONFIG)
+    txn = {
+        icbc_credit_card.C_DST: "1.2.3/RMB(支出)",
+        icbc_credit_card.C_DATE: "2023-01-02",
+        icbc_credit_card.C_CARD_NUMBER: "1234",
+        icbc_credit_card.C_TYPE: "消费",
+    }
+    assert icbc.to_beancount_txn(txn, "bill.eml", 1) is None
+    assert capsys.readouterr().err.count("Invalid amount, row skipped") == 2
@@ -0,0 +1,48 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from beancount.core import amount, data
+
+from china_bean_importers.classifier import Classifier
+
+
+def entry(narration, payee, account):
+    return data.Transaction(
+        {"filename": "ledger.bean", "lineno": 1},
+        datetime.date(2023, 1, 2),
+        "*",
+        payee,
+        narration,
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting(
+                "Assets:Cash", amount.Amount(Decimal("-12.50"), "CNY"), None, None, None, None
+            ),
+            data.Posting(account, None, None, None, None, None),
+        ],
+    )
+
+
+def test_batches_score_like_single_rows():
+    model = Classifier.train(
+        [
+            entry("咖啡", "星巴克", "Expenses:Coffee"),
+            entry("外卖", "饿了么", "Expenses:Food"),
+            entry("工资", "公司", "Income:Salary"),
+        ]
+    )
+    rows = [("拿铁", "星巴克", True), ("午饭", "饿了么", True), ("", None, True), ("工资", "公司", False)]
+    narrations, payees, expenses = map(list, zip(*rows))
+    predicted = model.predict(narrations, payees, expenses)
+    assert [account for account, _ in predicted] == [
+        "Expenses:Coffee",
+        "Expenses:Food",
+        "Expenses:Coffee",
+        "Income:Salary",
+    ]
+    assert predicted == [model.predict([n], [p], [e])[0] for n, p, e in rows]
@@ -0,0 +1,70 @@
+import datetime
+import gc
+import tracemalloc
+from decimal import Decimal
+
+from beancount.core import amount, data
+
+from china_bean_importers.compact import compact_entries
+
+
+def make_entries(n: int) -> list:
+    # strings equal across rows but built per row, as parsers do
+    entries = []
+    for i in range(n):
+        entries.append(
+            data.Transaction(
+                {"filename": "bill.csv", "lineno": i, "status": "".join(["支付", "成功"])},
+                datetime.date(2023, 1, 1),
+                "*",
+                "".join(["京东", "商城", "自营旗舰店"]),
+                f"订单 {i}",
+                {"".join(["Pending", "Review"])},
+                data.EMPTY_SET,
+                [
+                    data.Posting(
+                        "".join(["Assets:", "WeChat"]),
+                        amount.Amount(Decimal(-i), "".join(["C", "NY"])),
+                        None,
+                        None,
+                        None,
+                        None,
+                    ),
+                    data.Posting(
+                        "".join(["Expenses:", "Shopping"]), None, None, None, None, None
+                    ),
+                ],
+            )
+        )
+    return entries
+
+
+def retained(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+def test_compact_entries_share_repeated_values():
+    a, b = compact_entries(make_entries(2))
+    assert a.payee is b.payee
+    assert a.tags is b.tags
+    assert a.meta["status"] is b.meta["status"]
+    assert a.postings[1].account is b.postings[1].account
+    assert a.postings[0].units.currency is b.postings[0].units.currency
+    assert a.narration == "订单 0"
+
+
+def test_compact_entries_retain_less_memory():
+    n = 5000
+    plain = retained(lambda: make_entries(n))
+    compact = retained(lambda: compact_entries(make_entries(n)))
+    # payee, accounts, currency, status and tags are shared by all rows
+    assert compact < plain * 3 / 4
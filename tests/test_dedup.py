@@ -0,0 +1,138 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from beancount.core import amount, data
+from beancount.ingest import cache
+from beancount.ingest.extract import DUPLICATE_META
+
+from china_bean_importers import wechat
+from china_bean_importers.dedup import (
+    LedgerIndex,
+    clear_imported_ids,
+    end_run,
+    is_overlap,
+)
+from china_bean_importers.fingerprint import FingerprintIndex, add_fingerprints
+from china_bean_importers.pending import PendingTransaction
+
+from bills import WECHAT_CONFIG as CONFIG, WECHAT_HEADER as HEADER
+
+
+@pytest.fixture(autouse=True)
+def new_run():
+    clear_imported_ids()
+    yield
+    clear_imported_ids()
+
+
+def transaction(account, number, **meta):
+    return data.Transaction(
+        {"filename": "ledger.bean", "lineno": 1, **meta},
+        datetime.date(2023, 1, 2),
+        "*",
+        None,
+        "",
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting(
+                account, amount.Amount(Decimal(number), "CNY"), None, None, None, None
+            )
+        ],
+    )
+
+
+def pending(account, cents, txid=None):
+    return PendingTransaction(
+        datetime.date(2023, 1, 2), None, account, cents, "CNY", txid, None
+    )
+
+
+def test_overlap_is_per_run():
+    assert not is_overlap("Assets:WeChat", "1001", "a.csv")
+    assert not is_overlap("Assets:WeChat", "1001", "a.csv")
+    assert is_overlap("Assets:WeChat", "1001", "b.csv")
+    assert not is_overlap("Assets:Alipay", "1001", "b.csv")
+    assert not is_overlap("Assets:WeChat", "", "b.csv")
+    assert end_run([("b.csv", [])], []) == [("b.csv", [])]
+    assert not is_overlap("Assets:WeChat", "1001", "b.csv")
+
+
+def test_filtered_rows_do_not_claim_their_serial(tmp_path):
+    first = tmp_path / "wechat_a.csv"
+    first.write_text(
+        HEADER + "2023-01-02 10:00:00,零钱提现,招商银行(3333),/,/,¥50.00,"
+        "零钱,提现失败，已退回零钱,1001\t,/,/\n"
+    )
+    second = tmp_path / "wechat_b.csv"
+    second.write_text(
+        HEADER + "2023-01-02 10:00:00,商户消费,京东商城,京东购物,支出,¥12.50,"
+        "零钱,支付成功,1001\t,m1,/\n"
+    )
+    importer = wechat.Importer(CONFIG)
+    assert importer.extract(cache.get_file(str(first)), []) == []
+    entries = importer.extract(cache.get_file(str(second)), [])
+    assert [e.meta["serial"] for e in entries] == ["1001"]
+
+
+def test_ledger_index_marks_each_posting_once():
+    index = LedgerIndex([transaction("Assets:Card", "-12.50")])
+    marked = index.mark_duplicates(
+        [transaction("Assets:Card", "-12.5"), transaction("Assets:Card", "-12.50")]
+    )
+    assert [DUPLICATE_META in e.meta for e in marked] == [True, False]
+
+
+def test_ledger_index_matches_transaction_ids():
+    index = LedgerIndex([transaction("Assets:WeChat", "-1", serial="1001")])
+    kept = index.drop_duplicates(
+        [
+            pending("Assets:WeChat", -100, ("serial", "1001")),
+            pending("Assets:WeChat", -100, ("serial", "1002")),
+        ]
+    )
+    assert [e.txid for e in kept] == [("serial", "1002")]
+
+
+def test_fingerprints_recognize_accepted_imports(tmp_path):
+    built = add_fingerprints("wechat", [transaction("Assets:WeChat", "-12.5")])
+    rows = add_fingerprints(
+        "wechat", [pending("Assets:WeChat", -1250), pending("Assets:WeChat", -1250)]
+    )
+    # identical rows of a file are told apart, the first one matches the
+    # built entry whatever the display of its amount
+    assert rows[0].fingerprint == built[0].meta["fingerprint"]
+    assert rows[1].fingerprint != rows[0].fingerprint
+
+    index = FingerprintIndex(str(tmp_path / "fingerprints.sqlite"))
+    index.add(built)
+    assert [e.fingerprint for e in index.drop_duplicates(rows)] == [rows[1].fingerprint]
+    marked = index.mark_duplicates(built)
+    assert marked[0].meta[DUPLICATE_META]
+
+
+def test_overlapping_rows_are_not_classified(tmp_path, monkeypatch):
+    classified = []
+
+    def batch(config, descs, payees, **kwargs):
+        classified.extend(payees)
+        return [(None, {}, set())] * len(payees)
+
+    monkeypatch.setattr(wechat, "match_destination_and_metadata_batch", batch)
+    rows = (
+        "2023-01-02 10:00:00,商户消费,京东商城,京东购物,支出,¥12.50,零钱,支付成功,1001\t,m1,/\n"
+    )
+    first = tmp_path / "wechat_a.csv"
+    first.write_text(HEADER + rows)
+    second = tmp_path / "wechat_b.csv"
+    second.write_text(
+        HEADER
+        + rows
+        + "2023-01-03 10:00:00,商户消费,饿了么,午饭,支出,¥20.00,零钱,支付成功,1002\t,m2,/\n"
+    )
+    importer = wechat.Importer(CONFIG)
+    importer.extract(cache.get_file(str(first)), [])
+    entries = importer.extract(cache.get_file(str(second)), [])
+    assert [e.meta["serial"] for e in entries] == ["1002"]
+    assert classified == ["京东商城", "饿了么"]
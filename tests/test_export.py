@@ -0,0 +1,49 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from beancount.core import amount, data
+
+from china_bean_importers.export import ParquetExporter
+from china_bean_importers.fingerprint import add_fingerprints
+
+
+def transaction(day: int, serial: str):
+    return data.Transaction(
+        {"filename": "bill.csv", "lineno": day, "serial": serial},
+        datetime.date(2023, 1, day),
+        "*",
+        "京东",
+        "购物",
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting(
+                "Assets:WeChat", amount.Amount(Decimal("-12.50"), "CNY"), None, None, None, None
+            ),
+            data.Posting("Expenses:Shopping", None, None, None, None, None),
+        ],
+    )
+
+
+def exported(path) -> list:
+    return sorted(pq.read_table(str(path), columns=["serial"]).column("serial").to_pylist())
+
+
+def test_overlapping_statements_are_exported_once(tmp_path):
+    exporter = ParquetExporter(str(tmp_path / "parquet"))
+    first = add_fingerprints("wechat", [transaction(1, "1"), transaction(2, "2")])
+    second = add_fingerprints("wechat", [transaction(2, "2"), transaction(3, "3")])
+    exporter.write("wechat", str(tmp_path / "a.csv"), first)
+    exporter.write("wechat", str(tmp_path / "b.csv"), second)
+    assert exported(tmp_path / "parquet") == ["1", "2", "3"]
+    # exporting a statement again replaces its own rows only
+    exporter.write("wechat", str(tmp_path / "a.csv"), first)
+    exporter.write("wechat", str(tmp_path / "b.csv"), second)
+    assert exported(tmp_path / "parquet") == ["1", "2", "3"]
+    # a statement whose rows all come from others leaves no file
+    exporter.write("wechat", str(tmp_path / "c.csv"), first)
+    assert exported(tmp_path / "parquet") == ["1", "2", "3"]
@@ -0,0 +1,88 @@
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from china_bean_importers.importer import PdfImporter, PdfTableImporter
+from china_bean_importers.pdf import DocumentText
+
+COLUMNS = [40, 140, 320, 420, 520]
+HEADER = ["交易日期", "摘要", "金额", "余额"]
+# rows of each page, the last row of the first page continues on the second
+PAGES = [
+    [
+        HEADER,
+        ["2023-01-02", "星巴克", "-30.00", "970.00"],
+        ["2023-01-03", ["工资", "一月"], "5000.00", "5970.00"],
+        ["2023-01-04", "京东商城", "-12.50", "5957.50"],
+    ],
+    [
+        ["", "自营旗舰店", "", ""],
+        ["2023-01-05", "饿了么", "-20.00", "5937.50"],
+    ],
+]
+
+
+def ruled_table(page, rows, top=60, height=30):
+    bottom = top + height * len(rows)
+    for x in COLUMNS:
+        page.draw_line((x, top), (x, bottom))
+    for i, row in enumerate(rows):
+        y = top + height * i
+        page.draw_line((COLUMNS[0], y), (COLUMNS[-1], y))
+        for x, cell in zip(COLUMNS, row):
+            lines = [cell] if isinstance(cell, str) else cell
+            for j, line in enumerate(lines):
+                page.insert_text((x + 4, y + 12 + 11 * j), line, fontname="china-s", fontsize=9)
+    page.draw_line((COLUMNS[0], bottom), (COLUMNS[-1], bottom))
+
+
+def make_doc():
+    doc = fitz.open()
+    for rows in PAGES:
+        ruled_table(doc.new_page(), rows)
+    return doc
+
+
+def test_ruled_grid_agrees_with_find_tables():
+    importer = PdfTableImporter({})
+    importer.file_account_name = "test"
+    importer.header_first_cell = HEADER[0]
+    with DocumentText(make_doc()) as text:
+        assert importer.calibrate_tables(text) == COLUMNS
+        found = [
+            row for page in text for tbl in page.page.find_tables().tables
+            for row in tbl.extract()
+        ]
+        grid = list(importer.table_rows(text))
+    assert grid == found
+    assert grid[3] == ["2023-01-04", "京东商城", "-12.50", "5957.50"]
+    assert grid[2][1] == "工资\n一月"
+    # the split row comes out as two rows, one on each page
+    assert grid[4] == ["", "自营旗舰店", "", ""]
+
+
+def test_calibrated_columns_clip_the_table():
+    doc = fitz.open()
+    page = doc.new_page()
+    for x, label in zip(COLUMNS, HEADER):
+        page.insert_text((x + 2, 60), label, fontname="china-s", fontsize=9)
+    for i, row in enumerate(PAGES[0][1:]):
+        # a note in the margin of each row, left of the table
+        page.insert_text((4, 80 + 20 * i), "副本", fontname="china-s", fontsize=9)
+        for x, cell in zip(COLUMNS, row):
+            cell = cell if isinstance(cell, str) else "".join(cell)
+            page.insert_text((x + 2, 80 + 20 * i), cell, fontname="china-s", fontsize=9)
+    page.insert_text((COLUMNS[0] + 2, 160), "合计", fontname="china-s", fontsize=9)
+
+    importer = PdfImporter({})
+    importer.file_account_name = "test"
+    importer.column_headers = HEADER
+    importer.content_start_keyword = HEADER[-1]
+    importer.content_stop_keyword = "合计"
+    with DocumentText(doc) as text:
+        rows = list(importer.read_rows(text))
+    assert rows == [
+        ["2023-01-02", "星巴克", "-30.00", "970.00"],
+        ["2023-01-03", "工资一月", "5000.00", "5970.00"],
+        ["2023-01-04", "京东商城", "-12.50", "5957.50"],
+    ]
@@ -0,0 +1,86 @@
+from china_bean_importers.common import (
+    BillDetailMapping,
+    match_destination_and_metadata,
+    match_destination_and_metadata_batch,
+)
+from china_bean_importers.normalize import (
+    _normalizer,
+    canonical,
+    canonical_id,
+    clear_canonical_forms,
+    contains,
+)
+from china_bean_importers.rulepack import KeywordIndex
+
+
+def make_config(*rules):
+    return {
+        "detail_mappings": list(rules),
+        "unknown_expense_account": "Expenses:Unknown",
+        "unknown_income_account": "Income:Unknown",
+    }
+
+
+def test_canonical_folds_width_case_spacing_and_long_numbers():
+    assert canonical("ＳＴＡＲ bucks 12345678") == "starbucks"
+    assert canonical_id("Star Bucks") == canonical_id("starbucks")
+    assert canonical("订单1234567") == "订单1234567"
+
+
+def test_contains_matches_canonical_forms():
+    assert contains("ＭＣＤＯＮＡＬＤ'Ｓ 20230101123456", "mcdonald's")
+    assert contains("滴滴 出行", "滴滴出行")
+    assert not contains("滴滴", "滴滴出行")
+
+
+def test_keywords_keep_their_numbers():
+    assert contains("张三 6222020200112233445", "6222020200112233445")
+    assert not contains("张三 6222020200999999999", "6222020200112233445")
+    assert contains("ETC12345678 通行费", "ETC12345678")
+    assert not contains("Netcom 宽带", "ETC12345678")
+    assert contains("ｅｔｃ 12345678 通行费", "ETC12345678")
+
+
+def test_short_numbers_match_inside_long_numbers():
+    # a card tail or a short code inside a number dropped from the text
+    assert contains("转账 6222020200112233333", "3333")
+    assert contains("12306 订单 E123456789", "12306")
+    assert not contains("转账 6222020200112234444", "3333")
+    index = KeywordIndex()
+    index.add("3333", 0)
+    index.add("转账", 1)
+    assert index.find("转账 6222020200112233333") == {0, 1}
+    assert index.find("转账 6222020200112234444") == {1}
+
+
+def test_canonical_forms_are_cleared_at_the_end_of_a_run():
+    canonical("一次性的描述 20230101123456")
+    assert _normalizer.raw
+    clear_canonical_forms()
+    assert not _normalizer.raw and not _normalizer.forms
+    assert canonical("一次性的描述 20230101123456") == "一次性的描述"
+
+
+def test_batch_keys_on_raw_strings_with_number_keywords():
+    config = make_config(
+        BillDetailMapping(
+            ["6222020200112233445"], [], "Expenses:Rent", [], {"landlord": "张三"}
+        )
+    )
+    descs = ["张三 6222020200999999999", "张三 6222020200112233445"]
+    results = match_destination_and_metadata_batch(config, descs, [None, None])
+    assert [r[0] for r in results] == [None, "Expenses:Rent"]
+    assert results == [
+        match_destination_and_metadata(config, d, None) for d in descs
+    ]
+
+
+def test_batch_shares_results_by_canonical_form():
+    config = make_config(
+        BillDetailMapping(["星巴克"], [], "Expenses:Coffee", [], {}),
+    )
+    results = match_destination_and_metadata_batch(
+        config, ["星巴克 20230101123456", "星巴克  20230102654321", "全家"], [None] * 3
+    )
+    assert results[0] is results[1]
+    assert [r[0] for r in results] == ["Expenses:Coffee", "Expenses:Coffee", None]
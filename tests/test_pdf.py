@@ -0,0 +1,57 @@
+import weakref
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from china_bean_importers import pdf
+from china_bean_importers.pdf import DocumentText
+
+
+def make_doc(pages: int):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"page {i}")
+    return doc
+
+
+def test_iteration_keeps_a_bounded_number_of_pages():
+    alive = weakref.WeakSet()
+    most = 0
+    with DocumentText(make_doc(1000)) as text:
+        for i, page in enumerate(text):
+            assert page.text().strip() == f"page {i}"
+            alive.add(page)
+            most = max(most, len(alive))
+    assert most <= DocumentText.recent_pages
+
+
+def test_passes_share_recent_pages(monkeypatch):
+    built = []
+
+    class CountingPageText(pdf.PageText):
+        def __init__(self, page, flags):
+            built.append(page.number)
+            super().__init__(page, flags)
+
+    monkeypatch.setattr(pdf, "PageText", CountingPageText)
+    with DocumentText(make_doc(10)) as text:
+        # a calibration pass stopping at the second page, then a full read
+        for page in text:
+            if page.page.number == 1:
+                break
+        assert [page.text().strip() for page in text] == [
+            f"page {i}" for i in range(10)
+        ]
+    assert built == list(range(10))
+
+
+def test_pages_by_index_are_kept():
+    with DocumentText(make_doc(3)) as text:
+        assert text.page(0) is text.page(0)
+        assert next(iter(text)) is text.page(0)
+
+
+def test_pages_from_an_index():
+    with DocumentText(make_doc(3)) as text:
+        assert [page.page.number for page in text.pages(1)] == [1, 2]
@@ -0,0 +1,157 @@
+import datetime
+from decimal import Decimal
+
+from china_bean_importers.common import (
+    SAME_AS_NARRATION,
+    BillDetailMapping as BDM,
+    match_destination_and_metadata,
+)
+from china_bean_importers.ruleindex import rule_id
+from china_bean_importers.rulepack import analyze_rules, load_rule_pack, RuleSet
+
+
+def make_config(*rules, **extra):
+    return {
+        "detail_mappings": list(rules),
+        "unknown_expense_account": "Expenses:Unknown",
+        "unknown_income_account": "Income:Unknown",
+        **extra,
+    }
+
+
+def account(config, desc, payee=None, **kwargs):
+    return match_destination_and_metadata(config, desc, payee, **kwargs)[0]
+
+
+def test_higher_priority_wins():
+    config = make_config(
+        BDM(["京东"], [], "Expenses:Shopping:Online:JD", [], {}),
+        BDM(["京东"], [], "Expenses:Food", [], {}, priority=1),
+    )
+    assert account(config, "京东超市") == "Expenses:Food"
+
+
+def test_deeper_account_wins_at_equal_priority():
+    config = make_config(
+        BDM(["京东"], [], "Expenses:Shopping", [], {}),
+        BDM(["京东"], [], "Expenses:Shopping:JD", [], {}),
+    )
+    assert account(config, "京东超市") == "Expenses:Shopping:JD"
+
+
+def test_earlier_rule_wins_otherwise():
+    config = make_config(
+        BDM(["京东"], [], "Expenses:Shopping", [], {}),
+        BDM(["超市"], [], "Expenses:Groceries", [], {}),
+    )
+    assert account(config, "京东超市") == "Expenses:Shopping"
+
+
+def test_metadata_and_tags_merge_in_rule_order():
+    config = make_config(
+        BDM(["京东"], [], None, ["jd"], {"platform": "京东", "kind": "shop"}),
+        BDM(["超市"], [], "Expenses:Groceries", ["food"], {"kind": "food"}),
+    )
+    found, metadata, tags = match_destination_and_metadata(config, "京东超市", None)
+    assert found == "Expenses:Groceries"
+    assert metadata == {"platform": "京东", "kind": "food"}
+    assert tags == {"PendingReview", "jd", "food"}
+
+
+def test_match_logic_and_payee_keywords():
+    config = make_config(
+        BDM(["午饭"], ["食堂"], "Expenses:Food:Canteen", [], {}, match_logic="AND"),
+        BDM(["饿了么"], SAME_AS_NARRATION, "Expenses:Food:Delivery", [], {}),
+    )
+    assert account(config, "午饭", "食堂") == "Expenses:Food:Canteen"
+    assert account(config, "午饭", "外卖") is None
+    assert account(config, "订单", "饿了么") == "Expenses:Food:Delivery"
+
+
+def test_target_type():
+    config = make_config(
+        BDM(["退款"], [], "Income:Refund", [], {"target_type": "income"}),
+    )
+    assert account(config, "退款", expense=False) == "Income:Refund"
+    assert account(config, "退款", expense=True) is None
+
+
+def test_windows():
+    config = make_config(
+        BDM(["美团"], [], "Expenses:Food", [], {}),
+        BDM(
+            ["美团"],
+            [],
+            "Expenses:Food:Lunch",
+            priority=1,
+            amount_range=(None, 50),
+            time_range=("11:00", "14:00"),
+        ),
+    )
+    lunch = datetime.datetime(2023, 1, 2, 12, 0)
+    assert account(config, "美团", amount=Decimal(-30), when=lunch) == "Expenses:Food:Lunch"
+    assert account(config, "美团", amount=Decimal(-80), when=lunch) == "Expenses:Food"
+    assert (
+        account(config, "美团", amount=Decimal(-30), when=lunch.replace(hour=19))
+        == "Expenses:Food"
+    )
+
+
+def test_rule_packs_follow_detail_mappings(tmp_path):
+    pack = tmp_path / "merchants.csv"
+    pack.write_text(
+        "narration_keywords,payee_keywords,destination_account,tags,metadata,"
+        "priority,match_logic\n"
+        "星巴克,SAME_AS_NARRATION,Expenses:Coffee,coffee,brand=星巴克,0,OR\n"
+        "京东,,Expenses:Shopping:JD,,,0,OR\n",
+        encoding="utf-8",
+    )
+    config = make_config(
+        BDM(["京东"], [], "Expenses:Shopping", [], {}),
+        BDM(["星巴克"], [], "Expenses:Food", [], {}, priority=1),
+        rule_packs=[str(pack)],
+    )
+    found, metadata, tags = match_destination_and_metadata(config, None, "星巴克")
+    assert (found, metadata, tags) == (
+        "Expenses:Coffee",
+        {"brand": "星巴克"},
+        {"PendingReview", "coffee"},
+    )
+    assert account(config, "星巴克") == "Expenses:Food"
+    assert account(config, "京东") == "Expenses:Shopping:JD"
+    # compiled once, loaded from the pack afterwards
+    assert (tmp_path / "merchants.csv.pack").exists()
+
+
+def test_analyze_rules():
+    problems = analyze_rules(
+        RuleSet(
+            [
+                BDM(["京东"], [], "Expenses:Shopping", [], {}, priority=1),
+                BDM(["京东超市"], [], "Expenses:Groceries", [], {}),
+                BDM([], [], "Expenses:Never", [], {}),
+                BDM(["美团"], [], "Expenses:Food", [], {}),
+                BDM(["美团"], [], "Expenses:Travel", [], {}),
+            ]
+        ),
+        "rules",
+    )
+    assert len(problems) == 3
+    assert "rules rule 2" in problems[0] and "shadowed" in problems[0]
+    assert "rules rule 3" in problems[1] and "never match" in problems[1]
+    assert "rules rule 4" in problems[2] and "conflicting account" in problems[2]
+
+
+def test_rule_ids_survive_the_pack(tmp_path):
+    pack = tmp_path / "windows.csv"
+    pack.write_text(
+        "narration_keywords,payee_keywords,destination_account,tags,metadata,"
+        "priority,match_logic,amount_range,time_range,weekdays,days_of_month\n"
+        "美团,,Expenses:Food:Lunch,,,1,OR,-50,11:00-14:00,1|2|3|4|5,\n",
+        encoding="utf-8",
+    )
+    compiled = load_rule_pack(str(pack)).rules
+    reloaded = load_rule_pack(str(pack)).rules
+    assert (tmp_path / "windows.csv.pack").exists()
+    assert reloaded == compiled
+    assert [rule_id(m) for m in reloaded] == [rule_id(m) for m in compiled]
@@ -0,0 +1,13 @@
+from china_bean_importers.common import BillDetailMapping as BDM
+from china_bean_importers.ruleindex import rule_id
+from china_bean_importers.rulestats import RuleStats
+
+
+def test_rules_built_one_after_another_keep_their_own_entries(tmp_path):
+    stats = RuleStats(str(tmp_path / "stats.json"))
+    accounts = [f"Expenses:Shop{i}" for i in range(20)]
+    # each rule is dropped before the next one is built, which may get its id
+    for account in accounts:
+        stats.match(BDM(["咖啡"], [], account, [], {}), "咖啡", None, True)
+    assert set(stats.entries) == {rule_id(BDM(["咖啡"], [], a, [], {})) for a in accounts}
+    assert all(e["hits"] == 1 for e in stats.entries.values())
@@ -0,0 +1,99 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from beancount.core import amount, data
+
+from china_bean_importers.common import BillDetailMapping as BDM
+from china_bean_importers.ruleindex import reclassify, rule_account
+from china_bean_importers.staging import StagingStore
+
+from bills import WECHAT_CONFIG, WECHAT_HEADER
+
+COFFEE = BDM(["咖啡"], [], "Expenses:Coffee", [], {})
+
+
+def make_config(*rules):
+    return {
+        "detail_mappings": list(rules),
+        "unknown_expense_account": "Expenses:Unknown",
+        "unknown_income_account": "Income:Unknown",
+    }
+
+
+def entry(fingerprint, narration, payee, config):
+    return data.Transaction(
+        {"filename": "bill.csv", "lineno": 1, "fingerprint": fingerprint},
+        datetime.date(2023, 1, 2),
+        "*",
+        payee,
+        narration,
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting(
+                "Assets:Cash", amount.Amount(Decimal("-12.50"), "CNY"), None, None, None, None
+            ),
+            data.Posting(
+                rule_account(config, narration, payee, True), None, None, None, None, None
+            ),
+        ],
+    )
+
+
+def add(store, fingerprint, narration, payee, config):
+    store.add("test", [entry(fingerprint, narration, payee, config)], lambda _: None, config)
+
+
+def accounts(store):
+    return dict(store.query("SELECT fingerprint, account FROM rows"))
+
+
+def test_reclassify_added_rule(tmp_path):
+    store = StagingStore(str(tmp_path / "staging.sqlite"))
+    old = make_config()
+    add(store, "a", "咖啡", "店", old)
+    add(store, "b", "午饭", "店", old)
+    changes = reclassify(store, make_config(COFFEE))
+    assert [(c.fingerprint, c.new_account) for c in changes] == [("a", "Expenses:Coffee")]
+    assert accounts(store) == {"a": "Expenses:Coffee", "b": "Expenses:Unknown"}
+    assert reclassify(store, make_config(COFFEE)) == []
+
+
+def test_reclassify_rows_of_each_recorded_rule_set(tmp_path):
+    store = StagingStore(str(tmp_path / "staging.sqlite"))
+    # rows classified with different rule sets, no reclassify in between
+    add(store, "a", "咖啡", "店", make_config())
+    add(store, "b", "咖啡", "店", make_config(COFFEE))
+    changes = reclassify(store, make_config())
+    assert [(c.fingerprint, c.new_account) for c in changes] == [("b", "Expenses:Unknown")]
+    assert accounts(store) == {"a": "Expenses:Unknown", "b": "Expenses:Unknown"}
+
+
+def test_rows_are_staged_before_the_classifier(tmp_path):
+    pytest.importorskip("numpy")
+    from beancount.ingest import cache
+
+    from china_bean_importers import wechat
+    from china_bean_importers.classifier import Classifier
+
+    model = tmp_path / "classifier.npz"
+    Classifier.train([entry("x", "咖啡", "星巴克", make_config(COFFEE))]).save(str(model))
+    bill = tmp_path / "wechat.csv"
+    bill.write_text(
+        WECHAT_HEADER + "2023-01-02 10:00:00,商户消费,星巴克,咖啡豆,支出,¥12.50,"
+        "零钱,支付成功,1001\t,m1,/\n"
+    )
+    config = {
+        **WECHAT_CONFIG,
+        "staging_db": str(tmp_path / "staging.sqlite"),
+        "classifier_model": str(model),
+        "classifier_min_confidence": 0,
+    }
+    importer = wechat.Importer(config)
+    (e,) = importer.extract(cache.get_file(str(bill)), [])
+    # the classifier filled in the account, the store keeps the rules' one
+    assert e.postings[1].account == "Expenses:Coffee"
+    assert importer.staging.query("SELECT account, ruled FROM rows") == [
+        ("Expenses:Unknown", 1)
+    ]